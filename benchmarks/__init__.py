@@ -0,0 +1,5 @@
+"""
+End-to-end benchmarks for the hot API paths.
+
+Run them against a seeded database with ``python manage.py benchmark``.
+"""
@@ -0,0 +1,111 @@
+"""
+Write contention on SQLite.
+
+Several processes, like gunicorn workers, run short write transactions
+against a copy of the database. Each transaction is shaped like a like: read
+whether it exists, insert or delete it, update the post's counter and insert
+a notification. The ``defaults`` variant uses SQLite's rollback journal and
+the deferred ``BEGIN`` Django uses by default. ``tuned`` uses the pragmas of
+``core/sqlite.py`` and ``BEGIN IMMEDIATE``.
+"""
+import multiprocessing
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from .runner import percentile
+
+# Seconds the writer processes get to start before they all begin at once
+START_DELAY = 2.0
+
+
+def _writer(path, statements, begin, transactions, seed, user_ids, post_ids, start_at):
+    rng = random.Random(seed)
+    # Python's default busy timeout, which Django keeps
+    db = sqlite3.connect(path, timeout=5, isolation_level=None)
+    for statement in statements:
+        db.execute(statement)
+    time.sleep(max(0, start_at - time.time()))
+
+    samples = []
+    for _ in range(transactions):
+        user_id, post_id = rng.choice(user_ids), rng.choice(post_ids)
+        started = time.perf_counter()
+        ok = True
+        try:
+            db.execute(begin)
+            liked = db.execute(
+                'SELECT 1 FROM core_like WHERE user_id = ? AND post_id = ?', (user_id, post_id)
+            ).fetchone()
+            if liked:
+                db.execute('DELETE FROM core_like WHERE user_id = ? AND post_id = ?', (user_id, post_id))
+                db.execute('UPDATE core_post SET like_count = MAX(like_count - 1, 0) WHERE id = ?', (post_id,))
+            else:
+                now = time.strftime('%Y-%m-%d %H:%M:%S')
+                db.execute(
+                    'INSERT INTO core_like (user_id, post_id, created_at) VALUES (?, ?, ?)', (user_id, post_id, now)
+                )
+                db.execute('UPDATE core_post SET like_count = like_count + 1 WHERE id = ?', (post_id,))
+                db.execute(
+                    'INSERT INTO core_notification (user_id, from_user_id, post_id, notification_type, text, is_read, created_at) '
+                    "SELECT user_id, ?, id, 'like', 'liked your post', 0, ? FROM core_post WHERE id = ?",
+                    (user_id, now, post_id),
+                )
+            db.execute('COMMIT')
+        except sqlite3.OperationalError:
+            # "database is locked"
+            ok = False
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+        samples.append((time.perf_counter() - started, ok))
+    db.close()
+    return samples, time.time()
+
+
+def copy_database(source, target, journal_mode):
+    source_db, target_db = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        source_db.backup(target_db)
+        target_db.execute(f'PRAGMA journal_mode = {journal_mode}')
+    finally:
+        source_db.close()
+        target_db.close()
+
+
+def run_contention(database, statements, begin, journal_mode, writers=8, transactions=400, seed=42):
+    """``transactions`` spread over ``writers`` processes on a copy of ``database``, summarized"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / 'contention.sqlite3')
+        copy_database(database, path, journal_mode)
+        db = sqlite3.connect(path)
+        user_ids = [row[0] for row in db.execute('SELECT id FROM core_user ORDER BY id LIMIT 1000')]
+        post_ids = [row[0] for row in db.execute('SELECT id FROM core_post ORDER BY id DESC LIMIT 1000')]
+        db.close()
+        if not user_ids or not post_ids:
+            raise ValueError('The database has no users or posts to write likes for')
+
+        per_writer = max(1, transactions // writers)
+        start_at = time.time() + START_DELAY
+        # spawn: forking a process that has threads and open connections is unsafe
+        with multiprocessing.get_context('spawn').Pool(writers) as pool:
+            outcomes = pool.starmap(_writer, [
+                (path, statements, begin, per_writer, seed + number, user_ids, post_ids, start_at)
+                for number in range(writers)
+            ])
+
+    samples = [sample for writer_samples, _ in outcomes for sample in writer_samples]
+    wall = max(finished for _, finished in outcomes) - start_at
+    latencies = sorted(elapsed * 1000 for elapsed, _ in samples)
+    committed = sum(1 for _, ok in samples if ok)
+    return {
+        'requests': len(samples),
+        'concurrency': writers,
+        'errors': len(samples) - committed,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'throughput_rps': round(committed / wall, 2) if wall else None,
+    }
@@ -0,0 +1,83 @@
+"""
+In-process micro-benchmarks for pieces of the request path. Each entry of
+``MICRO_BENCHMARKS`` returns a mapping of variant name -> callable; the
+variants of one benchmark do the same work in different ways.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.fastjson import FastJSONRenderer
+
+
+def _feed_request(user):
+    request = Request(APIRequestFactory().get('/api/posts/', SERVER_NAME='localhost'))
+    request.user = user
+    return request
+
+
+def _feed_posts(user, count):
+    from core.views import PostViewSet
+
+    view = PostViewSet()
+    view.request = _feed_request(user)
+    view.format_kwarg = None
+    return list(view.get_queryset()[:count]), view.request
+
+
+def render_posts(user, count=20):
+    """JSON rendering of a PostSerializer(many=True) feed page"""
+    from core.serializers import PostSerializer
+
+    posts, request = _feed_posts(user, count)
+    data = PostSerializer(posts, many=True, context={'request': request}).data
+    return {
+        'drf_json': lambda: JSONRenderer().render(data),
+        'fast_json': lambda: FastJSONRenderer().render(data),
+    }
+
+
+def serialize_posts(user, count=20):
+    """Fetching and serializing a feed page: full PostSerializer vs the compiled path"""
+    from core.serializers import PostSerializer
+    from core.views import PostViewSet
+
+    view = PostViewSet()
+    view.request = _feed_request(user)
+    view.format_kwarg = None
+    context = view.get_serializer_context()
+    compiled = PostViewSet.get_compiled_serializer()
+
+    return {
+        'full_serializer': lambda: PostSerializer(view.get_queryset()[:count], many=True, context=context).data,
+        'compiled': lambda: compiled.serialize(view.get_queryset().values(*compiled.columns)[:count], context),
+    }
+
+
+def authenticate(user):
+    """Resolving a JWT's user: simplejwt's query per request vs the cached user"""
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from core.authentication import CachedJWTAuthentication, forget_user
+
+    token = str(AccessToken.for_user(user))
+    request = Request(APIRequestFactory().get('/api/posts/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+    simplejwt, cached = JWTAuthentication(), CachedJWTAuthentication()
+
+    def cached_miss():
+        forget_user(user.pk)
+        return cached.authenticate(request)
+
+    return {
+        'simplejwt': lambda: simplejwt.authenticate(request),
+        'cached_miss': cached_miss,
+        'cached_hit': lambda: cached.authenticate(request),
+    }
+
+
+MICRO_BENCHMARKS = {
+    'render_posts': render_posts,
+    'serialize_posts': serialize_posts,
+    'authenticate': authenticate,
+}
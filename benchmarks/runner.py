@@ -0,0 +1,284 @@
+"""
+Timing, targets and reporting for the benchmark suite.
+
+A target knows how to send a ``BenchmarkRequest``: ``InProcessTarget`` goes
+through Django's test client, ``HttpTarget`` talks to a running server such
+as a local gunicorn or daphne started by ``GunicornServer`` or
+``DaphneServer``.
+"""
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.test import Client
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+BASELINE_FILE = Path(__file__).resolve().parent / 'baseline.json'
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+
+class InProcessTarget:
+    def __init__(self, token):
+        self.client = Client(SERVER_NAME='localhost', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def send(self, method, request):
+        if request.json is not None:
+            response = getattr(self.client, method)(request.path, request.json, content_type='application/json')
+        elif request.files:
+            payload = dict(request.data)
+            for field, (filename, content, content_type) in request.files.items():
+                payload[field] = SimpleUploadedFile(filename, content, content_type)
+            response = getattr(self.client, method)(request.path, payload)
+        else:
+            response = getattr(self.client, method)(request.path, request.data or None)
+        return response.status_code, response.content
+
+
+class HttpTarget:
+    def __init__(self, base_url, token, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def send(self, method, request):
+        headers = {'Authorization': f'Bearer {self.token}'}
+        body = None
+        if request.json is not None:
+            body = json.dumps(request.json).encode()
+            headers['Content-Type'] = 'application/json'
+        elif request.files:
+            boundary = uuid.uuid4().hex
+            body = encode_multipart(boundary, request.data, request.files)
+            headers['Content-Type'] = f'multipart/form-data; boundary={boundary}'
+        http_request = urllib.request.Request(
+            self.base_url + request.path, data=body, headers=headers, method=method.upper()
+        )
+        try:
+            with urllib.request.urlopen(http_request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def encode_multipart(boundary, data, files):
+    lines = []
+    for name, value in data.items():
+        lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content, content_type) in files.items():
+        lines.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    lines.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(lines)
+
+
+class ServerProcess:
+    """Start a server on a free local port for the duration of a ``with`` block"""
+    name = None
+
+    def __init__(self, port=None, env=None):
+        self.port = port or free_port()
+        self.env = env or {}
+        self.process = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def command(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            self.command(),
+            cwd=settings.BASE_DIR,
+            env={
+                **os.environ,
+                'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'dekogram_project.settings'),
+                # One user sends every request; measure the endpoints, not the rate limits
+                'DEKOGRAM_RATE_LIMITS': '0',
+                **self.env,
+            },
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'{self.name} exited during startup')
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.5):
+                    return self
+            except OSError:
+                time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError(f'{self.name} did not start within 30 seconds')
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class GunicornServer(ServerProcess):
+    """The sync WSGI application under gunicorn"""
+    name = 'gunicorn'
+
+    def __init__(self, workers=2, threads=1, port=None):
+        super().__init__(port)
+        self.workers = workers
+        self.threads = threads
+
+    def command(self):
+        return [
+            sys.executable, '-m', 'gunicorn', 'dekogram_project.wsgi:application',
+            '--bind', f'127.0.0.1:{self.port}',
+            '--workers', str(self.workers), '--threads', str(self.threads),
+            '--log-level', 'warning',
+        ]
+
+
+class DaphneServer(ServerProcess):
+    """The ASGI application under daphne, with or without the async API views"""
+    name = 'daphne'
+
+    def __init__(self, async_api=True, port=None):
+        super().__init__(port, env={'DEKOGRAM_ASYNC_API': '1' if async_api else '0'})
+
+    def command(self):
+        return [
+            sys.executable, '-m', 'daphne', 'dekogram_project.asgi:application',
+            '--bind', '127.0.0.1', '--port', str(self.port), '-v', '0',
+        ]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_scenario(target, scenario, context, requests=100, warmup=10, concurrency=1):
+    """Send ``requests`` timed requests (after ``warmup`` untimed ones) and summarize them"""
+    created = []
+
+    def one(_):
+        request = scenario.build(context)
+        start = time.perf_counter()
+        status, content = target.send(scenario.method, request)
+        elapsed = time.perf_counter() - start
+        if scenario.cleanup and status < 400:
+            created.append(json.loads(content))
+        return elapsed, status, len(content)
+
+    for i in range(warmup):
+        one(i)
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(one, range(requests)))
+    else:
+        samples = [one(i) for i in range(requests)]
+    wall = time.perf_counter() - started
+
+    if scenario.cleanup:
+        scenario.cleanup(created)
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': sum(1 for _, status, _ in samples if status >= 400),
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'throughput_rps': round(requests / wall, 2) if wall else None,
+        'bytes': round(sum(size for _, _, size in samples) / len(samples)),
+    }
+
+
+def run_micro(variants, repeat=200, warmup=20):
+    """Time each variant callable ``repeat`` times and report latency percentiles"""
+    results = {}
+    for name, func in variants.items():
+        for _ in range(warmup):
+            func()
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            samples.append((time.perf_counter() - start) * 1000)
+        samples.sort()
+        results[name] = {
+            'requests': repeat,
+            'p50_ms': round(percentile(samples, 50), 4),
+            'p95_ms': round(percentile(samples, 95), 4),
+            'p99_ms': round(percentile(samples, 99), 4),
+            'mean_ms': round(sum(samples) / len(samples), 4),
+        }
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': settings.DATABASES['default']['ENGINE'],
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline, threshold=0.10):
+    """
+    Compare p50 latency per target and scenario with the baseline. Returns
+    rows of (key, baseline_ms, current_ms, speedup, regressed).
+    """
+    rows = []
+    for target, scenarios in results.get('targets', {}).items():
+        for name, current in scenarios.items():
+            previous = baseline.get('targets', {}).get(target, {}).get(name)
+            if not previous:
+                continue
+            speedup = previous['p50_ms'] / current['p50_ms'] if current['p50_ms'] else math.inf
+            rows.append((f'{target}/{name}', previous['p50_ms'], current['p50_ms'], speedup, speedup < 1 - threshold))
+    return rows
+
+
+def load_json(path):
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(path, data):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.write('\n')
@@ -0,0 +1,83 @@
+"""
+Benchmark scenarios. Each one describes a single request against the API;
+``build`` receives the run context and returns the request to send.
+"""
+import io
+import random
+
+from PIL import Image
+
+
+class Scenario:
+    def __init__(self, name, method, build, cleanup=None):
+        self.name = name
+        self.method = method
+        self.build = build
+        self.cleanup = cleanup
+
+    def __repr__(self):
+        return f'<Scenario {self.name}>'
+
+
+class BenchmarkRequest:
+    """A method, path and optional payload. ``files`` maps field -> (filename, bytes, content type)."""
+
+    def __init__(self, path, data=None, files=None, json=None):
+        self.path = path
+        self.data = data or {}
+        self.files = files or {}
+        self.json = json
+
+
+def sample_image(size=1600):
+    """A JPEG big enough to go through the resize path on upload"""
+    img = Image.new('RGB', (size, size), (40, 90, 160))
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def _post_id(context):
+    return random.choice(context.post_ids)
+
+
+def _delete_posts(responses):
+    from core.models import Post
+
+    posts = Post.objects.filter(id__in=[r['id'] for r in responses if 'id' in r])
+    for post in posts:
+        post.media.delete(save=False)
+    posts.delete()
+
+
+def _delete_comments(responses):
+    from core.models import Comment
+
+    Comment.objects.filter(id__in=[r['id'] for r in responses if 'id' in r]).delete()
+
+
+SCENARIOS = [
+    Scenario('feed_page_1', 'get', lambda ctx: BenchmarkRequest('/api/posts/?page=1')),
+    Scenario('feed_page_n', 'get', lambda ctx: BenchmarkRequest(f'/api/posts/?page={ctx.page}')),
+    Scenario('feed_previews', 'get', lambda ctx: BenchmarkRequest('/api/posts/?page=1&expand=comments_preview')),
+    Scenario('explore', 'get', lambda ctx: BenchmarkRequest('/api/posts/?type=explore')),
+    Scenario('explore_grid', 'get', lambda ctx: BenchmarkRequest('/api/posts/?type=explore&fields=id,media,media_type')),
+    Scenario('stories', 'get', lambda ctx: BenchmarkRequest('/api/stories/')),
+    Scenario('profile', 'get', lambda ctx: BenchmarkRequest(f'/api/users/{random.choice(ctx.usernames)}/')),
+    Scenario('profile_page', 'get', lambda ctx: BenchmarkRequest(f'/profile/{random.choice(ctx.usernames)}/')),
+    Scenario('search_typeahead', 'get', lambda ctx: BenchmarkRequest(
+        f'/api/users/search/?q={random.choice(ctx.usernames)[:random.randint(2, 5)]}'
+    )),
+    Scenario('comments', 'get', lambda ctx: BenchmarkRequest(f'/api/posts/{_post_id(ctx)}/comments/')),
+    Scenario('like_toggle', 'post', lambda ctx: BenchmarkRequest(f'/api/posts/{_post_id(ctx)}/like/')),
+    Scenario('comment_post', 'post', lambda ctx: BenchmarkRequest(
+        f'/api/posts/{_post_id(ctx)}/comments/', json={'text': 'Benchmark comment'}
+    ), cleanup=_delete_comments),
+    Scenario('upload', 'post', lambda ctx: BenchmarkRequest(
+        '/api/posts/',
+        data={'caption': 'Benchmark upload', 'location': 'Tashkent'},
+        files={'media': ('benchmark.jpg', ctx.image, 'image/jpeg')},
+    ), cleanup=_delete_posts),
+]
+
+SCENARIOS_BY_NAME = {scenario.name: scenario for scenario in SCENARIOS}
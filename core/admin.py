@@ -32,12 +32,14 @@ class PostAdmin(admin.ModelAdmin):
     ordering = ('-created_at',)
     
     def likes_count(self, obj):
-        return obj.likes.count()
+        return obj.like_count
     likes_count.short_description = 'Likes'
+    likes_count.admin_order_field = 'like_count'
     
     def comments_count(self, obj):
-        return obj.comments.count()
+        return obj.comment_count
     comments_count.short_description = 'Comments'
+    comments_count.admin_order_field = 'comment_count'
 
 
 @admin.register(Story)
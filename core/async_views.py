@@ -0,0 +1,239 @@
+"""
+Async versions of the read-heavy API endpoints, for ASGI servers.
+
+With ``ASYNC_API`` on (``asgi.py`` turns it on by default), GET requests
+to the feed/explore, stories, notifications, profile and user search
+endpoints are answered by the coroutines below. They reuse the viewsets'
+querysets, ETags, compiled serializers, pagination and rendering, so the
+responses are identical, but the request stays on the event loop and
+independent queries are awaited together with ``asyncio.gather``: a page
+and its total count, or a profile's counts.
+
+Anything these views do not handle falls back to the sync DRF view: other
+methods, the browsable API, failed authentication, invalid pages and
+unknown users (so errors look exactly as before). Reads go to a replica
+under the same rules as the sync views (core/replicas.py).
+
+Django 5.2 runs each async ORM call through ``sync_to_async`` on the
+request's own database thread, so gathered queries overlap with each
+other's Python work rather than hitting the database in parallel.
+"""
+import asyncio
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.db.models import Q
+from django.urls import URLPattern
+from rest_framework import exceptions
+from rest_framework.response import Response
+
+from . import follow_cache, versions
+from .fastjson import FastJSONRenderer
+from .models import User, Post, Follow
+from .replicas import ReplicaReadMixin, replica_settings
+from .serializers import UserShortSerializer, parse_field_list
+from .views import PostViewSet, StoryViewSet, NotificationViewSet, UserViewSet
+
+
+async def fetch(queryset):
+    return [row async for row in queryset]
+
+
+class AsyncEndpoint:
+    """
+    Wraps the routed sync view of one viewset action and answers its GET
+    requests with ``handle()``, which returns None to fall back.
+    """
+    viewset = None
+
+    def __init__(self, sync_view):
+        self.sync_view = sync_view
+        # DRF views enforce CSRF themselves, for session users only
+        self.csrf_exempt = True
+        markcoroutinefunction(self)
+
+    async def __call__(self, request, *args, **kwargs):
+        if request.method == 'GET':
+            view = self.initialize(request, args, kwargs)
+            if view is not None and await self.authenticate(view):
+                await self.route_reads(view)
+                response = await self.handle(view, *args, **kwargs)
+                if response is not None:
+                    return self.finalize(view, response)
+        return await sync_to_async(self.sync_view)(request, *args, **kwargs)
+
+    def initialize(self, request, args, kwargs):
+        """A viewset instance set up the way DRF's dispatch() would, or None for a non-JSON response"""
+        view = self.viewset(**self.sync_view.initkwargs)
+        view.action_map = self.sync_view.actions
+        view.args, view.kwargs = args, kwargs
+        view.format_kwarg = view.get_format_suffix(**kwargs)
+        view.request = view.initialize_request(request, *args, **kwargs)
+        view.headers = view.default_response_headers
+        try:
+            renderer, media_type = view.perform_content_negotiation(view.request)
+        except exceptions.NotAcceptable:
+            return None
+        if not isinstance(renderer, FastJSONRenderer):
+            return None
+        view.request.accepted_renderer, view.request.accepted_media_type = renderer, media_type
+        return view
+
+    async def authenticate(self, view):
+        def user():
+            try:
+                return view.request.user
+            except exceptions.APIException:
+                return None
+        # DRF's authenticators are sync; this runs them with their exact semantics
+        user = await sync_to_async(user)()
+        return user is not None and user.is_authenticated
+
+    async def route_reads(self, view):
+        if replica_settings()['ALIASES'] and isinstance(view, ReplicaReadMixin):
+            # Checks the user's pin in the cache
+            await sync_to_async(view.route_reads)(view.request)
+
+    async def handle(self, view, *args, **kwargs):
+        raise NotImplementedError
+
+    async def etag_response(self, view, keys):
+        """The ETag for ``keys`` and a 304 response if the client has it"""
+        if not versions.etags_enabled:
+            return None, None
+        etag = await sync_to_async(view.etag_for)(view.request, keys)
+        return etag, view.not_modified(view.request, etag)
+
+    def finalize(self, view, response):
+        response = view.finalize_response(view.request, response)
+        return response.render()
+
+
+class AsyncListEndpoint(AsyncEndpoint):
+    """list() of a CompiledListMixin viewset with its ETag and page-number pagination"""
+
+    async def version_keys(self, view):
+        return view.get_version_keys()
+
+    def needs_following(self, view):
+        """Whether the queryset filters by the viewer's follow set"""
+        return False
+
+    async def load_following(self, view):
+        # A cache miss queries, so load the set here rather than in the ETag or get_queryset() on the loop
+        if self.needs_following(view):
+            view.following = await follow_cache.afollowing_ids(view.request.user.id)
+
+    async def handle(self, view, *args, **kwargs):
+        query_params = view.request.query_params
+        fields = parse_field_list(query_params['fields']) if 'fields' in query_params else None
+        compiled = view.get_compiled_serializer(fields, parse_field_list(query_params.get('expand')))
+        try:
+            columns = compiled.columns
+        except TypeError:
+            return None
+
+        await self.load_following(view)
+        etag, not_modified = await self.etag_response(view, await self.version_keys(view))
+        if not_modified is not None:
+            return not_modified
+
+        rows = view.filter_queryset(view.get_queryset()).values(*columns)
+        page = await self.paginate(view, rows)
+        if page is None:
+            return None
+        data = compiled.serialize(await self.prepare_rows(view, page), view.get_serializer_context())
+        return view.add_etag(view.paginator.get_paginated_response(data), etag)
+
+    async def prepare_rows(self, view, page):
+        return view.prepare_rows(page)
+
+    async def paginate(self, view, rows):
+        """Fetch the requested page and the total count together; None for pages the sync view must reject"""
+        bounds = view.page_bounds()
+        if bounds is None:
+            return None
+        number, page_size = bounds
+        offset = (number - 1) * page_size
+        count, results = await asyncio.gather(rows.acount(), fetch(rows[offset:offset + page_size]))
+        return view.set_page(rows, number, page_size, count, results)
+
+
+class PostList(AsyncListEndpoint):
+    viewset = PostViewSet
+
+    def needs_following(self, view):
+        return view.request.query_params.get('type') != 'explore'
+
+    async def prepare_rows(self, view, page):
+        if page and 'comments_preview' in page[0]:
+            # Previews missing from the cache are loaded from the database
+            return await sync_to_async(view.prepare_rows)(page)
+        return view.prepare_rows(page)
+
+
+class StoryList(AsyncListEndpoint):
+    viewset = StoryViewSet
+
+    def needs_following(self, view):
+        return True
+
+
+class NotificationList(AsyncListEndpoint):
+    viewset = NotificationViewSet
+
+
+class UserDetail(AsyncEndpoint):
+    """The profile, with its counts fetched as separate concurrent queries"""
+    viewset = UserViewSet
+
+    async def handle(self, view, username=None, **kwargs):
+        viewer = view.request.user
+        profile = await User.objects.filter(username=username).afirst()
+        if profile is None:
+            return None
+        etag, not_modified = await self.etag_response(view, [f'profile:{profile.id}', f'feed:{viewer.id}'])
+        if not_modified is not None:
+            return not_modified
+
+        counts = {
+            'followers_count': Follow.objects.filter(followed=profile).acount,
+            'following_count': Follow.objects.filter(follower=profile).acount,
+            'posts_count': Post.objects.filter(user=profile).acount,
+            'is_following': Follow.objects.filter(followed=profile, follower=viewer).aexists,
+        }
+        wanted = [name for name in counts if name in view.rendered_fields()]
+        for name, value in zip(wanted, await asyncio.gather(*(counts[name]() for name in wanted))):
+            setattr(profile, name, value)
+        return view.add_etag(Response(view.get_serializer(profile).data), etag)
+
+
+class UserSearch(AsyncEndpoint):
+    viewset = UserViewSet
+
+    async def handle(self, view, **kwargs):
+        query = view.request.query_params.get('q', '')
+        users = await fetch(User.objects.filter(
+            Q(username__icontains=query) | Q(full_name__icontains=query)
+        ).exclude(id=view.request.user.id)[:20])
+        return Response(UserShortSerializer(users, many=True).data)
+
+
+# Router URL names served asynchronously
+ENDPOINTS = {
+    'post-list': PostList,
+    'story-list': StoryList,
+    'notification-list': NotificationList,
+    'user-detail': UserDetail,
+    'user-search': UserSearch,
+}
+
+
+def async_urls(patterns):
+    """Router URL patterns with the views of ``ENDPOINTS`` wrapped in their async versions"""
+    wrapped = []
+    for pattern in patterns:
+        endpoint = ENDPOINTS.get(getattr(pattern, 'name', None))
+        if endpoint is not None:
+            pattern = URLPattern(pattern.pattern, endpoint(pattern.callback), pattern.default_args, pattern.name)
+        wrapped.append(pattern)
+    return wrapped
@@ -0,0 +1,103 @@
+"""
+API authentication that reads the signed-in user from the cache.
+
+simplejwt's ``JWTAuthentication`` and DRF's ``SessionAuthentication`` load
+the whole ``User`` row on every request. The classes here keep a few of
+its columns (``CACHED_FIELDS``) in the default cache for
+``AUTH_USER_CACHE_TTL`` seconds and build the user from them, so a request
+only queries the database on a miss. The other fields are deferred: reading
+one costs a query, as with ``.only()``.
+
+Saving or deleting a user drops their entry (``core/signals.py``), so a
+deactivation or password change applies on the next request. The session
+class keeps Django's checks: the session must name ``ModelBackend`` and
+carry the user's current session hash, otherwise it falls back to
+``SessionAuthentication``.
+"""
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import SessionAuthentication
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+CACHED_FIELDS = (
+    'id', 'username', 'full_name', 'avatar', 'is_private', 'is_verified',
+    'is_active', 'is_staff', 'is_superuser',
+)
+# In model order, as Model.from_db() expects
+ATTNAMES = [field.attname for field in User._meta.concrete_fields if field.attname in CACHED_FIELDS]
+
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
+def user_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def cached_user(user_id):
+    """``(user, session hash)`` of ``user_id``, or ``(None, None)`` if there is no such user"""
+    key = user_key(user_id)
+    entry = cache.get(key)
+    if entry is None:
+        row = User.objects.filter(pk=user_id).values_list(*ATTNAMES, 'password').first()
+        if row is None:
+            return None, None
+        # The hash is a keyed HMAC of the password, so the password itself is not cached
+        entry = (row[:-1], User(password=row[-1]).get_session_auth_hash())
+        cache.set(key, entry, getattr(settings, 'AUTH_USER_CACHE_TTL', 60))
+    values, session_hash = entry
+    return User.from_db('default', ATTNAMES, values), session_hash
+
+
+def forget_user(user_id):
+    cache.delete(user_key(user_id))
+    if connection.in_atomic_block:
+        # A request may cache the old row before this write commits
+        transaction.on_commit(lambda: cache.delete(user_key(user_id)))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """``JWTAuthentication`` with the user read from the cache"""
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN or api_settings.USER_ID_FIELD != 'id':
+            # Needs the password hash, or a lookup the cache is not keyed by
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        user, _hash = cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return user
+
+
+class CachedSessionAuthentication(SessionAuthentication):
+    """``SessionAuthentication`` with the session's user read from the cache"""
+
+    def authenticate(self, request):
+        session = getattr(request._request, 'session', None)
+        user_id = session.get(SESSION_KEY) if session is not None else None
+        if user_id is None or session.get(BACKEND_SESSION_KEY) != MODEL_BACKEND:
+            return super().authenticate(request)
+
+        user, session_hash = cached_user(User._meta.pk.to_python(user_id))
+        if user is None or not user.is_active or not constant_time_compare(session.get(HASH_SESSION_KEY) or '', session_hash):
+            # Let django.contrib.auth decide, and flush the session if it must
+            return super().authenticate(request)
+
+        self.enforce_csrf(request)
+        # What AuthenticationMiddleware's lazy user would have loaded
+        request._request.user = user
+        return (user, None)
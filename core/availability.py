@@ -0,0 +1,172 @@
+"""
+Username availability, answered from a Bloom filter.
+
+Server processes (``start_name_filter()`` in wsgi.py/asgi.py) keep every
+taken username in a Bloom filter of ``NAME_FILTER['ERROR_RATE']``
+false positives. A name the filter has never seen is free, with no query;
+one it may have seen is checked with a single lookup on its unique index.
+Elsewhere (tests, commands) every check goes to the database.
+
+The filter is built from ``User`` in a background thread when the server
+starts, and rebuilt the same way after ``TTL`` seconds or once it holds
+more names than it was sized for, since a Bloom filter cannot forget a name
+or grow. Checks never wait for a build: until the first one finishes they
+go to the database, and during a rebuild they use the old filter. A saved user's name is added in
+this process at once and, once committed, in every worker on the host
+through the bus of ``core/follow_cache.py``. A lost message only makes
+another worker report a taken name as free until its next rebuild;
+registration itself relies on the unique constraints, not on this check.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+
+from . import follow_cache
+from .models import User
+
+logger = logging.getLogger(__name__)
+DEFAULTS = {
+    'ERROR_RATE': 0.01,  # false positives, each costing one indexed lookup
+    'TTL': 600,  # seconds between rebuilds
+    'HEADROOM': 1.5,  # capacity as a multiple of the names at build time
+}
+
+TOPIC = 'names'
+FIELDS = ('username',)
+
+
+def name_filter_settings():
+    return {**DEFAULTS, **getattr(settings, 'NAME_FILTER', {})}
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(capacity, 1024)
+        # The optimal size and hash count for ``capacity`` items at ``error_rate``
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, value):
+        # k positions from two 64-bit halves of one digest (Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(value))
+
+
+def name_key(field, value):
+    return f'{field}:{value}'
+
+
+class NameFilter:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.filter = None
+        self.built_at = 0.0
+        # Names added while a rebuild reads the table, replayed into the new filter
+        self.added_during_build = None
+
+    def current(self):
+        """The filter, or None before the first build; starts a rebuild when it is stale"""
+        bloom = self.filter
+        config = name_filter_settings()
+        if bloom is None or time.monotonic() - self.built_at > config['TTL'] or bloom.count > bloom.capacity:
+            self.rebuild_in_background()
+        return bloom
+
+    def rebuild_in_background(self):
+        with self.lock:
+            if self.added_during_build is not None:
+                # Already rebuilding
+                return
+            self.added_during_build = []
+        threading.Thread(target=self._rebuild, name='name-filter', daemon=True).start()
+
+    def _rebuild(self):
+        try:
+            self.rebuild(name_filter_settings())
+        except Exception:
+            logger.exception('Could not build the name filter')
+            with self.lock:
+                self.added_during_build = None
+        finally:
+            connections.close_all()
+
+    def rebuild(self, config):
+        with self.lock:
+            if self.added_during_build is None:
+                self.added_during_build = []
+        rows = User.objects.values_list(*FIELDS).order_by()
+        names = [name_key(field, value) for row in rows.iterator(chunk_size=2000) for field, value in zip(FIELDS, row)]
+        bloom = BloomFilter(int(len(names) * config['HEADROOM']), config['ERROR_RATE'])
+        for key in names:
+            bloom.add(key)
+        with self.lock:
+            for key in self.added_during_build:
+                bloom.add(key)
+            self.filter, self.built_at, self.added_during_build = bloom, time.monotonic(), None
+
+    def add(self, keys):
+        with self.lock:
+            if self.filter is not None:
+                for key in keys:
+                    self.filter.add(key)
+            if self.added_during_build is not None:
+                self.added_during_build.extend(keys)
+
+    def may_contain(self, key):
+        bloom = self.current()
+        return bloom is None or key in bloom
+
+
+names = NameFilter()
+
+
+def _received(payload):
+    names.add(payload.split('\n'))
+
+
+def start_name_filter():
+    """Answer availability checks from the filter in this process. Called by the server entry points."""
+    if names.enabled:
+        return
+    # The bus start_follow_cache() set up, so call that first
+    follow_cache.bus.subscribe(TOPIC, _received)
+    names.enabled = True
+    names.rebuild_in_background()
+
+
+def names_taken(user):
+    """Record ``user``'s username and email here now, and in every worker once committed"""
+    keys = [name_key(field, getattr(user, field)) for field in FIELDS if getattr(user, field)]
+    if not names.enabled or not keys:
+        return
+    names.add(keys)
+    transaction.on_commit(lambda: follow_cache.bus.publish(TOPIC, '\n'.join(keys)))
+
+
+def check(username):
+    """``(available, error)`` of ``username`` for a new account"""
+    try:
+        User._meta.get_field('username').run_validators(username)
+    except ValidationError as e:
+        return False, ' '.join(e.messages)
+    if names.enabled and not names.may_contain(name_key('username', username)):
+        return True, None
+    return not User.objects.filter(username=username).exists(), None
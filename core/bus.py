@@ -0,0 +1,109 @@
+"""
+Best-effort publish/subscribe between the worker processes of one host.
+
+    bus.subscribe('follows', lambda payload: ...)
+    bus.publish('follows', '42')
+
+``LocalBus`` only reaches the current process. ``SocketBus`` is a stand-in
+for Redis pub/sub on a single machine: every process binds a Unix datagram
+socket in a shared directory, and ``publish()`` sends one datagram to each
+socket there. Messages to dead or busy processes are dropped, so
+subscribers must tolerate missed messages (the follow cache expires its
+entries for that reason).
+"""
+import logging
+import os
+import socket
+import tempfile
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE = 4096
+
+
+class LocalBus:
+    def __init__(self):
+        self.handlers = {}
+
+    def subscribe(self, topic, handler):
+        self.handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic, payload):
+        self.dispatch(topic, payload)
+
+    def dispatch(self, topic, payload):
+        for handler in self.handlers.get(topic, ()):
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception('Bus handler for %r failed', topic)
+
+    def start(self):
+        pass
+
+
+class SocketBus(LocalBus):
+    def __init__(self, directory=None):
+        super().__init__()
+        self.directory = Path(directory or Path(tempfile.gettempdir()) / 'dekogram-bus')
+        self.sock = None
+        self.path = None
+        self._thread = None
+
+    def start(self):
+        if self.sock is not None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / f'{os.getpid()}.sock'
+        self.path.unlink(missing_ok=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(str(self.path))
+        self._thread = threading.Thread(target=self._receive, args=(self.sock,), name='bus', daemon=True)
+        self._thread.start()
+
+    def publish(self, topic, payload):
+        # This process directly, the others through their sockets
+        self.dispatch(topic, payload)
+        message = f'{topic} {payload}'.encode()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.setblocking(False)
+            for path in self.directory.glob('*.sock'):
+                if path == self.path:
+                    continue
+                try:
+                    sender.sendto(message, str(path))
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Left behind by a process that exited
+                    path.unlink(missing_ok=True)
+                except OSError:
+                    # A full receive buffer; the subscriber will catch up by expiry
+                    pass
+
+    def _receive(self, sock):
+        while True:
+            try:
+                message = sock.recv(MAX_MESSAGE)
+            except OSError:
+                return
+            if not message:
+                # Shut down by stop()
+                return
+            topic, _, payload = message.decode().partition(' ')
+            self.dispatch(topic, payload)
+
+    def stop(self):
+        if self.sock is not None:
+            self.sock.shutdown(socket.SHUT_RDWR)
+            self.sock.close()
+            self.sock = None
+            self.path.unlink(missing_ok=True)
+
+    def _after_fork(self):
+        # The socket and thread belong to the parent; a started bus restarts under the child's pid
+        was_started = self.sock is not None
+        self.sock = None
+        self._thread = None
+        if was_started:
+            self.start()
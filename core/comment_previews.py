@@ -0,0 +1,77 @@
+"""
+Cached previews of each post's newest comments, for embedding in feeds.
+
+``?expand=comments_preview`` on the post endpoints adds the
+``PREVIEW_SIZE`` newest top-level comments to every post. A page of posts
+reads all its previews with one ``get_many`` from the default cache, and
+loads the missing ones with a single query.
+
+The cache holds ``values()`` rows rather than rendered JSON, so media URLs
+are still built for the current request. Any comment written or deleted on
+a post drops its preview. A commenter's later profile changes show up once
+the preview expires after ``PREVIEW_TIMEOUT`` seconds.
+"""
+from functools import reduce
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import OuterRef, Q, Subquery
+
+from .models import Comment, Post
+from .serializers import CommentSerializer, CompiledSerializer
+
+PREVIEW_SIZE = 2
+PREVIEW_TIMEOUT = 60 * 5
+PREVIEW_FIELDS = ['id', 'user', 'text', 'created_at']
+
+serializer = CompiledSerializer(CommentSerializer, fields=PREVIEW_FIELDS)
+
+
+def preview_key(post_id):
+    return f'comment-preview:{post_id}'
+
+
+def load(post_ids):
+    """Uncached preview rows, ``{post_id: [row, ...]}``"""
+    newest = Comment.objects.filter(post_id=OuterRef('pk'), parent=None).order_by('-created_at', '-id').values('id')
+    # The n-th newest comment of each post is one LIMIT 1 OFFSET n seek on
+    # comment_top_level_idx, however many comments the post has
+    ranks = [
+        Q(pk__in=Post.objects.filter(pk__in=post_ids).values(comment_id=Subquery(newest[n:n + 1])))
+        for n in range(PREVIEW_SIZE)
+    ]
+    comments = Comment.objects.filter(reduce(Q.__or__, ranks)).order_by()
+    rows = {post_id: [] for post_id in post_ids}
+    loaded = comments.values('post_id', *serializer.columns)
+    # Newest first, without making the database sort
+    for row in sorted(loaded, key=lambda row: (row['created_at'], row['id']), reverse=True):
+        rows[row.pop('post_id')].append(row)
+    return rows
+
+
+def preview_rows(post_ids):
+    """Preview rows of ``post_ids``: one cache read, and one query for those not cached"""
+    keys = {post_id: preview_key(post_id) for post_id in dict.fromkeys(post_ids)}
+    cached = cache.get_many(keys.values())
+    rows = {post_id: cached[key] for post_id, key in keys.items() if key in cached}
+    missing = [post_id for post_id in keys if post_id not in rows]
+    if missing:
+        loaded = load(missing)
+        cache.set_many({keys[post_id]: loaded[post_id] for post_id in missing}, PREVIEW_TIMEOUT)
+        rows.update(loaded)
+    return rows
+
+
+def previews(post_ids, context):
+    """Rendered previews, ``{post_id: [comment, ...]}``"""
+    return {
+        post_id: serializer.serialize(rows, context)
+        for post_id, rows in preview_rows(post_ids).items()
+    }
+
+
+def invalidate(post_id):
+    cache.delete(preview_key(post_id))
+    if connection.in_atomic_block:
+        # A reader may cache the old comments before this write commits
+        transaction.on_commit(lambda: cache.delete(preview_key(post_id)))
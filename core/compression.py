@@ -0,0 +1,195 @@
+"""
+Compressed static assets and API responses.
+
+``CompressedManifestStaticFilesStorage`` fingerprints files during
+``collectstatic`` (``app.js`` -> ``app.3f2a9c81e0b4.js``) and writes ``.gz``
+and, when the ``brotli`` package is installed, ``.br`` copies next to every
+compressible file.
+
+``StaticFilesMiddleware`` serves ``STATIC_ROOT`` in production. It picks the
+best precompressed variant the client accepts, so static files are
+never compressed at request time, and marks fingerprinted files as
+immutable.
+
+``APIGZipMiddleware`` gzips JSON responses above
+``COMPRESSION['API_MIN_LENGTH']`` bytes.
+"""
+import gzip
+import json
+import mimetypes
+import os
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.http import FileResponse
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - exercised only without brotli
+    brotli = None
+
+DEFAULTS = {
+    'API_MIN_LENGTH': 1024,
+    'STATIC_MAX_AGE': 60,
+}
+
+# Already-compressed formats (images, video, fonts) only get bigger
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico'}
+
+# Preferred first; the file suffix and Content-Encoding of each variant
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+
+def compression_settings():
+    return {**DEFAULTS, **getattr(settings, 'COMPRESSION', {})}
+
+
+def compress_file(path):
+    """Write .gz/.br copies of ``path`` when they come out smaller. Returns their paths."""
+    path = Path(path)
+    data = path.read_bytes()
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    written = []
+    for suffix, compressed in variants.items():
+        target = path.with_name(path.name + suffix)
+        if len(compressed) < len(data):
+            target.write_bytes(compressed)
+            written.append(target)
+        elif target.exists():
+            target.unlink()
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        processed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            processed_names.add(name)
+            if hashed_name:
+                processed_names.add(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for name in sorted(processed_names):
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                compress_file(self.path(name))
+
+    def stored_name(self, name):
+        # Before the first collectstatic there is no manifest; keep plain URLs
+        # instead of failing every template that uses {% static %}
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+
+def accepted_encodings(header):
+    """Encodings from an Accept-Encoding header, minus those with q=0"""
+    accepted = set()
+    for item in header.split(','):
+        coding, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class StaticFilesMiddleware:
+    """
+    Serve collected static files with precompressed variants. Requests for
+    anything not in STATIC_ROOT fall through, so ``runserver`` still serves
+    the source directories in development.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.prefix = settings.STATIC_URL
+        self.root = Path(settings.STATIC_ROOT) if settings.STATIC_ROOT else None
+        self.max_age = compression_settings()['STATIC_MAX_AGE']
+        self.files, self.immutable = self.scan()
+
+    def scan(self):
+        """Map every collected file to its encodings, read once at startup"""
+        files = {}
+        if self.root is None or not self.root.is_dir():
+            return files, set()
+        suffixes = {suffix: encoding for encoding, suffix in ENCODINGS}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                name = path.relative_to(self.root).as_posix()
+                base, suffix = os.path.splitext(name)
+                if suffix in suffixes and (self.root / base).exists():
+                    files.setdefault(base, {})[suffixes[suffix]] = path
+                else:
+                    files.setdefault(name, {})[None] = path
+        immutable = set()
+        manifest = self.root / 'staticfiles.json'
+        if manifest.exists():
+            immutable = set(json.loads(manifest.read_text()).get('paths', {}).values())
+        return files, immutable
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.match(request)
+        return response if response is not None else self.get_response(request)
+
+    async def __acall__(self, request):
+        response = self.match(request)
+        return response if response is not None else await self.get_response(request)
+
+    def match(self, request):
+        """The response for a collected file, or None"""
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefix):
+            variants = self.files.get(request.path[len(self.prefix):])
+            if variants and None in variants:
+                return self.serve(request, request.path[len(self.prefix):], variants)
+        return None
+
+    def serve(self, request, name, variants):
+        accepted = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+        encoding = next(
+            (encoding for encoding, _ in ENCODINGS if encoding in variants and (encoding in accepted or '*' in accepted)),
+            None,
+        )
+        content_type, _ = mimetypes.guess_type(name)
+        response = FileResponse(open(variants[encoding], 'rb'), content_type=content_type or 'application/octet-stream')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if len(variants) > 1:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        if name in self.immutable:
+            response['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+        else:
+            response['Cache-Control'] = f'public, max-age={self.max_age}'
+        return response
+
+
+class APIGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware for JSON responses only, and only above a size threshold"""
+
+    def process_response(self, request, response):
+        if not response.get('Content-Type', '').startswith('application/json'):
+            return response
+        if not response.streaming and len(response.content) < compression_settings()['API_MIN_LENGTH']:
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,248 @@
+"""
+Denormalized engagement counters with a write-behind buffer.
+
+``Post.like_count``, ``Post.comment_count``, ``Comment.reply_count`` and
+``Story.view_count`` are kept up to date by the signal handlers in ``core.signals``, so reads no
+longer join and count likes, comments and views.
+
+In a server process (``wsgi.py``/``asgi.py`` call ``start_flusher()``), a
+new like only adds +1 to an in-memory buffer. A background thread writes all
+pending deltas every ``COUNTERS['FLUSH_INTERVAL']`` seconds with one
+``UPDATE ... SET like_count = like_count + CASE id WHEN ... END`` per
+table, so a viral post costs one row update per interval instead of one
+per like. Increments are relative, so several workers flushing into the
+same rows are safe. Reads in the same process add the pending deltas
+(``merge_pending``). Pending deltas are flushed at exit, which covers the
+graceful shutdown of gunicorn and daphne workers.
+
+Without a running flusher (tests, management commands, the shell) every
+delta is written straight away instead.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import defaultdict
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Post, Story, Like, Comment, StoryView
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WRITE_BEHIND': True,
+    'FLUSH_INTERVAL': 0.25,
+}
+
+# Counter column -> (related model, foreign key to the counted row)
+COUNTERS = {
+    Post: {'like_count': (Like, 'post'), 'comment_count': (Comment, 'post')},
+    Comment: {'reply_count': (Comment, 'parent')},
+    Story: {'view_count': (StoryView, 'story')},
+}
+
+
+def counter_settings():
+    return {**DEFAULTS, **getattr(settings, 'COUNTERS', {})}
+
+
+def write_deltas(deltas):
+    """Apply ``{(model, pk, field): delta}`` with one UPDATE per model. Returns the touched pks per model."""
+    by_model = defaultdict(lambda: defaultdict(dict))
+    for (model, pk, field), delta in deltas.items():
+        if delta:
+            by_model[model][field][pk] = delta
+    touched = {}
+    # Joins the caller's transaction; a single UPDATE needs none of its own
+    with transaction.atomic(savepoint=False) if len(by_model) > 1 else nullcontext():
+        for model, fields in by_model.items():
+            pks = set()
+            updates = {}
+            for field, per_pk in fields.items():
+                pks.update(per_pk)
+                # Clamped, so a count that drifted low cannot break the CHECK >= 0
+                updates[field] = Greatest(F(field) + Case(
+                    *[When(pk=pk, then=Value(delta)) for pk, delta in per_pk.items()],
+                    default=Value(0), output_field=IntegerField(),
+                ), Value(0))
+            model.objects.filter(pk__in=pks).update(**updates)
+            touched[model] = pks
+    return touched
+
+
+def bump_versions(touched):
+    """Counts changed in the database; other processes' ETags must change too"""
+    from .signals import VersionBatch
+
+    batch = VersionBatch()
+    batch.add_posts(touched.get(Post, ()))
+    batch.add_stories(touched.get(Story, ()))
+    batch.send()
+
+
+class CounterBuffer:
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = defaultdict(int)
+        # Deltas being written; reads still count them until the write is done
+        self.inflight = {}
+        self.running = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, model, pk, field, delta=1):
+        with self.lock:
+            self.pending[(model, pk, field)] += delta
+
+    def get(self, model, pk, field):
+        key = (model, pk, field)
+        with self.lock:
+            return self.pending.get(key, 0) + self.inflight.get(key, 0)
+
+    def snapshot(self, model, field):
+        """Pending deltas of one counter, ``{pk: delta}``"""
+        with self.lock:
+            merged = defaultdict(int)
+            for source in (self.inflight, self.pending):
+                for (m, pk, f), delta in source.items():
+                    if m is model and f == field:
+                        merged[pk] += delta
+            return merged
+
+    def flush(self):
+        """Write all pending deltas. Returns how many counters were written."""
+        with self.lock:
+            if not self.pending:
+                return 0
+            self.inflight, self.pending = self.pending, defaultdict(int)
+        try:
+            touched = write_deltas(self.inflight)
+        except Exception:
+            # Keep the deltas for the next attempt
+            with self.lock:
+                for key, delta in self.inflight.items():
+                    self.pending[key] += delta
+                self.inflight = {}
+            raise
+        with self.lock:
+            count, self.inflight = len(self.inflight), {}
+        bump_versions(touched)
+        return count
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='counter-flusher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flusher thread and write whatever is left"""
+        if self.running:
+            self.running = False
+            self._stop.set()
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        from django.db import connection
+
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Counter flush failed; will retry')
+            finally:
+                connection.close_if_unusable_or_obsolete()
+        connection.close()
+
+    def _after_fork(self):
+        # The child starts empty; the parent still owns and flushes its deltas
+        was_running = self.running
+        self.lock = threading.Lock()
+        self.pending = defaultdict(int)
+        self.inflight = {}
+        self.running = False
+        self._stop = threading.Event()
+        self._thread = None
+        if was_running:
+            self.start()
+
+
+buffer = CounterBuffer(counter_settings()['FLUSH_INTERVAL'])
+os.register_at_fork(after_in_child=buffer._after_fork)
+
+
+def start_flusher():
+    """Switch this process to write-behind counting. Called by the server entry points."""
+    if counter_settings()['WRITE_BEHIND'] and not buffer.running:
+        buffer.flush_interval = counter_settings()['FLUSH_INTERVAL']
+        buffer.start()
+        atexit.register(buffer.stop)
+
+
+def increment(model, pk, field, delta=1):
+    """Count ``delta`` on ``model.field`` for row ``pk``, buffered when a flusher is running"""
+    increment_all({(model, pk, field): delta})
+
+
+def increment_all(deltas):
+    """``increment`` for ``{(model, pk, field): delta}``, written as one UPDATE per table when unbuffered"""
+    if buffer.running:
+        # Only committed writes count
+        def add():
+            for (model, pk, field), delta in deltas.items():
+                buffer.add(model, pk, field, delta)
+        transaction.on_commit(add)
+    elif deltas:
+        write_deltas(deltas)
+
+
+def current(model, pk, field):
+    """The counter as this process sees it: database value plus pending deltas"""
+    value = model.objects.filter(pk=pk).values_list(field, flat=True).first() or 0
+    return value + buffer.get(model, pk, field)
+
+
+def merge_pending(items, model, fields):
+    """
+    Add pending deltas to already loaded rows or instances in place.
+    ``fields`` maps the attribute the response reads to its counter column,
+    e.g. ``{'likes_count': 'like_count'}``.
+    """
+    for attr, field in fields.items():
+        deltas = buffer.snapshot(model, field)
+        if not deltas:
+            continue
+        for item in items:
+            if isinstance(item, dict):
+                if attr in item and item.get('id') in deltas:
+                    item[attr] += deltas[item['id']]
+            elif hasattr(item, attr) and item.pk in deltas:
+                setattr(item, attr, getattr(item, attr) + deltas[item.pk])
+    return items
+
+
+def count_of(related, fk):
+    """The outer row's number of ``related`` rows, as a correlated subquery on ``fk``"""
+    return Coalesce(Subquery(
+        related.objects.filter(**{fk: OuterRef('pk')}).order_by()
+        .values(fk).annotate(n=Count('pk')).values('n')
+    ), 0)
+
+
+def recount(model=None):
+    """Recompute counters from the rows they count, e.g. after bulk inserts"""
+    for counted_model, fields in COUNTERS.items():
+        if model is not None and counted_model is not model:
+            continue
+        counted_model.objects.update(**{
+            field: count_of(related, fk) for field, (related, fk) in fields.items()
+        })
@@ -0,0 +1,106 @@
+"""
+Run the independent queries of one request concurrently.
+
+    data = fan_out(
+        is_following=lambda: Follow.objects.filter(follower=user, followed=profile).exists(),
+        posts=lambda: list(profile.posts.all()),
+    )
+
+The first callable runs in the calling thread and the others on a bounded,
+process-wide thread pool (``FANOUT['MAX_WORKERS']``), so a request takes
+as long as its slowest query instead of the sum of them. Each pool thread
+has its own database connection, which is closed or kept after every task
+according to ``CONN_MAX_AGE`` (and returned to the pool with
+``DEKOGRAM_DB_POOL``), like a request's. Tasks run in a copy of the
+caller's context, so they read from the request's replica
+(core/replicas.py). Callables must evaluate their querysets fully; lazy
+querysets would run later in the caller.
+
+Everything runs inline, in order, when concurrency cannot help or would be
+wrong:
+- the caller is inside a transaction, whose uncommitted writes other
+  connections cannot see (this includes every ``TestCase``)
+- the caller is itself a pool thread, so nested fan-outs cannot exhaust the pool
+- the database is an in-memory SQLite one, which connections do not share
+- ``MAX_WORKERS`` is 0
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+DEFAULTS = {
+    'MAX_WORKERS': 8,
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def fanout_settings():
+    return {**DEFAULTS, **getattr(settings, 'FANOUT', {})}
+
+
+def _mark_worker():
+    _local.worker = True
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=fanout_settings()['MAX_WORKERS'], thread_name_prefix='fanout', initializer=_mark_worker,
+            )
+        return _pool
+
+
+def _reset_after_fork():
+    # The parent's pool threads do not exist in a forked worker
+    global _pool, _pool_lock
+    _pool, _pool_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def run_inline():
+    if getattr(_local, 'worker', False) or fanout_settings()['MAX_WORKERS'] < 1:
+        return True
+    for connection in connections.all():
+        if connection.in_atomic_block:
+            return True
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            return True
+    return False
+
+
+def _run(func):
+    try:
+        return func()
+    finally:
+        # What the end of a request does
+        close_old_connections()
+
+
+def fan_out(**tasks):
+    """Call every keyword's callable, concurrently where possible. Returns ``{name: result}``."""
+    if len(tasks) < 2 or run_inline():
+        return {name: func() for name, func in tasks.items()}
+    (first_name, first), *others = tasks.items()
+    pool = get_pool()
+    # Each task sees the request's context, e.g. its database routing
+    futures = {name: pool.submit(contextvars.copy_context().run, _run, func) for name, func in others}
+    try:
+        results = {first_name: first()}
+        for name, future in futures.items():
+            results[name] = future.result()
+    except BaseException:
+        for future in futures.values():
+            future.cancel()
+        raise
+    return results
@@ -0,0 +1,197 @@
+"""
+Per-process cache of whom each user follows.
+
+The feed, stories and interaction batches all need the viewer's followed
+ids. Server processes (``start_follow_cache()`` in wsgi.py/asgi.py) keep
+them as sorted ``array`` objects of 4 bytes per id, in an LRU capped at
+``FOLLOW_CACHE['MAX_BYTES']``. Elsewhere (tests, commands) every lookup
+goes to the database.
+
+A follow or unfollow drops the follower's entry in this process at once
+and, once committed, in every worker on the host through the bus
+(``core/bus.py``). The bus may drop messages, so entries also expire after
+``TTL`` seconds.
+
+Cached sets filter as a literal ``IN`` list. Sets larger than
+``IN_LIST_MAX``, and all sets without the cache, filter with a subquery on
+``core_follow`` instead, so the query text does not grow with the set.
+"""
+import atexit
+import bisect
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .bus import LocalBus, SocketBus
+from .models import Follow
+
+DEFAULTS = {
+    'MAX_BYTES': 16 * 1024 * 1024,
+    'TTL': 300,  # seconds
+    'IN_LIST_MAX': 500,
+    'BUS': 'socket',  # 'socket': every worker on this host; 'local': this process only
+    'BUS_DIR': None,  # default: <tmp>/dekogram-bus
+}
+
+TOPIC = 'follows'
+# array overhead, counted against MAX_BYTES with the ids
+ENTRY_OVERHEAD = 128
+
+
+def follow_cache_settings():
+    return {**DEFAULTS, **getattr(settings, 'FOLLOW_CACHE', {})}
+
+
+def compact(ids):
+    """Sorted ids as an array of 4-byte ints, or 8-byte ones if an id needs it"""
+    ids = sorted(ids)
+    return array('I' if not ids or ids[-1] < 2 ** 32 else 'Q', ids)
+
+
+class FollowSetCache:
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # follower id -> (ids, loaded at)
+        self.size = 0
+        # Bumped by every invalidation; a load that raced one is not stored
+        self.generation = 0
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            ids, loaded_at = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                self._remove(user_id)
+                return None
+            self.entries.move_to_end(user_id)
+            return ids
+
+    def put(self, user_id, ids, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self._remove(user_id)
+            self.entries[user_id] = (ids, time.monotonic())
+            self.size += self.nbytes(ids)
+            while self.size > self.max_bytes and self.entries:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.generation += 1
+            self._remove(user_id)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.size = 0
+
+    @staticmethod
+    def nbytes(ids):
+        return len(ids) * ids.itemsize + ENTRY_OVERHEAD
+
+    def _remove(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is not None:
+            self.size -= self.nbytes(entry[0])
+
+
+cache = FollowSetCache(follow_cache_settings()['MAX_BYTES'], follow_cache_settings()['TTL'])
+bus = LocalBus()
+
+
+def _invalidated(payload):
+    cache.invalidate(int(payload))
+
+
+def start_follow_cache():
+    """Cache follow sets in this process. Called by the server entry points."""
+    global bus
+    config = follow_cache_settings()
+    if cache.enabled:
+        return
+    cache.max_bytes, cache.ttl = config['MAX_BYTES'], config['TTL']
+    if config['BUS'] == 'socket':
+        bus = SocketBus(config['BUS_DIR'])
+        os.register_at_fork(after_in_child=bus._after_fork)
+        atexit.register(bus.stop)
+    bus.subscribe(TOPIC, _invalidated)
+    bus.start()
+    cache.enabled = True
+
+
+def load(user_id):
+    # In index order of (follower_id, followed_id), so nothing is sorted
+    rows = Follow.objects.filter(follower_id=user_id).order_by('followed_id')
+    return compact(rows.values_list('followed_id', flat=True))
+
+
+def following_ids(user_id):
+    """Sorted ids of the users ``user_id`` follows"""
+    if not cache.enabled:
+        return load(user_id)
+    ids = cache.get(user_id)
+    if ids is None:
+        generation = cache.generation
+        ids = load(user_id)
+        cache.put(user_id, ids, generation)
+    return ids
+
+
+async def afollowing_ids(user_id):
+    ids = cache.get(user_id) if cache.enabled else None
+    if ids is None:
+        ids = await sync_to_async(following_ids)(user_id)
+    return ids
+
+
+def _contains(ids, user_id):
+    index = bisect.bisect_left(ids, user_id)
+    return index < len(ids) and ids[index] == user_id
+
+
+def is_following(follower_id, followed_id):
+    return _contains(following_ids(follower_id), followed_id)
+
+
+def followed_among(follower_id, user_ids):
+    """Which of ``user_ids`` ``follower_id`` follows, in one query at most"""
+    if not user_ids or follower_id is None:
+        return set()
+    if cache.enabled:
+        ids = following_ids(follower_id)
+        return {user_id for user_id in user_ids if _contains(ids, user_id)}
+    # Without the cache only this page's users are looked up, not the whole set
+    rows = Follow.objects.filter(follower_id=follower_id, followed_id__in=user_ids)
+    return set(rows.values_list('followed_id', flat=True))
+
+
+def author_filter(user, field='user_id', ids=None):
+    """``Q`` matching rows by ``user`` or by anyone they follow (``ids``, if already loaded)"""
+    if ids is None and cache.enabled:
+        ids = following_ids(user.id)
+    # Without the cache a subquery saves loading the ids first
+    if ids is not None and len(ids) <= follow_cache_settings()['IN_LIST_MAX']:
+        return Q(**{f'{field}__in': [*ids, user.id]})
+    followed = Follow.objects.filter(follower_id=user.id).values('followed_id')
+    return Q(**{f'{field}__in': followed}) | Q(**{field: user.id})
+
+
+def follows_changed(follower_id):
+    """Drop ``follower_id``'s set here now, and in every worker once the change is committed"""
+    cache.invalidate(follower_id)
+    if cache.enabled:
+        transaction.on_commit(lambda: bus.publish(TOPIC, str(follower_id)))
@@ -0,0 +1,115 @@
+"""
+Idempotency keys for write endpoints.
+
+A client that may retry a write sends ``Idempotency-Key: <unique string>``.
+The first request with a key stores its response. A retry with the same key
+gets that response back, marked ``Idempotent-Replayed: true``, instead of
+running the write again. A retry that arrives while the first request is
+still running gets 409, and reusing a key for a different request gets 422.
+Keys expire after ``IDEMPOTENCY_KEY_TTL``.
+"""
+import functools
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.http.request import RawPostDataException
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .interactions import insert_ignore
+from .models import IdempotencyKey
+
+DEFAULT_TTL = timedelta(hours=1)
+PURGE_INTERVAL = 60  # seconds between sweeps of expired keys, per process
+
+_last_purge = 0.0
+
+
+def key_ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', DEFAULT_TTL)
+
+
+def purge_expired(force=False):
+    """Delete expired keys, at most once per PURGE_INTERVAL unless forced"""
+    global _last_purge
+    now = time.monotonic()
+    if not force and now - _last_purge < PURGE_INTERVAL:
+        return 0
+    _last_purge = now
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=timezone.now() - key_ttl()).delete()
+    return deleted
+
+
+def request_hash(request):
+    digest = hashlib.sha256()
+    for part in (request.method, request.get_full_path()):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    try:
+        digest.update(request.body)
+    except RawPostDataException:
+        # Form data already read by CSRF checks
+        digest.update(repr(sorted(request.POST.lists())).encode())
+    return digest.hexdigest()
+
+
+def reserve(user, key, fingerprint):
+    """Claim ``key`` for this request. Returns None when claimed, else the existing record."""
+    for _ in range(2):
+        if insert_ignore(IdempotencyKey(user=user, key=key, request_hash=fingerprint)):
+            return None
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None:
+            continue  # expired and deleted in between; try again
+        if record.created_at < timezone.now() - key_ttl():
+            record.delete()
+            continue
+        return record
+    return IdempotencyKey.objects.filter(user=user, key=key).first()
+
+
+def idempotent(view_method):
+    """Honour the Idempotency-Key header on a DRF view method"""
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            return Response({'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+        purge_expired()
+        fingerprint = request_hash(request)
+        record = reserve(request.user, key, fingerprint)
+        if record is not None:
+            if record.request_hash != fingerprint:
+                return Response(
+                    {'error': 'Idempotency-Key was used for a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if record.status_code is None:
+                return Response(
+                    {'error': 'A request with this Idempotency-Key is in progress'},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+        except Exception:
+            IdempotencyKey.objects.filter(user=request.user, key=key).delete()
+            raise
+        if response.status_code >= 500:
+            # Let the client retry server errors for real
+            IdempotencyKey.objects.filter(user=request.user, key=key).delete()
+        else:
+            IdempotencyKey.objects.filter(user=request.user, key=key).update(
+                status_code=response.status_code, response=response.data
+            )
+        return response
+
+    return wrapper
@@ -0,0 +1,169 @@
+"""
+Race-free set-state writes for likes, saves and follows.
+
+``insert_ignore`` is a single ``INSERT ... ON CONFLICT DO NOTHING`` (``INSERT
+OR IGNORE`` on SQLite) that reports whether it inserted, so two concurrent
+"like" requests can never raise ``IntegrityError`` or both send a
+notification. ``set_state`` turns a relation on or off and reports whether
+anything changed, and ``apply_state`` maps a PUT/DELETE/``?state=`` request
+onto it. ``insert_ignore_many`` and ``delete_matching_many`` do the same for
+a batch and report which rows they actually changed, so counters only move
+for those.
+"""
+from django.db import connections, router
+from django.db.models.constants import OnConflict
+from django.db.models.signals import post_save, post_delete
+from rest_framework.exceptions import ValidationError
+
+
+def insert_ignore(obj):
+    """Insert ``obj`` unless it violates a unique constraint. Returns True if inserted."""
+    model = type(obj)
+    meta = model._meta
+    using = router.db_for_write(model, instance=obj)
+    connection = connections[using]
+    ops = connection.ops
+    fields = [field for field in meta.concrete_fields if not field.primary_key]
+    values = [field.get_db_prep_save(field.pre_save(obj, True), connection) for field in fields]
+    sql = '%s %s (%s) VALUES (%s) %s' % (
+        ops.insert_statement(on_conflict=OnConflict.IGNORE),
+        ops.quote_name(meta.db_table),
+        ', '.join(ops.quote_name(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields)),
+        ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, values)
+        inserted = cursor.rowcount == 1
+    if inserted:
+        # Keep the version bumps in core.signals working for raw inserts
+        post_save.send(sender=model, instance=obj, created=True, update_fields=None, raw=False, using=using)
+    return inserted
+
+
+def _unique_fields(meta):
+    return [meta.get_field(name) for name in next(iter(meta.unique_together))]
+
+
+def insert_ignore_many(objs):
+    """``insert_ignore`` for several objects of one model, in one statement where the database allows. Returns the inserted ones."""
+    if not objs:
+        return []
+    model = type(objs[0])
+    meta = model._meta
+    using = router.db_for_write(model, instance=objs[0])
+    connection = connections[using]
+    if not connection.features.can_return_columns_from_insert:
+        return [obj for obj in objs if insert_ignore(obj)]
+    ops = connection.ops
+    fields = [field for field in meta.concrete_fields if not field.primary_key]
+    keys = _unique_fields(meta)
+    returning, returning_params = ops.return_insert_columns(keys)
+    sql = '%s %s (%s) VALUES %s %s %s' % (
+        ops.insert_statement(on_conflict=OnConflict.IGNORE),
+        ops.quote_name(meta.db_table),
+        ', '.join(ops.quote_name(field.column) for field in fields),
+        ', '.join(['(%s)' % ', '.join(['%s'] * len(fields))] * len(objs)),
+        ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None),
+        returning,
+    )
+    values = [field.get_db_prep_save(field.pre_save(obj, True), connection) for obj in objs for field in fields]
+    with connection.cursor() as cursor:
+        # RETURNING only yields the rows that went in, not the conflicting ones
+        cursor.execute(sql, values + list(returning_params))
+        inserted = set(cursor.fetchall())
+    created = [obj for obj in objs if tuple(getattr(obj, field.attname) for field in keys) in inserted]
+    for obj in created:
+        post_save.send(sender=model, instance=obj, created=True, update_fields=None, raw=False, using=using)
+    return created
+
+
+def delete_matching(obj):
+    """
+    Delete the row matching ``obj`` on its unique fields in one statement.
+    Only for leaf tables like likes, saves and follows that nothing else
+    references. Returns True if a row was deleted.
+    """
+    model = type(obj)
+    meta = model._meta
+    using = router.db_for_write(model, instance=obj)
+    connection = connections[using]
+    ops = connection.ops
+    fields = _unique_fields(meta)
+    sql = 'DELETE FROM %s WHERE %s' % (
+        ops.quote_name(meta.db_table),
+        ' AND '.join(f'{ops.quote_name(field.column)} = %s' for field in fields),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [getattr(obj, field.attname) for field in fields])
+        deleted = cursor.rowcount > 0
+    if deleted:
+        post_delete.send(sender=model, instance=obj, using=using, origin=obj)
+    return deleted
+
+
+def delete_matching_many(objs):
+    """``delete_matching`` for several objects of one model. Returns the ones whose row this call deleted."""
+    if not objs:
+        return []
+    model = type(objs[0])
+    meta = model._meta
+    connection = connections[router.db_for_write(model, instance=objs[0])]
+    if not connection.features.can_return_columns_from_insert:
+        return [obj for obj in objs if delete_matching(obj)]
+    ops = connection.ops
+    fields = _unique_fields(meta)
+    match = '(%s)' % ' AND '.join(f'{ops.quote_name(field.column)} = %s' for field in fields)
+    returning, returning_params = ops.return_insert_columns(fields)
+    sql = 'DELETE FROM %s WHERE %s %s' % (ops.quote_name(meta.db_table), ' OR '.join([match] * len(objs)), returning)
+    with connection.cursor() as cursor:
+        # Of two concurrent deletes of a row only one gets it back
+        cursor.execute(sql, [getattr(obj, field.attname) for obj in objs for field in fields] + list(returning_params))
+        deleted = set(cursor.fetchall())
+    gone = [obj for obj in objs if tuple(getattr(obj, field.attname) for field in fields) in deleted]
+    for obj in gone:
+        post_delete.send(sender=model, instance=obj, using=connection.alias, origin=obj)
+    return gone
+
+
+def set_state(obj, state):
+    """Make the relation described by ``obj`` exist (``state=True``) or not. Returns True if it changed."""
+    return insert_ignore(obj) if state else delete_matching(obj)
+
+
+def parse_state(request):
+    """
+    The state a set-state request asks for: PUT means on and DELETE means
+    off. POST takes ``?state=true|false``. A bare POST returns None, the
+    legacy toggle.
+    """
+    if request.method == 'PUT':
+        return True
+    if request.method == 'DELETE':
+        return False
+    value = request.query_params.get('state')
+    if value is None:
+        return None
+    if value.lower() in ('true', '1', 'on'):
+        return True
+    if value.lower() in ('false', '0', 'off'):
+        return False
+    raise ValidationError({'state': 'Must be true or false.'})
+
+
+def apply_state(request, obj):
+    """
+    Apply the state ``request`` asks for to the relation ``obj``. Returns
+    (state, created); ``created`` is True only for the request that inserted
+    the row, so it alone sends the notification.
+    """
+    state = parse_state(request)
+    if state is None:
+        # Legacy toggle. The insert decides the direction, so concurrent
+        # taps cannot raise or leave a duplicate behind
+        created = insert_ignore(obj)
+        if not created:
+            set_state(obj, False)
+        return created, created
+    changed = set_state(obj, state)
+    return state, state and changed
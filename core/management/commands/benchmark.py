@@ -0,0 +1,212 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from benchmarks.runner import (
+    BASELINE_FILE, RESULTS_DIR, InProcessTarget, HttpTarget, GunicornServer, DaphneServer,
+    run_scenario, run_micro, environment, compare, load_json, write_json,
+)
+from benchmarks.contention import run_contention
+from benchmarks.micro import MICRO_BENCHMARKS
+from benchmarks.scenarios import SCENARIOS, SCENARIOS_BY_NAME, sample_image
+from core import sqlite
+from core.models import Post, Follow
+from core.ratelimit import ratelimit_settings
+
+User = get_user_model()
+
+
+class BenchmarkContext:
+    def __init__(self, usernames, post_ids, page, image):
+        self.usernames = usernames
+        self.post_ids = post_ids
+        self.page = page
+        self.image = image
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the hot API paths against the current database (seed it with seed_data first)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=['inprocess', 'gunicorn', 'daphne', 'both', 'servers'], default='inprocess',
+                            help='both: in-process and gunicorn; servers: sync views under gunicorn '
+                                 'against async views under daphne')
+        parser.add_argument('--micro', action='append', choices=sorted(MICRO_BENCHMARKS),
+                            help='Run these in-process micro-benchmarks instead of the HTTP scenarios')
+        parser.add_argument('--contention', action='store_true',
+                            help='Measure concurrent SQLite writers (--concurrency processes, --requests transactions) '
+                                 'with SQLite defaults and with the tuned profile, instead of the HTTP scenarios')
+        parser.add_argument('--url', help='Benchmark an already running server instead of starting gunicorn')
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS_BY_NAME),
+                            help='Only run these scenarios (repeatable)')
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=20, help='Untimed requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=8, help='Client threads for the HTTP target')
+        parser.add_argument('--gunicorn-workers', type=int, default=2)
+        parser.add_argument('--gunicorn-threads', type=int, default=1)
+        parser.add_argument('--daphne-sync-views', action='store_true',
+                            help='Run daphne without the async API views, to separate server and view effects')
+        parser.add_argument('--user', help='Username to authenticate as (default: the first user who follows someone)')
+        parser.add_argument('--page', type=int, default=5, help='Feed page used by feed_page_n')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Where to write the JSON results (default: benchmarks/results/<timestamp>.json)')
+        parser.add_argument('--baseline', default=str(BASELINE_FILE), help='Baseline JSON to compare against')
+        parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+        parser.add_argument('--threshold', type=float, default=0.10, help='Slowdown that counts as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        user = self.get_user(options['user'])
+        context = self.build_context(user, options['page'])
+        token = str(RefreshToken.for_user(user).access_token)
+        scenarios = [SCENARIOS_BY_NAME[name] for name in options['scenario']] if options['scenario'] else SCENARIOS
+
+        results = {'environment': environment(), 'user': user.username, 'targets': {}}
+        if options['contention']:
+            results['targets']['contention'] = self.run_contention(options)
+        elif options['micro']:
+            for name in options['micro']:
+                results['targets'][f'micro:{name}'] = self.run_micro(name, user, options)
+        elif options['target'] in ('inprocess', 'both'):
+            with override_settings(DEBUG=False, RATE_LIMITS={**ratelimit_settings(), 'ENABLED': False}):
+                results['targets']['inprocess'] = self.run_target(
+                    'inprocess', InProcessTarget(token), scenarios, context, options, concurrency=1
+                )
+        http = not (options['micro'] or options['contention'])
+        if options['target'] in ('gunicorn', 'both', 'servers') and http:
+            if options['url']:
+                results['targets']['gunicorn'] = self.run_target(
+                    options['url'], HttpTarget(options['url'], token), scenarios, context, options, options['concurrency']
+                )
+            else:
+                with GunicornServer(options['gunicorn_workers'], options['gunicorn_threads']) as server:
+                    results['targets']['gunicorn'] = self.run_target(
+                        'gunicorn', HttpTarget(server.url, token), scenarios, context, options, options['concurrency']
+                    )
+        if options['target'] in ('daphne', 'servers') and http:
+            label = 'daphne-sync' if options['daphne_sync_views'] else 'daphne'
+            with DaphneServer(async_api=not options['daphne_sync_views']) as server:
+                results['targets'][label] = self.run_target(
+                    label, HttpTarget(server.url, token), scenarios, context, options, options['concurrency']
+                )
+        if options['target'] == 'servers' and http:
+            self.report_servers(results['targets'])
+
+        output = options['output'] or RESULTS_DIR / f'{time.strftime("%Y%m%d-%H%M%S")}.json'
+        write_json(output, results)
+        self.stdout.write(f'Results written to {output}')
+
+        if options['save_baseline']:
+            write_json(options['baseline'], results)
+            self.stdout.write(self.style.SUCCESS(f'Baseline saved to {options["baseline"]}'))
+            return
+
+        regressions = self.report_comparison(results, load_json(options['baseline']), options['threshold'])
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{len(regressions)} scenario(s) regressed: {", ".join(regressions)}')
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        follower_id = Follow.objects.order_by('follower_id').values_list('follower_id', flat=True).first()
+        if follower_id is None:
+            raise CommandError('No follow graph found. Seed one with "manage.py seed_data --profile small".')
+        return User.objects.get(pk=follower_id)
+
+    def build_context(self, user, page):
+        usernames = list(User.objects.order_by('?').values_list('username', flat=True)[:1000])
+        # Post actions only resolve posts in the viewer's own feed
+        authors = list(user.following.values_list('followed_id', flat=True)) + [user.id]
+        post_ids = list(Post.objects.filter(user_id__in=authors).order_by('?').values_list('id', flat=True)[:1000])
+        if not post_ids:
+            raise CommandError(f'No posts in the feed of "{user.username}". Seed the database with "manage.py seed_data --profile small".')
+        return BenchmarkContext(usernames, post_ids, page, sample_image())
+
+    def run_target(self, label, target, scenarios, context, options, concurrency):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{label} (concurrency {concurrency})'))
+        self.stdout.write(f'  {"scenario":<18} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"req/s":>9} {"errors":>7}')
+        results = {}
+        for scenario in scenarios:
+            stats = run_scenario(target, scenario, context, options['requests'], options['warmup'], concurrency)
+            results[scenario.name] = stats
+            self.stdout.write(
+                f'  {scenario.name:<18} {stats["p50_ms"]:>9.2f} {stats["p95_ms"]:>9.2f} '
+                f'{stats["p99_ms"]:>9.2f} {stats["throughput_rps"]:>9.1f} {stats["errors"]:>7}'
+            )
+        return results
+
+    def run_micro(self, name, user, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'micro: {name}'))
+        results = run_micro(MICRO_BENCHMARKS[name](user), options['requests'], options['warmup'])
+        fastest = min(stats['p50_ms'] for stats in results.values())
+        for variant, stats in results.items():
+            self.stdout.write(
+                f'  {variant:<18} p50 {stats["p50_ms"]:>9.3f} ms  p99 {stats["p99_ms"]:>9.3f} ms  '
+                f'{stats["p50_ms"] / fastest:>5.2f}x the fastest'
+            )
+        return results
+
+    def run_contention(self, options):
+        database = settings.DATABASES['default']
+        if database['ENGINE'] != sqlite.SQLITE_ENGINE:
+            raise CommandError('The write contention benchmark needs a SQLite database.')
+        config = sqlite.sqlite_settings()
+        variants = {
+            # Rollback journal, full fsyncs, deferred transactions
+            'defaults': ([], 'BEGIN', 'DELETE'),
+            'tuned': (sqlite.pragmas(config), 'BEGIN IMMEDIATE', config['JOURNAL_MODE']),
+        }
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'SQLite write contention ({options["concurrency"]} processes, {options["requests"]} transactions)'
+        ))
+        self.stdout.write(f'  {"variant":<18} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"tx/s":>9} {"locked":>7}')
+        results = {}
+        for name, (statements, begin, journal_mode) in variants.items():
+            stats = run_contention(
+                database['NAME'], statements, begin, journal_mode,
+                writers=options['concurrency'], transactions=options['requests'], seed=options['seed'],
+            )
+            results[name] = stats
+            self.stdout.write(
+                f'  {name:<18} {stats["p50_ms"]:>9.2f} {stats["p95_ms"]:>9.2f} '
+                f'{stats["p99_ms"]:>9.2f} {stats["throughput_rps"]:>9.1f} {stats["errors"]:>7}'
+            )
+        return results
+
+    def report_servers(self, targets):
+        """Side by side: daphne's p50, p99 and throughput relative to gunicorn's"""
+        gunicorn = targets['gunicorn']
+        label, daphne = next((name, stats) for name, stats in targets.items() if name.startswith('daphne'))
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{label} vs gunicorn'))
+        self.stdout.write(f'  {"scenario":<18} {"p50":>7} {"p99":>7} {"req/s":>7}')
+        for name, stats in daphne.items():
+            base = gunicorn[name]
+            self.stdout.write(
+                f'  {name:<18} {base["p50_ms"] / stats["p50_ms"]:>6.2f}x {base["p99_ms"] / stats["p99_ms"]:>6.2f}x '
+                f'{stats["throughput_rps"] / base["throughput_rps"]:>6.2f}x'
+            )
+
+    def report_comparison(self, results, baseline, threshold):
+        rows = compare(results, baseline, threshold)
+        if not rows:
+            self.stdout.write('No baseline to compare against; store one with --save-baseline.')
+            return []
+        self.stdout.write(self.style.MIGRATE_HEADING('Compared with baseline (p50)'))
+        regressions = []
+        for key, before, after, speedup, regressed in rows:
+            line = f'  {key:<28} {before:>9.2f} -> {after:>9.2f} ms  {speedup:>5.2f}x'
+            if regressed:
+                regressions.append(key)
+                self.stdout.write(self.style.ERROR(line + '  REGRESSION'))
+            else:
+                self.stdout.write(self.style.SUCCESS(line) if speedup > 1 + threshold else line)
+        return regressions
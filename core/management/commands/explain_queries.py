@@ -0,0 +1,146 @@
+import re
+from contextlib import ExitStack
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core.models import Comment, Follow
+
+User = get_user_model()
+
+
+class Endpoint:
+    def __init__(self, name, path, allow=(), reason=''):
+        self.name = name
+        self.path = path
+        # Problem kinds ('scan', 'sort') this endpoint cannot avoid, and why
+        self.allow = set(allow)
+        self.reason = reason
+
+
+ENDPOINTS = [
+    Endpoint('feed', '/api/posts/', allow={'sort'},
+             reason='merges the newest posts of every followed author'),
+    Endpoint('feed_page_2', '/api/posts/?page=2', allow={'sort'},
+             reason='merges the newest posts of every followed author'),
+    Endpoint('feed_previews', '/api/posts/?expand=comments_preview', allow={'sort'},
+             reason='merges the newest posts of every followed author'),
+    Endpoint('explore', '/api/posts/?type=explore'),
+    Endpoint('post_detail', '/api/posts/{post_id}/'),
+    Endpoint('post_comments', '/api/posts/{post_id}/comments/'),
+    Endpoint('comment_replies', '/api/posts/{post_id}/comments/?parent={comment_id}'),
+    Endpoint('stories', '/api/stories/', allow={'sort'},
+             reason='merges the active stories of every followed author'),
+    Endpoint('notifications', '/api/notifications/'),
+    Endpoint('profile', '/api/users/{username}/'),
+    Endpoint('profile_page', '/profile/{username}/'),
+    Endpoint('followers', '/api/users/{username}/followers/'),
+    Endpoint('following', '/api/users/{username}/following/'),
+    Endpoint('followers_search', '/api/users/{username}/followers/?q={prefix}', allow={'sort'},
+             reason='without statistics the planner sorts the matching followers instead of walking the username index'),
+]
+
+# Plan lines that mean a query reads a whole table or sorts its rows itself
+PROBLEMS = {
+    'sqlite': [
+        ('scan', re.compile(r'^SCAN (?!CONSTANT ROW)')),
+        ('sort', re.compile(r'USE TEMP B-TREE')),
+    ],
+    'postgresql': [
+        ('scan', re.compile(r'Seq Scan on ')),
+        ('sort', re.compile(r'(^|->\s+)(Incremental )?Sort\b')),
+    ],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Request the hot API endpoints, EXPLAIN every query they run and fail '
+        'when a plan scans a whole table or sorts without an index'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--endpoint', action='append', choices=[endpoint.name for endpoint in ENDPOINTS],
+                            help='Only check these endpoints (repeatable)')
+        parser.add_argument('--user', help='Username to request as (default: the first user who follows someone)')
+        parser.add_argument('--plans', action='store_true', help='Print every plan, not only the problems')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        followed = user.following.select_related('followed').first().followed
+        comment = (
+            Comment.objects.filter(post__user=followed, parent=None).select_related('post').first()
+            or Comment.objects.filter(parent=None).select_related('post').first()
+        )
+        if comment is None:
+            raise CommandError('No comments found. Seed the database with "manage.py seed_data --profile small".')
+        params = {
+            'username': followed.username, 'post_id': comment.post.id, 'comment_id': comment.id,
+            'prefix': user.username[:3],
+        }
+        token = str(RefreshToken.for_user(user).access_token)
+        client = Client(SERVER_NAME='localhost', HTTP_AUTHORIZATION=f'Bearer {token}')
+        endpoints = [endpoint for endpoint in ENDPOINTS if not options['endpoint'] or endpoint.name in options['endpoint']]
+
+        failures = []
+        for endpoint in endpoints:
+            self.stdout.write(self.style.MIGRATE_HEADING(endpoint.name))
+            for alias, sql, plan in self.explain(client, endpoint.path.format(**params)):
+                problems = self.problems(connections[alias].vendor, plan)
+                unexpected = [kind for kind in problems if kind not in endpoint.allow]
+                if options['plans'] or problems:
+                    self.stdout.write(f'  {sql[:120]}')
+                    for line in plan:
+                        self.stdout.write(f'      {line}')
+                if unexpected:
+                    failures.append(endpoint.name)
+                    self.stdout.write(self.style.ERROR(f'  {", ".join(unexpected)} not allowed'))
+                elif problems:
+                    self.stdout.write(self.style.WARNING(f'  {", ".join(problems)} allowed: {endpoint.reason}'))
+        if failures:
+            raise CommandError(f'Full scans or unindexed sorts in: {", ".join(dict.fromkeys(failures))}')
+        self.stdout.write(self.style.SUCCESS(f'{len(endpoints)} endpoint(s) use their indexes.'))
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'User "{username}" does not exist')
+        follower_id = Follow.objects.order_by('follower_id').values_list('follower_id', flat=True).first()
+        if follower_id is None:
+            raise CommandError('No follow graph found. Seed one with "manage.py seed_data --profile small".')
+        return User.objects.get(pk=follower_id)
+
+    def explain(self, client, path):
+        """``(alias, sql, plan lines)`` of every SELECT a GET of ``path`` runs"""
+        with ExitStack() as stack:
+            # Fanned-out queries would run on other threads' connections
+            stack.enter_context(override_settings(FANOUT={'MAX_WORKERS': 0}))
+            captured = {alias: stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in connections}
+            response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(f'GET {path} returned {response.status_code}')
+        for alias, context in captured.items():
+            for query in context.captured_queries:
+                if query['sql'].startswith('SELECT'):
+                    yield alias, query['sql'], self.plan(connections[alias], query['sql'])
+
+    def plan(self, connection, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return [row[3] for row in cursor.fetchall()]
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+
+    def problems(self, vendor, plan):
+        found = []
+        for kind, pattern in PROBLEMS.get(vendor, []):
+            if any(pattern.search(line.strip()) for line in plan) and kind not in found:
+                found.append(kind)
+        return found
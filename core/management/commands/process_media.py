@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from core.media import VIDEO_FIELDS, process_and_save
+from core.models import Post
+from core.versions import bump
+
+
+class Command(BaseCommand):
+    help = 'Read the duration, dimensions and poster frame of video posts that have none yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Reprocess every video post, not only new ones')
+
+    def handle(self, *args, **options):
+        videos = Post.objects.filter(media_type='video')
+        if not options['all']:
+            videos = videos.filter(duration=None)
+        processed = missing = 0
+        # Posts sharing a file (as seeded data does) are processed once
+        for name in list(videos.order_by().values_list('media', flat=True).distinct()):
+            post = videos.filter(media=name).first()
+            if not post.media.storage.exists(name):
+                missing += 1
+                continue
+            # As the upload workers do
+            process_and_save(post)
+            fields = {field: getattr(post, field) for field in VIDEO_FIELDS}
+            post_ids = list(videos.filter(media=name).exclude(pk=post.pk).values_list('id', flat=True))
+            if post_ids:
+                Post.objects.filter(pk__in=post_ids).update(**fields)
+                # update() sends no post_save signals
+                bump('explore', *[f'post:{post_id}' for post_id in post_ids])
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} video file(s); {missing} missing.'))
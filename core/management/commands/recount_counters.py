@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.counters import recount
+
+
+class Command(BaseCommand):
+    help = 'Recompute the like, comment and story view counters from the rows they count'
+
+    def handle(self, *args, **options):
+        recount()
+        self.stdout.write(self.style.SUCCESS('Counters recomputed.'))
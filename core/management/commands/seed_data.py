@@ -1,16 +1,136 @@
 import random
-from django.core.management.base import BaseCommand
+import struct
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import accumulate
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
-from core.models import Post, Story, Comment, Like, Follow
+from django.db import transaction
+from core.counters import recount
+from core.models import Post, Story, Comment, Like, Follow, StoryView, Notification
 from django.utils import timezone
 from datetime import timedelta
+from PIL import Image, ImageDraw
 
 User = get_user_model()
 
+# Dataset profiles for load testing. The same profile and --seed always
+# produce the same rows, so benchmark runs stay comparable.
+PROFILES = {
+    'small': {
+        'users': 1_000, 'avg_following': 30, 'posts_per_user': 5, 'likes_per_post': 12,
+        'comments_per_post': 3, 'story_ratio': 0.3, 'views_per_story': 10,
+        'notifications_per_user': 10, 'media_files': 32,
+    },
+    'medium': {
+        'users': 100_000, 'avg_following': 80, 'posts_per_user': 8, 'likes_per_post': 25,
+        'comments_per_post': 4, 'story_ratio': 0.2, 'views_per_story': 25,
+        'notifications_per_user': 20, 'media_files': 128,
+    },
+    'large': {
+        'users': 1_000_000, 'avg_following': 150, 'posts_per_user': 10, 'likes_per_post': 40,
+        'comments_per_post': 5, 'story_ratio': 0.15, 'views_per_story': 40,
+        'notifications_per_user': 25, 'media_files': 512,
+    },
+}
+
+SEED_USERNAME_PREFIX = 'seed_'
+SEED_PASSWORD = 'password123'
+VIDEO_RATIO = 0.2
+
+CAPTIONS = [
+    "Great day today!", "Exploring the city 🏙️", "Best coffee in town ☕",
+    "Working on new projects 💻", "Sunset vibes 🌅", "New photo alert! 📸"
+]
+HASHTAGS = ['#travel', '#food', '#photography', '#tech', '#sunset', '#coffee', '#city']
+LOCATIONS = ['', '', 'Tashkent', 'Samarkand', 'Bukhara', 'Istanbul', 'Dubai']
+COMMENTS = ['Nice!', 'Love this 😍', 'Wow', 'Where is this?', '🔥🔥🔥', 'Amazing shot']
+
+
+def render_image(job):
+    """Write one synthetic JPEG. Runs in a worker process, so no Django here."""
+    path, index, size = job
+    rng = random.Random(index)
+    start = tuple(rng.randrange(256) for _ in range(3))
+    end = tuple(rng.randrange(256) for _ in range(3))
+    img = Image.new('RGB', (size, size))
+    draw = ImageDraw.Draw(img)
+    for y in range(size):
+        t = y / size
+        draw.line([(0, y), (size, y)], fill=tuple(int(a + (b - a) * t) for a, b in zip(start, end)))
+    draw.text((size // 10, size // 10), f'dekogram #{index}', fill=(255, 255, 255))
+    img.save(path, 'JPEG', quality=80)
+    return path
+
+
+def _box(kind, payload):
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def render_video(job):
+    """
+    Write a tiny MP4 container with ftyp/moov/mdat boxes. It holds no frames,
+    but carries real duration and dimension metadata for the media pipeline.
+    """
+    path, index, size = job
+    rng = random.Random(index)
+    timescale, duration = 1000, rng.randint(3_000, 60_000)
+    width, height = (size, size * 16 // 9) if index % 2 else (size, size)
+    matrix = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mvhd = _box(b'mvhd', struct.pack('>B3xIIII', 0, 0, 0, timescale, duration)
+                + struct.pack('>IH10x', 0x10000, 0x100) + matrix + bytes(24) + struct.pack('>I', 2))
+    tkhd = _box(b'tkhd', struct.pack('>I', 0x7) + struct.pack('>IIII', 0, 0, 1, 0)
+                + struct.pack('>I', duration) + bytes(8) + struct.pack('>hhhH', 0, 0, 0, 0)
+                + matrix + struct.pack('>II', width << 16, height << 16))
+    with open(path, 'wb') as f:
+        f.write(_box(b'ftyp', b'isom' + struct.pack('>I', 512) + b'isomiso2mp41'))
+        f.write(_box(b'moov', mvhd + _box(b'trak', tkhd)))
+        f.write(_box(b'mdat', b''))
+    return path
+
+
+@contextmanager
+def manual_timestamps(*models):
+    """Let bulk_create keep the generated created_at/updated_at values"""
+    fields = [
+        field for model in models for field in model._meta.fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
 class Command(BaseCommand):
     help = 'Seeds the database with initial users, posts, and stories'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--profile', choices=sorted(PROFILES),
+                            help='Generate a synthetic load-testing dataset of this size')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument('--batch-size', type=int, default=5_000, help='Rows per bulk_create batch')
+        parser.add_argument('--workers', type=int, default=None, help='Processes used to render media files')
+        parser.add_argument('--no-media', action='store_true', help='Skip writing synthetic media files')
+        for name in PROFILES['small']:
+            value_type = float if name == 'story_ratio' else int
+            parser.add_argument(f'--{name.replace("_", "-")}', type=value_type, dest=name,
+                                help=f'Override the profile value for {name}')
+
+    def handle(self, *args, **options):
+        if options['profile'] or options['users']:
+            return self.seed_synthetic(options)
+
         self.stdout.write('Seeding data...')
 
         # 1. Create Users
@@ -51,19 +171,14 @@ class Command(BaseCommand):
         self.stdout.write('Created follows.')
 
         # 3. Create Posts
-        captions = [
-            "Great day today!", "Exploring the city 🏙️", "Best coffee in town ☕",
-            "Working on new projects 💻", "Sunset vibes 🌅", "New photo alert! 📸"
-        ]
-        
         # Placeholder for media (optional)
         # Since we don't have actual files, we leave them blank or use a default
-        
+
         for user in created_users:
             for _ in range(random.randint(2, 5)):
                 Post.objects.create(
                     user=user,
-                    caption=random.choice(captions),
+                    caption=random.choice(CAPTIONS),
                     media_type='image',
                     # media='posts/default.png' # In real life we'd have files
                 )
@@ -81,3 +196,211 @@ class Command(BaseCommand):
         self.stdout.write('Created stories.')
 
         self.stdout.write(self.style.SUCCESS('Successfully seeded database!'))
+
+    # Synthetic load-testing dataset
+
+    def seed_synthetic(self, options):
+        config = dict(PROFILES[options['profile'] or 'small'])
+        config.update({name: options[name] for name in config if options.get(name) is not None})
+        if config['users'] < 2:
+            raise CommandError('At least 2 users are needed to build a follow graph.')
+        if User.objects.filter(username__startswith=SEED_USERNAME_PREFIX).exists():
+            raise CommandError(
+                'Synthetic users already exist. Run "manage.py flush" first so the dataset stays reproducible.'
+            )
+
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # Timestamps are offsets from the current hour so runs line up
+        self.now = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.stdout.write(f'Seeding synthetic dataset: {config}')
+
+        media = self.render_media(config['media_files'], options['workers'], options['no_media'])
+        with manual_timestamps(User, Follow, Post, Story, StoryView, Comment, Like, Notification):
+            user_ids = self.create_users(config['users'])
+            popularity = self.popularity_index(user_ids)
+            self.create_follows(user_ids, popularity, config['avg_following'])
+            post_ids = self.create_posts(user_ids, popularity, config['posts_per_user'], media)
+            self.create_likes(user_ids, post_ids, config['likes_per_post'])
+            self.create_comments(user_ids, post_ids, config['comments_per_post'])
+            story_ids = self.create_stories(user_ids, config['story_ratio'], media)
+            self.create_story_views(user_ids, story_ids, config['views_per_story'])
+            self.create_notifications(user_ids, post_ids, config['notifications_per_user'])
+
+        # bulk_create skips the signals that keep the counters current
+        self.stdout.write('Counting likes, comments and story views...')
+        recount()
+        self.stdout.write(self.style.SUCCESS('Successfully seeded synthetic dataset!'))
+
+    def render_media(self, count, workers, skip):
+        """Render a pool of media files in parallel; posts reuse them round-robin"""
+        images = [f'seed/image_{i}.jpg' for i in range(count)]
+        videos = [f'seed/video_{i}.mp4' for i in range(max(1, count // 4))]
+        if not skip:
+            root = Path(settings.MEDIA_ROOT)
+            (root / 'seed').mkdir(parents=True, exist_ok=True)
+            image_jobs = [(str(root / name), i, 1080) for i, name in enumerate(images) if not (root / name).exists()]
+            video_jobs = [(str(root / name), i, 720) for i, name in enumerate(videos) if not (root / name).exists()]
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(render_image, image_jobs, chunksize=4))
+                list(pool.map(render_video, video_jobs, chunksize=4))
+            self.stdout.write(f'Rendered {len(image_jobs)} images and {len(video_jobs)} videos.')
+        return {'image': images, 'video': videos}
+
+    def timestamp(self, max_days=90):
+        return self.now - timedelta(seconds=self.rng.randrange(max_days * 86400))
+
+    def bulk_insert(self, model, rows, label, ignore_conflicts=False):
+        """Insert an iterable of unsaved instances in batches, one transaction per batch"""
+        batch, total = [], 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                total += self.flush(model, batch, ignore_conflicts)
+                batch = []
+        if batch:
+            total += self.flush(model, batch, ignore_conflicts)
+        self.stdout.write(f'Created {total} {label}.')
+
+    def flush(self, model, batch, ignore_conflicts):
+        with transaction.atomic():
+            model.objects.bulk_create(batch, batch_size=self.batch_size, ignore_conflicts=ignore_conflicts)
+        return len(batch)
+
+    def ids_of(self, queryset):
+        return array('q', queryset.order_by('id').values_list('id', flat=True).iterator(chunk_size=self.batch_size))
+
+    def create_users(self, count):
+        password = make_password(SEED_PASSWORD, salt='dekogramseed')
+        width = len(str(count))
+        self.bulk_insert(User, (
+            User(
+                username=f'{SEED_USERNAME_PREFIX}{i:0{width}d}',
+                email=f'{SEED_USERNAME_PREFIX}{i}@example.com',
+                full_name=f'Seed User {i}',
+                password=password,
+                created_at=self.timestamp(365),
+                updated_at=self.now,
+            )
+            for i in range(count)
+        ), 'users')
+        return self.ids_of(User.objects.filter(username__startswith=SEED_USERNAME_PREFIX))
+
+    def popularity_index(self, user_ids):
+        """Zipf-like popularity: a shuffled ranking plus cumulative weights for sampling"""
+        ranked = array('q', user_ids)
+        self.rng.shuffle(ranked)
+        cum_weights = list(accumulate(1 / (rank + 1) ** 0.9 for rank in range(len(ranked))))
+        return ranked, cum_weights
+
+    def sample_popular(self, popularity, k):
+        ranked, cum_weights = popularity
+        total = cum_weights[-1]
+        return [ranked[bisect_left(cum_weights, self.rng.random() * total)] for _ in range(k)]
+
+    def heavy_tailed(self, mean, cap):
+        """Pareto-distributed count with the given mean (shape 2 has mean 2)"""
+        return min(cap, int(mean * 0.5 * self.rng.paretovariate(2.0)))
+
+    def create_follows(self, user_ids, popularity, avg_following):
+        cap = len(user_ids) - 1
+
+        def rows():
+            for follower_id in user_ids:
+                degree = self.heavy_tailed(avg_following, cap)
+                for followed_id in set(self.sample_popular(popularity, degree)):
+                    if followed_id != follower_id:
+                        yield Follow(follower_id=follower_id, followed_id=followed_id, created_at=self.timestamp())
+
+        self.bulk_insert(Follow, rows(), 'follows', ignore_conflicts=True)
+
+    def create_posts(self, user_ids, popularity, posts_per_user, media):
+        total = len(user_ids) * posts_per_user
+
+        def rows():
+            # Popular accounts post more often
+            for i, author_id in enumerate(self.sample_popular(popularity, total)):
+                media_type = 'video' if self.rng.random() < VIDEO_RATIO else 'image'
+                created_at = self.timestamp()
+                yield Post(
+                    user_id=author_id,
+                    caption=self.rng.choice(CAPTIONS),
+                    hashtags=' '.join(self.rng.sample(HASHTAGS, self.rng.randint(0, 3))),
+                    media_type=media_type,
+                    media=media[media_type][i % len(media[media_type])],
+                    location=self.rng.choice(LOCATIONS),
+                    created_at=created_at,
+                    updated_at=created_at,
+                )
+
+        self.bulk_insert(Post, rows(), 'posts')
+        return self.ids_of(Post.objects.filter(user__username__startswith=SEED_USERNAME_PREFIX))
+
+    def create_likes(self, user_ids, post_ids, likes_per_post):
+        def rows():
+            for post_id in post_ids:
+                for user_index in set(self.rng.randrange(len(user_ids)) for _ in range(self.heavy_tailed(likes_per_post, len(user_ids)))):
+                    yield Like(user_id=user_ids[user_index], post_id=post_id, created_at=self.timestamp())
+
+        self.bulk_insert(Like, rows(), 'likes', ignore_conflicts=True)
+
+    def create_comments(self, user_ids, post_ids, comments_per_post):
+        def rows():
+            for post_id in post_ids:
+                for _ in range(self.heavy_tailed(comments_per_post, 10_000)):
+                    created_at = self.timestamp()
+                    yield Comment(
+                        user_id=self.rng.choice(user_ids),
+                        post_id=post_id,
+                        text=self.rng.choice(COMMENTS),
+                        created_at=created_at,
+                        updated_at=created_at,
+                    )
+
+        self.bulk_insert(Comment, rows(), 'comments')
+
+    def create_stories(self, user_ids, story_ratio, media):
+        def rows():
+            for i, user_id in enumerate(user_ids):
+                if self.rng.random() >= story_ratio:
+                    continue
+                for _ in range(self.rng.randint(1, 3)):
+                    created_at = self.now - timedelta(seconds=self.rng.randrange(20 * 3600))
+                    media_type = 'video' if self.rng.random() < VIDEO_RATIO else 'image'
+                    yield Story(
+                        user_id=user_id,
+                        media_type=media_type,
+                        media=media[media_type][i % len(media[media_type])],
+                        created_at=created_at,
+                        expires_at=created_at + timedelta(hours=24),
+                    )
+
+        self.bulk_insert(Story, rows(), 'stories')
+        return self.ids_of(Story.objects.filter(user__username__startswith=SEED_USERNAME_PREFIX))
+
+    def create_story_views(self, user_ids, story_ids, views_per_story):
+        def rows():
+            for story_id in story_ids:
+                for user_index in set(self.rng.randrange(len(user_ids)) for _ in range(self.heavy_tailed(views_per_story, len(user_ids)))):
+                    yield StoryView(story_id=story_id, user_id=user_ids[user_index], created_at=self.now)
+
+        self.bulk_insert(StoryView, rows(), 'story views', ignore_conflicts=True)
+
+    def create_notifications(self, user_ids, post_ids, per_user):
+        kinds = ['like', 'like', 'like', 'comment', 'follow']
+
+        def rows():
+            for user_id in user_ids:
+                for _ in range(self.heavy_tailed(per_user, 1_000)):
+                    kind = self.rng.choice(kinds) if post_ids else 'follow'
+                    yield Notification(
+                        user_id=user_id,
+                        from_user_id=self.rng.choice(user_ids),
+                        notification_type=kind,
+                        post_id=None if kind == 'follow' else self.rng.choice(post_ids),
+                        text=f'New {kind}',
+                        is_read=self.rng.random() < 0.5,
+                        created_at=self.timestamp(30),
+                    )
+
+        self.bulk_insert(Notification, rows(), 'notifications')
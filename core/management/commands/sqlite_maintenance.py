@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Checkpoint and truncate the SQLite write-ahead log and refresh the '
+        'query planner statistics. Run it from cron, or with --interval.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--analyze', action='store_true',
+                            help='Run a full ANALYZE instead of PRAGMA optimize, which only analyzes tables that need it')
+        parser.add_argument('--interval', type=float,
+                            help='Repeat every this many seconds until interrupted')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'Database "{options["database"]}" is not SQLite.')
+        while True:
+            self.maintain(connection, options['analyze'])
+            if not options['interval']:
+                return
+            # Do not hold the connection between runs
+            connection.close()
+            time.sleep(options['interval'])
+
+    def maintain(self, connection, analyze):
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            # TRUNCATE waits for readers (up to the busy timeout) and empties the WAL file
+            busy, wal_pages, checkpointed = cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+            if analyze:
+                cursor.execute('ANALYZE')
+            else:
+                # Bounds the rows each index is sampled with, so it stays quick on large tables
+                cursor.execute('PRAGMA analysis_limit = 1000')
+                cursor.execute('PRAGMA optimize')
+        if busy:
+            self.stdout.write(self.style.WARNING(
+                f'Checkpoint incomplete: {checkpointed} of {wal_pages} WAL pages copied; readers were busy.'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'{"ANALYZE" if analyze else "optimize"} done and WAL checkpointed '
+            f'in {time.perf_counter() - started:.2f}s.'
+        ))
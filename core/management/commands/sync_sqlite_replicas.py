@@ -0,0 +1,39 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SQLITE = 'django.db.backends.sqlite3'
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the SQLite primary database over its SQLite replicas, to try '
+        'replica routing locally. Run it again to simulate replication.'
+    )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS].settings_dict
+        if primary['ENGINE'] != SQLITE:
+            raise CommandError('The primary is not SQLite; its replicas are kept up to date by the database server.')
+        replicas = [alias for alias in connections if alias != DEFAULT_DB_ALIAS]
+        if not replicas:
+            raise CommandError('No replicas configured; set DEKOGRAM_REPLICA_URLS.')
+
+        source = sqlite3.connect(primary['NAME'])
+        try:
+            for alias in replicas:
+                replica = connections[alias].settings_dict
+                if replica['ENGINE'] != SQLITE:
+                    raise CommandError(f'Replica {alias} is not SQLite.')
+                connections[alias].close()
+                target = sqlite3.connect(replica['NAME'])
+                try:
+                    # The backup API copies a consistent snapshot page by page
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f'{alias}: {replica["NAME"]}')
+        finally:
+            source.close()
+        self.stdout.write(self.style.SUCCESS(f'Copied the primary to {len(replicas)} replica(s).'))
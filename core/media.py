@@ -0,0 +1,274 @@
+"""
+Video metadata and poster frames for uploaded posts.
+
+``process_video()`` fills in a video post's ``duration``, ``width``,
+``height`` and ``poster`` so grids can draw an image tile and size it
+before any video data loads.
+
+Uploads are not held up by it: ``process_later()`` queues the post once its
+row is committed, and a small per-process thread pool
+(``MEDIA_PIPELINE['WORKERS']``) processes and saves it, which bumps the
+post's versions like any other save. Until then the fields are empty and
+clients show the video itself. Queued posts are lost if the process exits;
+``python manage.py process_media`` fills in any video still without them.
+
+MP4 and QuickTime files are read with ``parse_mp4()``, which walks the
+container's boxes and reads only the ``moov`` header, seeking past the
+media data. Other containers (AVI, WMV) need ``ffprobe``. The poster is the
+frame at ``POSTER_AT`` seconds (or mid-way through shorter clips), encoded
+as a JPEG by a local ``ffmpeg``. Without ffmpeg, or when a file has no
+decodable frame, ``poster`` stays empty and clients fall back to the video.
+"""
+import io
+import json
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, connections, transaction
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'FFMPEG': 'ffmpeg',  # command name or path; None disables ffmpeg
+    'FFPROBE': 'ffprobe',
+    'TIMEOUT': 30,  # seconds per ffmpeg/ffprobe run
+    'POSTER_AT': 1.0,  # seconds into the video
+    'POSTER_SIZE': 1080,  # longest side of the poster, in pixels
+    'POSTER_QUALITY': 4,  # ffmpeg -q:v, 2 (best) to 31
+    'WORKERS': 2,  # videos processed at once, per process
+}
+
+VIDEO_FIELDS = ['duration', 'width', 'height', 'poster']
+
+MP4_EXTENSIONS = {'.mp4', '.m4v', '.mov'}
+
+# Boxes on the path from the file's top level to the ones read here
+CONTAINERS = {b'moov', b'trak'}
+
+
+class VideoInfo(NamedTuple):
+    duration: float  # seconds
+    width: int
+    height: int
+
+
+def media_settings():
+    return {**DEFAULTS, **getattr(settings, 'MEDIA_PIPELINE', {})}
+
+
+def _boxes(f, end):
+    """``(type, payload offset, payload size)`` of each box from ``f``'s position up to ``end``"""
+    while end is None or f.tell() + 8 <= end:
+        start = f.tell()
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack('>I4s', header)
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+        elif size == 0:
+            # The last box, running to the end of the file
+            size = (end if end is not None else f.seek(0, io.SEEK_END)) - start
+            f.seek(start + 8)
+        payload = f.tell()
+        if size < payload - start:
+            return
+        yield kind, payload, start + size - payload
+        f.seek(start + size)
+
+
+def _mvhd(data):
+    """``(timescale, duration)`` from a movie header"""
+    if data[0] == 1:
+        return struct.unpack_from('>IQ', data, 20)
+    return struct.unpack_from('>II', data, 12)
+
+
+def _tkhd(data):
+    """``(width, height)`` of a track as displayed, or ``(0, 0)`` for audio"""
+    # Width and height follow the 36-byte matrix, as 16.16 fixed point
+    offset = 88 if data[0] == 1 else 76
+    a, b = struct.unpack_from('>ii', data, offset - 36)
+    width, height = (value >> 16 for value in struct.unpack_from('>II', data, offset))
+    # A matrix of a = 0, b = +-1 turns the picture a quarter, as phones record portrait clips
+    return (height, width) if a == 0 and b != 0 else (width, height)
+
+
+def parse_mp4(f):
+    """``VideoInfo`` of an MP4/QuickTime file object, or None if it has no movie header"""
+    f.seek(0)
+    timescale = duration = None
+    width = height = 0
+    stack = [None]
+    pending = [_boxes(f, None)]
+    while pending:
+        for kind, offset, size in pending[-1]:
+            if kind in CONTAINERS:
+                pending.append(_boxes(f, offset + size))
+                stack.append(kind)
+                break
+            if kind == b'mvhd':
+                timescale, duration = _mvhd(f.read(min(size, 32)))
+            elif kind == b'tkhd' and not width:
+                width, height = _tkhd(f.read(min(size, 96)))
+        else:
+            pending.pop()
+            if stack.pop() == b'moov':
+                break
+    if not timescale:
+        return None
+    return VideoInfo(round(duration / timescale, 3), width, height)
+
+
+def _tool(name):
+    command = media_settings()[name]
+    return shutil.which(command) if command else None
+
+
+def ffprobe(path):
+    """``VideoInfo`` from ffprobe, or None without ffprobe or a readable video stream"""
+    command = _tool('FFPROBE')
+    if command is None:
+        return None
+    try:
+        result = subprocess.run(
+            [command, '-v', 'error', '-select_streams', 'v:0', '-print_format', 'json',
+             '-show_entries', 'format=duration:stream=width,height:stream_side_data=rotation', path],
+            capture_output=True, timeout=media_settings()['TIMEOUT'], check=True,
+        )
+        probe = json.loads(result.stdout)
+        stream = probe['streams'][0]
+        width, height = stream['width'], stream['height']
+    except (subprocess.SubprocessError, OSError, ValueError, KeyError, IndexError):
+        logger.warning('ffprobe could not read %s', path, exc_info=True)
+        return None
+    rotation = next((data.get('rotation') for data in stream.get('side_data_list', []) if 'rotation' in data), 0)
+    if abs(int(rotation)) % 180 == 90:
+        width, height = height, width
+    duration = float(probe.get('format', {}).get('duration') or 0)
+    return VideoInfo(round(duration, 3), width, height)
+
+
+def render_poster(path, duration):
+    """JPEG bytes of the poster frame, or None without ffmpeg or a decodable frame"""
+    command = _tool('FFMPEG')
+    if command is None:
+        return None
+    config = media_settings()
+    at = min(config['POSTER_AT'], duration / 2) if duration else 0
+    size = config['POSTER_SIZE']
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'poster.jpg')
+        try:
+            subprocess.run(
+                [command, '-v', 'error', '-nostdin', '-ss', f'{at:.3f}', '-i', path, '-frames:v', '1',
+                 '-vf', f"scale='min({size},iw)':'min({size},ih)':force_original_aspect_ratio=decrease",
+                 '-q:v', str(config['POSTER_QUALITY']), '-y', output],
+                capture_output=True, timeout=config['TIMEOUT'], check=True,
+            )
+            with open(output, 'rb') as f:
+                return f.read() or None
+        except (subprocess.SubprocessError, OSError):
+            logger.warning('ffmpeg could not render a poster for %s', path, exc_info=True)
+            return None
+
+
+def video_info(field_file):
+    """``VideoInfo`` of a stored video, from its container or from ffprobe"""
+    info = None
+    if os.path.splitext(field_file.name)[1].lower() in MP4_EXTENSIONS:
+        with field_file.open('rb') as f:
+            try:
+                info = parse_mp4(f)
+            except (struct.error, OSError):
+                logger.warning('Could not parse %s as MP4', field_file.name, exc_info=True)
+    if (info is None or not info.width) and _local_path(field_file):
+        info = ffprobe(_local_path(field_file)) or info
+    return info
+
+
+def _local_path(field_file):
+    try:
+        return field_file.path
+    except NotImplementedError:
+        # Remote storage; only the pure-Python parser applies
+        return None
+
+
+def process_video(post):
+    """Fill in ``post``'s video fields from its stored media. Does not save the post."""
+    info = video_info(post.media)
+    if info is not None:
+        post.duration, post.width, post.height = info
+    path = _local_path(post.media)
+    poster = render_poster(path, info.duration if info else 0) if path else None
+    if poster is not None:
+        name = os.path.splitext(os.path.basename(post.media.name))[0]
+        post.poster.save(f'{name}.jpg', ContentFile(poster), save=False)
+
+
+def process_and_save(post):
+    """Process ``post``'s video and save the fields; post_save bumps its versions"""
+    process_video(post)
+    post.save(update_fields=VIDEO_FIELDS)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=media_settings()['WORKERS'], thread_name_prefix='media')
+        return _pool
+
+
+def _reset_after_fork():
+    # The parent's pool threads do not exist in a forked worker
+    global _pool, _pool_lock
+    _pool, _pool_lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def process_post(post_id):
+    """``process_and_save()`` the video post ``post_id``, unless it or its file is gone"""
+    post = Post.objects.filter(pk=post_id, media_type='video').first()
+    if post is not None and post.media.storage.exists(post.media.name):
+        process_and_save(post)
+
+
+def _process(post_id):
+    try:
+        process_post(post_id)
+    except Exception:
+        logger.exception('Could not process the video of post %s', post_id)
+    finally:
+        close_old_connections()
+
+
+def _submit(post_id):
+    if any(connection.in_atomic_block for connection in connections.all()):
+        # Run from inside a transaction (as in a TestCase), whose rows a pool thread cannot see
+        process_post(post_id)
+        return
+    get_pool().submit(_process, post_id)
+
+
+def process_later(post):
+    """Process ``post``'s video on the pool once the current transaction commits"""
+    transaction.on_commit(lambda: _submit(post.pk))
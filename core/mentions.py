@@ -0,0 +1,72 @@
+"""
+@mentions in post captions and comments.
+
+Every distinct ``@username`` in a message gets one ``mention``
+notification. All the usernames are resolved with a single
+``username__in`` query and the notifications are written with a single
+``bulk_create``, so a message costs two queries however many people it
+mentions. Only the first ``MENTIONS['MAX_PER_MESSAGE']`` distinct names
+count; the rest of a spammy message is ignored. The author, deactivated
+accounts and anyone the caller already notifies (such as the post's
+author on a comment) are skipped.
+"""
+import re
+
+from django.conf import settings
+
+from .models import User, Notification
+from .versions import bump
+
+DEFAULTS = {
+    'MAX_PER_MESSAGE': 10,
+}
+
+# '@' not preceded by a word character, so email addresses are not mentions.
+# Usernames may contain letters, digits and . + - _ (Django's validator).
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.+-]+)')
+
+
+def mention_settings():
+    return {**DEFAULTS, **getattr(settings, 'MENTIONS', {})}
+
+
+def parse_mentions(text, limit=None):
+    """Distinct mentioned usernames in order of appearance, at most ``limit`` of them"""
+    if limit is None:
+        limit = mention_settings()['MAX_PER_MESSAGE']
+    names = []
+    for match in MENTION_RE.finditer(text or ''):
+        # A mention at the end of a sentence: "thanks @alice."
+        name = match.group(1).rstrip('.')
+        if name and name not in names:
+            names.append(name)
+            if len(names) >= limit:
+                break
+    return names
+
+
+def notify_mentions(text, author, post, where='a post', skip=()):
+    """Notify the users mentioned in ``text`` ("... mentioned you in <where>"). Returns the ids notified."""
+    names = parse_mentions(text)
+    if not names:
+        return []
+    user_ids = list(
+        User.objects.filter(username__in=names, is_active=True)
+        .exclude(pk__in=[author.pk, *skip])
+        .values_list('id', flat=True)
+    )
+    if not user_ids:
+        return []
+    Notification.objects.bulk_create([
+        Notification(
+            user_id=user_id,
+            from_user=author,
+            notification_type='mention',
+            post=post,
+            text=f'{author.username} mentioned you in {where}',
+        )
+        for user_id in user_ids
+    ])
+    # bulk_create sends no post_save signals
+    bump(*[f'notifications:{user_id}' for user_id in user_ids])
+    return user_ids
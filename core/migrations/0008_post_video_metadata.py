@@ -0,0 +1,33 @@
+# Generated by Django 5.2.9 on 2026-10-19 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_comment_replies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='duration',
+            field=models.FloatField(blank=True, help_text='Seconds', null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='poster',
+            field=models.ImageField(blank=True, upload_to='posters/'),
+        ),
+    ]
@@ -52,6 +52,11 @@ class Follow(models.Model):
     class Meta:
         unique_together = ('follower', 'followed')
         ordering = ['-created_at']
+        indexes = [
+            # Follower and following lists, newest first, paged on (created_at, id)
+            models.Index(fields=['followed', '-created_at', '-id'], name='follow_followed_created_idx'),
+            models.Index(fields=['follower', '-created_at', '-id'], name='follow_follower_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.follower.username} follows {self.followed.username}"
@@ -70,11 +75,25 @@ class Post(models.Model):
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPES)
     media = models.FileField(upload_to='posts/')
     location = models.CharField(max_length=200, blank=True)
+    # Videos only, filled in from the upload by core.media
+    duration = models.FloatField(null=True, blank=True, help_text='Seconds')
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    poster = models.ImageField(upload_to='posters/', blank=True)
+    # Denormalized, maintained by core.counters
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Feeds and profiles: one author's posts, newest first
+            models.Index(fields=['user', '-created_at'], name='post_user_created_idx'),
+            # Explore: newest videos
+            models.Index(fields=['media_type', '-created_at'], name='post_media_created_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         if self.media:
@@ -95,10 +114,10 @@ class Post(models.Model):
                 img.save(self.media.path, optimize=True, quality=85)
     
     def likes_count(self):
-        return self.likes.count()
+        return self.like_count
     
     def comments_count(self):
-        return self.comments.count()
+        return self.comment_count
     
     def is_liked_by(self, user):
         return self.likes.filter(user=user).exists()
@@ -122,10 +141,15 @@ class Story(models.Model):
     media = models.FileField(upload_to='stories/')
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     expires_at = models.DateTimeField(db_index=True)
+    view_count = models.PositiveIntegerField(default=0)  # maintained by core.counters
     
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = 'Stories'
+        indexes = [
+            # Active stories of the followed users
+            models.Index(fields=['user', 'expires_at'], name='story_user_expires_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         if self.media:
@@ -149,6 +173,9 @@ class Story(models.Model):
     def is_expired(self):
         return timezone.now() > self.expires_at
     
+    def views_count(self):
+        return self.view_count
+    
     def __str__(self):
         return f"Story by {self.user.username} - {self.created_at}"
 
@@ -170,12 +197,26 @@ class Comment(models.Model):
     """Comment model for posts"""
     user = models.ForeignKey(User, related_name='comments', on_delete=models.CASCADE)
     post = models.ForeignKey(Post, related_name='comments', on_delete=models.CASCADE)
+    # Replies are one level deep: a reply's parent is always a top-level comment
+    parent = models.ForeignKey(
+        'self', related_name='replies', null=True, blank=True, on_delete=models.CASCADE, db_index=False
+    )
     text = models.TextField()
+    # Denormalized, maintained by core.counters
+    reply_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['post', '-created_at'], name='comment_post_created_idx'),
+            # A post's top-level comments, newest first, paged on (created_at, id)
+            models.Index(fields=['post', '-created_at', '-id'], condition=models.Q(parent=None),
+                         name='comment_top_level_idx'),
+            # A thread's replies, oldest first; also serves the parent foreign key
+            models.Index(fields=['parent', 'created_at', 'id'], name='comment_reply_idx'),
+        ]
     
     def __str__(self):
         return f"Comment by {self.user.username} on {self.post.id}"
@@ -228,6 +269,11 @@ class Notification(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='notification_user_created_idx'),
+            # Only unread rows, which mark-read and unread counts look for
+            models.Index(fields=['user'], condition=models.Q(is_read=False), name='notification_unread_idx'),
+        ]
     
     def __str__(self):
         return f"Notification for {self.user.username} - {self.notification_type}"
@@ -258,3 +304,19 @@ class Report(models.Model):
     
     def __str__(self):
         return f"Report by {self.reporter.username} - {self.reason}"
+
+
+class IdempotencyKey(models.Model):
+    """Stored response of a write sent with an Idempotency-Key header"""
+    user = models.ForeignKey(User, related_name='idempotency_keys', on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)  # null while in progress
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f"Idempotency key {self.key} for {self.user.username}"
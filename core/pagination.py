@@ -0,0 +1,118 @@
+"""
+Keyset ("seek") pagination.
+
+Each page continues after the ordering values of the previous page's last
+row (``WHERE (created_at, id) < (last_created_at, last_id)``) instead of
+skipping rows with ``OFFSET``. A deep page costs the same as the first one
+and rows added in the meantime are neither repeated nor skipped. The price is
+that there is only a ``next`` link and no total count.
+
+The ordering must end in a unique column so that every row has a distinct
+position, and an index should cover it.
+"""
+import base64
+import binascii
+import datetime
+import json
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering=('-created_at', '-id')):
+        self.ordering = ordering
+        self.next_position = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            position = self.to_python(queryset.model, self.decode_cursor(cursor))
+            queryset = queryset.filter(self.after(position))
+        rows = list(queryset[:page_size + 1])
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_position = [self.value(rows[-1], field.lstrip('-')) for field in self.ordering]
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def after(self, position):
+        """Rows after ``position`` in the ordering"""
+        names = [field.lstrip('-') for field in self.ordering]
+        ops = ['lt' if field.startswith('-') else 'gt' for field in self.ordering]
+        # (a, b) < (x, y) is a < x OR (a = x AND b < y); the bound on the
+        # first column on its own lets the index narrow the range
+        rows_after = [
+            Q(**dict(zip(names[:i], position[:i])), **{f'{names[i]}__{ops[i]}': position[i]})
+            for i in range(len(names))
+        ]
+        return Q(**{f'{names[0]}__{ops[0]}e': position[0]}) & reduce(Q.__or__, rows_after)
+
+    def to_python(self, model, position):
+        """``position``'s values as their ordering fields' Python types; NotFound if any does not fit"""
+        if len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        values = []
+        for path, value in zip(self.ordering, position):
+            *relations, name = path.lstrip('-').split('__')
+            field_model = model
+            for relation in relations:
+                field_model = field_model._meta.get_field(relation).related_model
+            try:
+                value = field_model._meta.get_field(name).to_python(value)
+            except (ValidationError, ValueError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+            # A cursor from a client need not be one this class wrote
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            values.append(value)
+        return values
+
+    @staticmethod
+    def value(row, path):
+        for attr in path.split('__'):
+            row = getattr(row, attr)
+        # Full precision: the cursor must compare equal to the stored value
+        return row.isoformat() if isinstance(row, datetime.datetime) else row
+
+    def encode_cursor(self, position):
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (binascii.Error, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
@@ -0,0 +1,243 @@
+"""
+Opt-in request profiling.
+
+On demand: a staff user adds ``?_profile=cprofile`` (or ``sample``), or the
+``X-Profile`` header, to any request. The view runs under cProfile or a
+stack sampler and the output is stored in ``PROFILING['OUTPUT_DIR']``; its
+file name comes back in the ``X-Profile-Output`` header. Add
+``_profile_return=1`` to get the profile as the response body instead.
+
+Continuous: with ``PROFILING['CONTINUOUS']`` on, a background thread samples
+the stacks of in-flight requests and aggregates them per view
+(``PostViewSet.list``, ``profile_view``, ...) into
+``continuous-<pid>.collapsed``. The whole request is sampled, middleware
+included, while Django dispatches the view as usual. Only sync (WSGI)
+middleware chains are sampled.
+
+Sampled output uses the collapsed-stack format (``frame;frame;frame count``)
+understood by flamegraph.pl and speedscope. cProfile output is a standard
+``.prof`` file for snakeviz or flameprof.
+"""
+import atexit
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse
+
+DEFAULTS = {
+    'OUTPUT_DIR': Path(settings.BASE_DIR) / 'profiles',
+    'CONTINUOUS': False,
+    'SAMPLE_INTERVAL': 0.005,
+    'SAMPLE_RATE': 1.0,
+    'FLUSH_INTERVAL': 30,
+}
+
+PROFILE_MODES = ('cprofile', 'sample')
+
+
+def profiling_settings():
+    return {**DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def view_name(view_func, method='GET'):
+    """``PostViewSet.list`` for DRF viewset actions, the function name otherwise"""
+    cls = getattr(view_func, 'cls', None)
+    if cls is not None:
+        actions = getattr(view_func, 'actions', None) or {}
+        return f'{cls.__name__}.{actions.get(method.lower(), "dispatch")}'
+    return getattr(view_func, '__name__', view_func.__class__.__name__)
+
+
+def collapse(frame, stop_code=None):
+    """Render a frame's stack root-first as ``module.func;module.func``"""
+    names = []
+    while frame is not None and frame.f_code is not stop_code:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Sample one thread's stack every ``interval`` seconds while running"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[collapse(frame)] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
+
+
+class ContinuousSampler:
+    """
+    Process-wide sampler for the continuous mode. Request threads register
+    the view they are running; one daemon thread samples only those threads.
+    """
+
+    def __init__(self, interval, flush_interval, output_dir, stop_code=None):
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self.path = Path(output_dir) / f'continuous-{os.getpid()}.collapsed'
+        self.stop_code = stop_code
+        self.active = {}
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='continuous-sampler', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            if self.active:
+                frames = sys._current_frames()
+                with self.lock:
+                    for thread_id, name in list(self.active.items()):
+                        frame = frames.get(thread_id)
+                        if frame is not None:
+                            self.counts[f'{name};{collapse(frame, self.stop_code)}'] += 1
+            if time.monotonic() - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            lines = ''.join(f'{stack} {count}\n' for stack, count in self.counts.most_common())
+        if not lines:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(lines)
+        os.replace(tmp, self.path)
+
+
+_continuous_sampler = None
+_continuous_lock = threading.Lock()
+
+
+def get_continuous_sampler(config):
+    global _continuous_sampler
+    if _continuous_sampler is None:
+        with _continuous_lock:
+            if _continuous_sampler is None:
+                _continuous_sampler = ContinuousSampler(
+                    config['SAMPLE_INTERVAL'], config['FLUSH_INTERVAL'], config['OUTPUT_DIR'],
+                    stop_code=ProfilingMiddleware.__call__.__code__,
+                )
+    return _continuous_sampler
+
+
+def is_staff(request):
+    """Check staff status for session users and JWT-authenticated API clients"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+    from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+
+    from .authentication import CachedJWTAuthentication
+
+    try:
+        result = CachedJWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return False
+    return bool(result and result[0].is_staff)
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        config = profiling_settings()
+        # An async chain has no one thread to sample, so only sync chains are
+        # sampled; the coroutine of an async chain is returned as is
+        if self.async_mode or not config['CONTINUOUS'] or random.random() >= config['SAMPLE_RATE']:
+            return self.get_response(request)
+        sampler = get_continuous_sampler(config)
+        thread_id = threading.get_ident()
+        # Renamed after the view by process_view() once it is resolved
+        sampler.active[thread_id] = request.method
+        try:
+            return self.get_response(request)
+        finally:
+            sampler.active.pop(thread_id, None)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Async endpoints are named and profiled through their sync fallback
+        view_func = getattr(view_func, 'sync_view', view_func)
+        sampler = _continuous_sampler
+        thread_id = threading.get_ident()
+        if sampler is not None and thread_id in sampler.active:
+            sampler.active[thread_id] = view_name(view_func, request.method)
+
+        mode = request.GET.get('_profile') or request.headers.get('X-Profile')
+        if mode in PROFILE_MODES and is_staff(request):
+            return self.profile(request, mode, profiling_settings(), view_func, view_args, view_kwargs)
+        return None
+
+    def run_view(self, request, view_func, view_args, view_kwargs):
+        response = view_func(request, *view_args, **view_kwargs)
+        # DRF and template responses render lazily; include rendering in the profile
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+        return response
+
+    def profile(self, request, mode, config, view_func, view_args, view_kwargs):
+        output_dir = Path(config['OUTPUT_DIR'])
+        output_dir.mkdir(parents=True, exist_ok=True)
+        stem = f'{time.strftime("%Y%m%d-%H%M%S")}-{view_name(view_func, request.method)}-{os.getpid()}'
+
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            response = profiler.runcall(self.run_view, request, view_func, view_args, view_kwargs)
+            path = output_dir / f'{stem}.prof'
+            profiler.dump_stats(path)
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(50)
+            body = text.getvalue()
+        else:
+            with StackSampler(threading.get_ident(), config['SAMPLE_INTERVAL'] / 5) as sampler:
+                response = self.run_view(request, view_func, view_args, view_kwargs)
+            path = output_dir / f'{stem}.collapsed'
+            body = sampler.collapsed()
+            path.write_text(body)
+
+        if request.GET.get('_profile_return'):
+            response = HttpResponse(body, content_type='text/plain; charset=utf-8')
+        response['X-Profile-Output'] = path.name
+        return response
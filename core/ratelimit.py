@@ -0,0 +1,198 @@
+"""
+Token-bucket rate limits for the write endpoints.
+
+Each scope in ``RATE_LIMITS['SCOPES']`` is a bucket of N requests that
+refills evenly over the period: ``'30/min'`` lets a client send 30 writes
+at once and then one every two seconds. Signed-in requests are counted per
+user and anonymous ones per client IP: ``REMOTE_ADDR``, or with
+``NUM_PROXIES`` in REST_FRAMEWORK set, the ``X-Forwarded-For`` entry the
+nearest proxy saw. Reads are not limited, except by ``LookupThrottle`` on
+the public lookups that reveal whether an account exists.
+
+A bucket is kept as one timestamp, the moment it will be full again (the
+"generic cell rate algorithm" form of a token bucket), so a check is a
+single read and write. ``RATE_LIMITS['BACKEND']`` picks where:
+
+    'locmem'  a dict in each process, so every worker has its own buckets
+    'cache'   the ``RATE_LIMITS['CACHE']`` cache, shared by the workers that
+              use it. On Redis the check is one atomic script; other caches
+              read and write separately, so racing requests can slip a few
+              writes past the limit.
+
+DRF views name their scope in ``throttle_scopes`` (action -> scope) or
+``throttle_scope``. Template views use ``@rate_limit(scope)``. Refused
+requests get 429 with ``Retry-After``. The async views in
+``core/async_views.py`` skip DRF's throttling, which is fine while they only
+serve reads.
+"""
+import functools
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.http import JsonResponse
+from rest_framework.throttling import BaseThrottle
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'locmem',  # or 'cache'
+    'CACHE': 'default',
+    'SCOPES': {},  # scope -> 'count/period', period one of s, min, hour, day
+}
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+# Past this many buckets the locmem store drops the ones that are full again
+LOCMEM_MAX_KEYS = 10000
+
+
+def ratelimit_settings():
+    return {**DEFAULTS, **getattr(settings, 'RATE_LIMITS', {})}
+
+
+def parse_rate(rate):
+    """``'30/min'`` -> (capacity 30, 2.0 seconds per token)"""
+    count, _, period = rate.partition('/')
+    count = int(count)
+    return count, PERIODS[period] / count
+
+
+def consume(full_at, capacity, interval, now):
+    """
+    Take one token from the bucket that is full again at ``full_at``.
+    Returns ``(allowed, new full_at, seconds until a token is free)``.
+    """
+    start = max(full_at or now, now)
+    new_full_at = start + interval
+    # A bucket with all ``capacity`` tokens gone is full again capacity * interval from now
+    wait = new_full_at - capacity * interval - now
+    if wait > 0:
+        return False, full_at, wait
+    return True, new_full_at, 0.0
+
+
+class LocMemStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.full_at = {}
+
+    def take(self, key, capacity, interval, now):
+        with self.lock:
+            allowed, full_at, wait = consume(self.full_at.get(key), capacity, interval, now)
+            if allowed:
+                self.full_at[key] = full_at
+                if len(self.full_at) > LOCMEM_MAX_KEYS:
+                    self.full_at = {key: value for key, value in self.full_at.items() if value > now}
+            return allowed, wait
+
+    def clear(self):
+        with self.lock:
+            self.full_at.clear()
+
+
+class CacheStore:
+    # consume() as one atomic step on the Redis server
+    SCRIPT = """
+local now = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local interval = tonumber(ARGV[3])
+local full_at = math.max(tonumber(redis.call('GET', KEYS[1]) or ARGV[1]), now)
+local wait = full_at + interval - capacity * interval - now
+if wait > 0 then
+    return tostring(wait)
+end
+redis.call('SET', KEYS[1], tostring(full_at + interval), 'PX', math.ceil((full_at + interval - now) * 1000))
+return '0'
+"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def take(self, key, capacity, interval, now):
+        cache = caches[self.alias]
+        key = f'ratelimit:{key}'
+        if isinstance(cache, RedisCache):
+            client = cache._cache.get_client(key, write=True)
+            wait = float(client.eval(self.SCRIPT, 1, cache.make_and_validate_key(key), now, capacity, interval))
+            return wait <= 0, max(wait, 0.0)
+        allowed, full_at, wait = consume(cache.get(key), capacity, interval, now)
+        if allowed:
+            cache.set(key, full_at, timeout=max(1, math.ceil(full_at - now)))
+        return allowed, wait
+
+
+locmem_store = LocMemStore()
+
+
+def get_store(config):
+    if config['BACKEND'] == 'cache':
+        return CacheStore(config['CACHE'])
+    return locmem_store
+
+
+def check(scope, ident):
+    """Take a token from ``ident``'s bucket in ``scope``. Returns ``(allowed, seconds to wait)``."""
+    config = ratelimit_settings()
+    rate = config['SCOPES'].get(scope)
+    if not config['ENABLED'] or rate is None:
+        return True, 0.0
+    capacity, interval = parse_rate(rate)
+    return get_store(config).take(f'{scope}:{ident}', capacity, interval, time.time())
+
+
+def client_ident(request, by_ip=False):
+    """The bucket owner: the signed-in user, or the client's IP address"""
+    user = getattr(request, 'user', None)
+    if not by_ip and user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'ip:{BaseThrottle().get_ident(request)}'
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Limits the unsafe methods of views that name a scope; see the module docstring"""
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        if request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return True
+        scopes = getattr(view, 'throttle_scopes', None)
+        scope = scopes.get(getattr(view, 'action', None)) if scopes else getattr(view, 'throttle_scope', None)
+        if scope is None:
+            return True
+        allowed, self.wait_seconds = check(scope, client_ident(request))
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LookupThrottle(TokenBucketThrottle):
+    """Limits every request, reads included, in the ``lookup`` scope; for a view's ``throttle_classes``"""
+    scope = 'lookup'
+
+    def allow_request(self, request, view):
+        allowed, self.wait_seconds = check(self.scope, client_ident(request))
+        return allowed
+
+
+def rate_limit(scope, methods=('POST',)):
+    """Limit a template view's ``methods`` per client IP, answering 429 with Retry-After"""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                allowed, wait = check(scope, client_ident(request, by_ip=True))
+                if not allowed:
+                    retry_after = math.ceil(wait)
+                    response = JsonResponse(
+                        {'error': f'Too many attempts. Try again in {retry_after} seconds.'}, status=429
+                    )
+                    response['Retry-After'] = str(retry_after)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,160 @@
+"""
+Read replicas with read-your-writes.
+
+``READ_REPLICAS['ALIASES']`` names replica databases (see
+``dekogram_project/databases.py``). Only views that opt in read from one:
+viewsets with ``ReplicaReadMixin`` for their ``replica_actions`` and
+function views with ``@replica_reads``, for GET requests. Everything else,
+including every write, uses the primary.
+
+A replica may lag behind the primary, so a request reads from the primary
+when
+- it has written anything itself (the router sees every write)
+- its user wrote anything within ``STICKY_SECONDS``: ``ReplicaMiddleware``
+  pins the user in the cache after a request that wrote
+- a content version of its ETag changed within ``STICKY_SECONDS``, so a
+  fresh ETag is never attached to stale content (``core/versions.py``)
+- the primary is inside a transaction
+"""
+import contextvars
+import random
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULTS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': 5,
+}
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+def replica_settings():
+    return {**DEFAULTS, **getattr(settings, 'READ_REPLICAS', {})}
+
+
+class RoutingState:
+    """Where the current request reads from"""
+    __slots__ = ('alias', 'wrote')
+
+    def __init__(self):
+        self.alias = None
+        self.wrote = False
+
+
+# Per request (and per task under ASGI); fan_out() copies it into its threads
+_state = contextvars.ContextVar('replica_routing', default=None)
+
+
+def pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def read_from_replica(user):
+    """Send the current request's reads to a replica, unless it must see the primary"""
+    state = _state.get()
+    aliases = replica_settings()['ALIASES']
+    if state is None or state.wrote or not aliases:
+        return
+    if user.is_authenticated and cache.get(pin_key(user.id)):
+        return
+    state.alias = random.choice(aliases)
+
+
+def changed_ago(seconds):
+    """Tell the router that content the request shows changed ``seconds`` ago"""
+    state = _state.get()
+    if state is not None and state.alias is not None and seconds < replica_settings()['STICKY_SECONDS']:
+        state.alias = None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.alias is None or state.wrote:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware:
+    """Gives each request its routing state and pins users whose request wrote"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.sticky_seconds = replica_settings()['STICKY_SECONDS']
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            return self.get_response(request)
+        finally:
+            _state.reset(token)
+            self.pin(request, state)
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            return await self.get_response(request)
+        finally:
+            _state.reset(token)
+            if state.wrote:
+                await sync_to_async(self.pin)(request, state)
+
+    def pin(self, request, state):
+        if not state.wrote:
+            return
+        # DRF sets request.user for token-authenticated requests too
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            cache.set(pin_key(user.id), 1, self.sticky_seconds)
+
+
+class ReplicaReadMixin:
+    """Viewsets whose ``replica_actions`` may read from a replica on GET"""
+    replica_actions = ('list', 'retrieve')
+
+    def route_reads(self, request):
+        if request.method in SAFE_METHODS and self.action in self.replica_actions:
+            read_from_replica(request.user)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.route_reads(request)
+
+
+def replica_reads(view):
+    """Function views that may read from a replica on GET"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            read_from_replica(request.user)
+        return view(request, *args, **kwargs)
+    return wrapper
@@ -1,59 +1,141 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
 from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
 from .models import Post, Story, Comment, Like, Save, Follow, Notification, Report, StoryView
 
 User = get_user_model()
 
-class UserShortSerializer(serializers.ModelSerializer):
+
+def parse_field_list(value):
+    """Split a comma-separated query parameter into field paths"""
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class SparseFieldsMixin:
+    """
+    Lets clients trim a response with ``?fields=id,media,user.username`` and
+    opt in to ``Meta.expandable_fields`` with ``?expand=``. Explicit
+    ``fields``/``expand`` arguments win over the request's query parameters.
+    Views read ``serializer.fields`` to skip the annotations and joins of
+    fields that will not be rendered. Serializers that validate input ignore
+    ``?fields=``, which would otherwise drop writable fields.
+    """
+
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        query_params = getattr(request, 'query_params', None)
+        writing = 'data' in kwargs or (request is not None and request.method not in SAFE_METHODS)
+        if writing:
+            query_params = None
+        if fields is None and query_params is not None and 'fields' in query_params:
+            fields = parse_field_list(query_params['fields'])
+        if expand is None and query_params is not None:
+            expand = parse_field_list(query_params.get('expand'))
+        self._sparse_fields = fields
+        self._expand = expand or []
+
+    @cached_property
+    def fields(self):
+        fields = super().fields
+        prune_fields(self, fields, self._sparse_fields, self._expand)
+        return fields
+
+
+def prune_fields(serializer, fields, wanted, expand):
+    """Drop unrequested fields, recursing into nested serializers for dotted paths"""
+    expandable = set(getattr(getattr(serializer, 'Meta', None), 'expandable_fields', ()))
+    top_expand = {path.split('.', 1)[0] for path in expand}
+    for name in expandable - top_expand - {path.split('.', 1)[0] for path in wanted or ()}:
+        fields.pop(name, None)
+    if wanted is None:
+        return
+
+    nested = {}
+    for path in wanted:
+        head, _, rest = path.partition('.')
+        nested.setdefault(head, [])
+        if rest:
+            nested[head].append(rest)
+    for name in list(fields):
+        if name not in nested:
+            fields.pop(name)
+        elif nested[name] and isinstance(fields[name], serializers.Serializer):
+            prune_fields(fields[name], fields[name].fields, nested[name], [])
+
+
+class UserShortSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'full_name', 'avatar', 'is_verified']
 
-class LikeSerializer(serializers.ModelSerializer):
+class FollowUserSerializer(UserShortSerializer):
+    """A row of a follower/following list: the other user, when the follow began, and whether the viewer follows them"""
+    followed_at = serializers.DateTimeField(read_only=True)
+    is_following = serializers.BooleanField(read_only=True)
+
+    class Meta(UserShortSerializer.Meta):
+        fields = UserShortSerializer.Meta.fields + ['followed_at', 'is_following']
+
+class LikeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserShortSerializer(read_only=True)
     class Meta:
         model = Like
         fields = ['id', 'user', 'created_at']
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserShortSerializer(read_only=True)
     class Meta:
         model = Comment
-        fields = ['id', 'user', 'text', 'created_at']
+        fields = ['id', 'user', 'text', 'parent', 'reply_count', 'created_at']
+        read_only_fields = ['parent', 'reply_count']
 
-class PostSerializer(serializers.ModelSerializer):
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserShortSerializer(read_only=True)
-    likes_count = serializers.IntegerField(source='likes.count', read_only=True)
-    comments_count = serializers.IntegerField(source='comments.count', read_only=True)
+    likes_count = serializers.IntegerField(read_only=True)
+    comments_count = serializers.IntegerField(read_only=True)
     is_liked = serializers.SerializerMethodField()
     is_saved = serializers.SerializerMethodField()
+    comments_preview = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         fields = [
             'id', 'user', 'caption', 'hashtags', 'media_type', 'media', 
+            'poster', 'duration', 'width', 'height',
             'location', 'created_at', 'likes_count', 'comments_count', 
-            'is_liked', 'is_saved'
+            'is_liked', 'is_saved', 'comments_preview'
         ]
-        extra_kwargs = {
-            'media_type': {'read_only': True}
-        }
+        expandable_fields = ['comments_preview']
+        # The video fields are read from the upload (core/media.py)
+        read_only_fields = ['media_type', 'poster', 'duration', 'width', 'height']
 
     def get_is_liked(self, obj):
+        # Annotated by PostViewSet.get_queryset to avoid a query per post
+        if hasattr(obj, 'is_liked'):
+            return obj.is_liked
         user = self.context['request'].user
         if user.is_authenticated:
             return obj.likes.filter(user=user).exists()
         return False
 
     def get_is_saved(self, obj):
+        if hasattr(obj, 'is_saved'):
+            return obj.is_saved
         user = self.context['request'].user
         if user.is_authenticated:
             return obj.saves.filter(user=user).exists()
         return False
 
-class StorySerializer(serializers.ModelSerializer):
+    def get_comments_preview(self, obj):
+        # Filled in from core.comment_previews by PostViewSet
+        return getattr(obj, 'comments_preview', None)
+
+class StorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserShortSerializer(read_only=True)
-    views_count = serializers.IntegerField(source='views.count', read_only=True)
+    views_count = serializers.IntegerField(read_only=True)
     is_viewed = serializers.SerializerMethodField()
 
     class Meta:
@@ -61,12 +143,14 @@ class StorySerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'media_type', 'media', 'created_at', 'expires_at', 'views_count', 'is_viewed']
 
     def get_is_viewed(self, obj):
+        if hasattr(obj, 'is_viewed'):
+            return obj.is_viewed
         user = self.context['request'].user
         if user.is_authenticated:
             return obj.views.filter(user=user).exists()
         return False
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     followers_count = serializers.IntegerField(read_only=True)
     following_count = serializers.IntegerField(read_only=True)
     posts_count = serializers.IntegerField(read_only=True)
@@ -81,20 +165,163 @@ class UserProfileSerializer(serializers.ModelSerializer):
         ]
 
     def get_is_following(self, obj):
+        if hasattr(obj, 'is_following'):
+            return obj.is_following
         user = self.context['request'].user
         if user.is_authenticated:
             return obj.followers.filter(follower=user).exists()
         return False
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     from_user = UserShortSerializer(read_only=True)
     class Meta:
         model = Notification
         fields = ['id', 'from_user', 'notification_type', 'post', 'text', 'is_read', 'created_at']
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     follower = UserShortSerializer(read_only=True)
     followed = UserShortSerializer(read_only=True)
     class Meta:
         model = Follow
         fields = ['id', 'follower', 'followed', 'created_at']
+
+
+class InteractionSerializer(serializers.Serializer):
+    """One set-state operation: like/save a post on or off, or view a story"""
+    TYPES = ('like', 'save', 'view')
+
+    type = serializers.ChoiceField(choices=TYPES)
+    id = serializers.IntegerField(min_value=1)
+    state = serializers.BooleanField()
+
+    def validate(self, attrs):
+        if attrs['type'] == 'view' and not attrs['state']:
+            raise serializers.ValidationError('A story view cannot be undone')
+        return attrs
+
+
+class InteractionBatchSerializer(serializers.Serializer):
+    MAX_OPS = 200
+
+    ops = serializers.ListField(child=InteractionSerializer(), allow_empty=False, max_length=MAX_OPS)
+
+
+class CompiledSerializer:
+    """
+    Read-only fast path for list responses.
+
+    Compiles a ModelSerializer into the columns it needs and one converter
+    per field, then builds plain dicts straight from ``queryset.values()``
+    rows. The output matches the full serializer; anything the compiler
+    does not understand raises ``TypeError`` at compile time so the view
+    keeps using the full serializer. Method fields must be backed by a
+    queryset annotation of the same name.
+    """
+
+    def __init__(self, serializer_class, fields=None, expand=None):
+        self.serializer_class = serializer_class
+        self.fields = fields
+        self.expand = expand
+        self._spec = None
+        self._error = None
+
+    @property
+    def spec(self):
+        if self._error is not None:
+            raise self._error
+        if self._spec is None:
+            try:
+                kwargs = {'fields': self.fields, 'expand': self.expand} if issubclass(self.serializer_class, SparseFieldsMixin) else {}
+                self._spec = self._compile(self.serializer_class(**kwargs), '')
+            except TypeError as e:
+                self._error = e
+                raise
+        return self._spec
+
+    @property
+    def columns(self):
+        return self._columns(self.spec)
+
+    def _columns(self, spec):
+        columns = []
+        for name, column, make_convert, nested in spec:
+            columns.append(column)
+            if nested is not None:
+                columns.extend(self._columns(nested))
+        return columns
+
+    def _compile(self, serializer, prefix):
+        spec = []
+        for field in serializer._readable_fields:
+            if isinstance(field, serializers.SerializerMethodField):
+                if prefix:
+                    raise TypeError(f'Cannot compile nested method field "{field.field_name}"')
+                spec.append((field.field_name, field.field_name, _identity, None))
+                continue
+            if len(field.source_attrs) != 1:
+                raise TypeError(f'Cannot compile source "{field.source}"')
+            column = prefix + field.source
+            if isinstance(field, serializers.BaseSerializer):
+                if getattr(field, 'many', False):
+                    raise TypeError(f'Cannot compile nested list "{field.field_name}"')
+                spec.append((field.field_name, column, None, self._compile(field, column + '__')))
+            elif isinstance(field, serializers.FileField):
+                spec.append((field.field_name, column, _file_url_converter(field), None))
+            elif isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                spec.append((field.field_name, column, _identity, None))
+            elif isinstance(field, serializers.RelatedField):
+                raise TypeError(f'Cannot compile related field "{field.field_name}"')
+            else:
+                spec.append((field.field_name, column, _bound(field.to_representation), None))
+        return spec
+
+    def _bind(self, spec, context):
+        return [
+            (name, column, make_convert(context) if nested is None else None,
+             self._bind(nested, context) if nested is not None else None)
+            for name, column, make_convert, nested in spec
+        ]
+
+    def _build(self, plan, row):
+        out = {}
+        for name, column, convert, nested in plan:
+            value = row[column]
+            if value is None:
+                out[name] = None
+            elif nested is not None:
+                out[name] = self._build(nested, row)
+            else:
+                out[name] = convert(value)
+        return out
+
+    def serialize(self, rows, context):
+        """Turn ``values(*self.columns)`` rows into the serializer's output"""
+        plan = self._bind(self.spec, context)
+        return [self._build(plan, row) for row in rows]
+
+
+def _identity(context):
+    return lambda value: value
+
+
+def _bound(to_representation):
+    return lambda context: to_representation
+
+
+def _file_url_converter(field):
+    """Mirror FileField.to_representation for a stored file name"""
+    def make_convert(context):
+        use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+        storage = field.parent.Meta.model._meta.get_field(field.source).storage
+        request = context.get('request')
+        cache = {}
+
+        def convert(name):
+            if not name or not use_url:
+                return name or None
+            if name not in cache:
+                url = storage.url(name)
+                cache[name] = request.build_absolute_uri(url) if request is not None else url
+            return cache[name]
+        return convert
+    return make_convert
@@ -0,0 +1,199 @@
+"""
+Bump the content versions in ``core.versions`` whenever a model changes,
+and keep the engagement counters of ``core.counters`` in step with likes,
+comments and story views.
+
+Bulk operations (``bulk_create``, ``update``) do not send these signals;
+code that uses them must record the change itself, usually on a
+``batched_versions()`` batch.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import authentication, availability, comment_previews
+from .counters import increment, increment_all
+from .follow_cache import follows_changed
+from .models import User, Post, Story, StoryView, Comment, Like, Save, Follow, Notification
+from .versions import bump
+
+_local = threading.local()
+
+
+def _explore(post):
+    return ['explore'] if post.media_type == 'video' else []
+
+
+class VersionBatch:
+    """Version bumps collected during a bulk write and sent once at the end"""
+
+    def __init__(self):
+        self.keys = set()
+        self.post_ids = set()
+        self.story_ids = set()
+        self.counts = defaultdict(int)
+
+    def add(self, *keys):
+        self.keys.update(keys)
+
+    def add_posts(self, post_ids):
+        """Bump posts by id; their authors are looked up in one query on send()"""
+        self.post_ids.update(post_ids)
+
+    def add_stories(self, story_ids):
+        """Bump stories by id, like add_posts()"""
+        self.story_ids.update(story_ids)
+
+    def count(self, model, pk, field, delta=1):
+        """Add ``delta`` to a counter; all counts are written together on send()"""
+        self.counts[(model, pk, field)] += delta
+
+    def send(self):
+        if self.counts:
+            increment_all({key: delta for key, delta in self.counts.items() if delta})
+        keys = set(self.keys)
+        if self.post_ids:
+            for post_id, user_id, media_type in Post.objects.filter(pk__in=self.post_ids).values_list(
+                'id', 'user_id', 'media_type'
+            ):
+                keys.update([f'post:{post_id}', f'author:{user_id}'])
+                if media_type == 'video':
+                    keys.add('explore')
+        if self.story_ids:
+            for user_id in Story.objects.filter(pk__in=self.story_ids).values_list('user_id', flat=True).distinct():
+                keys.add(f'stories:{user_id}')
+        if keys:
+            bump(*keys)
+
+
+@contextmanager
+def batched_versions():
+    """
+    Collect the bumps of every signal sent inside the block, plus whatever
+    the caller adds to the yielded batch, and send them together on exit.
+    Deleting many likes then costs one post lookup instead of one per like.
+    """
+    outer = getattr(_local, 'batch', None)
+    batch = outer or VersionBatch()
+    _local.batch = batch
+    try:
+        yield batch
+    finally:
+        _local.batch = outer
+    if outer is None:
+        batch.send()
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    bump(f'profile:{instance.id}', f'author:{instance.id}', f'stories:{instance.id}')
+    authentication.forget_user(instance.id)
+    if 'created' in kwargs and (update_fields is None or {'username', 'email'} & set(update_fields)):
+        availability.names_taken(instance)
+
+
+@receiver([post_save, post_delete], sender=Post)
+def post_changed(sender, instance, **kwargs):
+    bump(f'post:{instance.id}', f'author:{instance.user_id}', f'profile:{instance.user_id}', *_explore(instance))
+
+
+@receiver([post_save, post_delete], sender=Like)
+@receiver([post_save, post_delete], sender=Comment)
+def engagement_changed(sender, instance, **kwargs):
+    batch = getattr(_local, 'batch', None)
+    if batch is not None:
+        batch.add_posts([instance.post_id])
+        if sender is Like:
+            batch.add(f'feed:{instance.user_id}')
+        return
+    try:
+        post = instance.post
+    except Post.DoesNotExist:
+        # The post itself is being deleted and has already been bumped
+        return
+    keys = [f'post:{post.id}', f'author:{post.user_id}', *_explore(post)]
+    if sender is Like:
+        keys.append(f'feed:{instance.user_id}')
+    bump(*keys)
+
+
+@receiver([post_save, post_delete], sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    comment_previews.invalidate(instance.post_id)
+
+
+# Counted model -> [(foreign key to the row holding the count, counter field)]
+COUNTED = {
+    Like: [('post', 'like_count')],
+    Comment: [('post', 'comment_count'), ('parent', 'reply_count')],
+    StoryView: [('story', 'view_count')],
+}
+
+
+@receiver([post_save, post_delete], sender=Like)
+@receiver([post_save, post_delete], sender=Comment)
+@receiver([post_save, post_delete], sender=StoryView)
+def count_changed(sender, instance, signal, created=False, origin=None, **kwargs):
+    if signal is post_save and not created:
+        return
+    batch = getattr(_local, 'batch', None)
+    for fk, field in COUNTED[sender]:
+        counted_model = sender._meta.get_field(fk).related_model
+        pk = getattr(instance, f'{fk}_id')
+        if pk is None:
+            # A top-level comment has no parent to count it
+            continue
+        if signal is post_save:
+            delta = 1
+        elif isinstance(origin, counted_model) and origin.pk == pk:
+            # The post, story or parent comment is being deleted along with its count
+            continue
+        else:
+            delta = -1
+        if batch is not None:
+            batch.count(counted_model, pk, field, delta)
+        else:
+            increment(counted_model, pk, field, delta)
+
+
+@receiver([post_save, post_delete], sender=Save)
+def save_changed(sender, instance, **kwargs):
+    batch = getattr(_local, 'batch', None)
+    if batch is not None:
+        batch.add(f'feed:{instance.user_id}')
+        return
+    bump(f'feed:{instance.user_id}')
+
+
+@receiver([post_save, post_delete], sender=Follow)
+def follow_changed(sender, instance, **kwargs):
+    follows_changed(instance.follower_id)
+    bump(f'feed:{instance.follower_id}', f'profile:{instance.follower_id}', f'profile:{instance.followed_id}')
+
+
+@receiver([post_save, post_delete], sender=Story)
+def story_changed(sender, instance, **kwargs):
+    bump(f'stories:{instance.user_id}')
+
+
+@receiver([post_save, post_delete], sender=StoryView)
+def story_viewed(sender, instance, **kwargs):
+    batch = getattr(_local, 'batch', None)
+    if batch is not None:
+        batch.add_stories([instance.story_id])
+        batch.add(f'feed:{instance.user_id}')
+        return
+    try:
+        author_id = instance.story.user_id
+    except Story.DoesNotExist:
+        return
+    bump(f'stories:{author_id}', f'feed:{instance.user_id}')
+
+
+@receiver([post_save, post_delete], sender=Notification)
+def notification_changed(sender, instance, **kwargs):
+    bump(f'notifications:{instance.user_id}')
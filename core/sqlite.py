@@ -0,0 +1,72 @@
+"""
+SQLite tuning for deployments that stay on SQLite.
+
+Every new connection to a SQLite file runs the pragmas of ``SQLITE``:
+- WAL journal mode, so readers never block the writer and the writer
+  never blocks readers; it is stored in the file, so it is only switched once
+- ``synchronous=NORMAL``, which is safe in WAL mode: a power loss can lose
+  the last commits but never corrupts the database
+- a memory-mapped file and a larger page cache, so reads skip system calls
+- a busy timeout, so a writer waits for the lock instead of failing with
+  "database is locked"
+- temporary tables and indexes (sorts, DISTINCT) in memory
+
+The databases also begin transactions with ``BEGIN IMMEDIATE`` (see
+``dekogram_project/databases.py``): a deferred transaction that reads before
+it writes cannot wait for the lock and fails at once.
+
+WAL files grow until they are checkpointed and the query planner needs
+statistics; ``python manage.py sqlite_maintenance`` does both.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+SQLITE_ENGINE = 'django.db.backends.sqlite3'
+
+DEFAULTS = {
+    'TUNE': True,
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'MMAP_SIZE': 256 * 1024 * 1024,  # bytes
+    'CACHE_SIZE': -32 * 1024,  # negative: KiB per connection, so 32 MiB
+    'BUSY_TIMEOUT': 10000,  # milliseconds
+    'TEMP_STORE': 'MEMORY',
+}
+
+
+def sqlite_settings():
+    return {**DEFAULTS, **getattr(settings, 'SQLITE', {})}
+
+
+def pragmas(config=None):
+    """The per-connection ``PRAGMA`` statements, without the journal mode"""
+    config = config or sqlite_settings()
+    return [
+        f'PRAGMA synchronous = {config["SYNCHRONOUS"]}',
+        f'PRAGMA mmap_size = {int(config["MMAP_SIZE"])}',
+        f'PRAGMA cache_size = {int(config["CACHE_SIZE"])}',
+        f'PRAGMA busy_timeout = {int(config["BUSY_TIMEOUT"])}',
+        f'PRAGMA temp_store = {config["TEMP_STORE"]}',
+    ]
+
+
+def tune(cursor, config=None):
+    config = config or sqlite_settings()
+    # Switching the journal mode needs a moment without other connections,
+    # so only do it while it differs
+    journal_mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+    if journal_mode.lower() != config['JOURNAL_MODE'].lower():
+        cursor.execute(f'PRAGMA journal_mode = {config["JOURNAL_MODE"]}')
+    for statement in pragmas(config):
+        cursor.execute(statement)
+
+
+@receiver(connection_created)
+def tune_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        return
+    config = sqlite_settings()
+    if config['TUNE']:
+        # The raw DB-API cursor: Django's would log and time these queries
+        tune(connection.connection.cursor(), config)
@@ -1,3 +1,1812 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, resolve
+from django.utils import timezone
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from benchmarks.contention import run_contention
+
+from . import availability, comment_previews, counters, follow_cache, media, ratelimit, versions
+from .bus import SocketBus
+from .management.commands import explain_queries
+from .management.commands.seed_data import render_video
+from .async_views import AsyncListEndpoint, PostList, async_urls
+from .authentication import CachedJWTAuthentication
+from .counters import recount
+from .fanout import fan_out
+from .mentions import notify_mentions, parse_mentions
+from .fastjson import FastJSONParser, FastJSONRenderer
+from .idempotency import purge_expired
+from .interactions import delete_matching_many, insert_ignore_many
+from .sqlite import pragmas as sqlite_pragmas
+from . import replicas
+from .replicas import ReplicaRouter, RoutingState, read_from_replica
+from .versions import make_etag
+from dekogram_project.databases import databases_from_env
+from .models import User, Post, Story, Comment, Like, Save, Follow, Notification, StoryView, IdempotencyKey
+from .urls import router
+from .serializers import CompiledSerializer, PostSerializer, StorySerializer, NotificationSerializer
+from .views import PostViewSet, StoryViewSet, NotificationViewSet, prefix_upper_bound
+
+QUERY_BUDGETS_FILE = Path(__file__).resolve().parent / 'query_budgets.json'
+
+
+def seed_graph(users=8, posts_per_user=6, comments_per_post=3, likes_per_post=4):
+    """Seed a small but realistic social graph and return the viewer"""
+    people = [
+        User(username=f'user{i}', email=f'user{i}@example.com', full_name=f'User {i}')
+        for i in range(users)
+    ]
+    User.objects.bulk_create(people)
+    people = list(User.objects.order_by('id'))
+    viewer = people[0]
+
+    Follow.objects.bulk_create([
+        Follow(follower=follower, followed=followed)
+        for follower in people for followed in people
+        if follower != followed
+    ])
+
+    posts = []
+    for index, author in enumerate(people):
+        for n in range(posts_per_user):
+            ext = 'mp4' if n % 2 else 'jpg'
+            posts.append(Post(
+                user=author,
+                caption=f'Post {n} by {author.username} #seed',
+                hashtags='#seed',
+                media=f'posts/seed_{index}_{n}.{ext}',
+                media_type='video' if ext == 'mp4' else 'image',
+                location='Tashkent',
+            ))
+    Post.objects.bulk_create(posts)
+    posts = list(Post.objects.all())
+
+    Comment.objects.bulk_create([
+        Comment(user=people[(post.id + n) % users], post=post, text=f'Comment {n}')
+        for post in posts for n in range(comments_per_post)
+    ])
+    Like.objects.bulk_create([
+        Like(user=people[(post.id + n) % users], post=post)
+        for post in posts for n in range(min(likes_per_post, users))
+    ], ignore_conflicts=True)
+    Save.objects.bulk_create([Save(user=viewer, post=post) for post in posts[::3]])
+
+    expires_at = timezone.now() + timedelta(hours=24)
+    stories = Story.objects.bulk_create([
+        Story(user=author, media=f'stories/seed_{author.id}.jpg', media_type='image', expires_at=expires_at)
+        for author in people
+    ])
+    StoryView.objects.bulk_create([StoryView(story=story, user=viewer) for story in stories[::2]])
+
+    Notification.objects.bulk_create([
+        Notification(
+            user=viewer,
+            from_user=people[1 + n % (users - 1)],
+            notification_type='like',
+            post=posts[n % len(posts)],
+            text='liked your post',
+        )
+        for n in range(30)
+    ])
+    # bulk_create skips the signals that maintain the counters
+    recount()
+    return viewer
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Every API endpoint has a fixed query budget checked in to
+    query_budgets.json. List endpoints must also cost the same number of
+    queries however many rows end up on the page.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        with open(QUERY_BUDGETS_FILE) as f:
+            cls.budgets = json.load(f)
+        cls.viewer = seed_graph()
+        cls.other = User.objects.exclude(pk=cls.viewer.pk).order_by('id').first()
+        cls.post = Post.objects.filter(user=cls.other).order_by('id').first()
+        cls.story = Story.objects.filter(user=cls.other).first()
+
+    def setUp(self):
+        self.client = APIClient()
+        token = RefreshToken.for_user(self.viewer).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def request(self, method, url, data=None, **extra):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url, data, format='json', **extra)
+        self.assertLess(response.status_code, 400, response.content)
+        return response, len(ctx.captured_queries)
+
+    def assertWithinBudget(self, name, method, url, data=None, **extra):
+        self.assertIn(name, self.budgets, f'No query budget recorded for "{name}"')
+        response, count = self.request(method, url, data, **extra)
+        budget = self.budgets[name]
+        self.assertLessEqual(
+            count, budget,
+            f'{method.upper()} {url} ran {count} queries, budget for "{name}" is {budget}'
+        )
+        return response, count
+
+    def assertFlatInPageSize(self, name, url, grow):
+        """Query count must not change when the page fills with more rows"""
+        small, before = self.assertWithinBudget(name, 'get', url)
+        grow()
+        large, after = self.assertWithinBudget(name, 'get', url)
+        self.assertGreater(len(large.data['results']), len(small.data['results']))
+        self.assertEqual(before, after, f'"{name}" query count grows with page size')
+
+    def add_posts(self, count, media='jpg'):
+        Post.objects.bulk_create([
+            Post(user=self.other, caption='more', media=f'posts/more_{n}.{media}',
+                 media_type='video' if media == 'mp4' else 'image')
+            for n in range(count)
+        ])
+
+    def test_feed(self):
+        Post.objects.exclude(user=self.viewer).delete()
+        self.assertFlatInPageSize('feed', '/api/posts/', lambda: self.add_posts(15))
+
+    def test_feed_not_modified(self):
+        etag = self.client.get('/api/posts/')['ETag']
+        response, _ = self.assertWithinBudget('feed_not_modified', 'get', '/api/posts/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_explore(self):
+        Post.objects.filter(media_type='video').delete()
+        self.add_posts(2, media='mp4')
+        self.assertFlatInPageSize('explore', '/api/posts/?type=explore', lambda: self.add_posts(15, media='mp4'))
+
+    def test_stories(self):
+        Story.objects.exclude(user=self.viewer).delete()
+
+        def grow():
+            expires_at = timezone.now() + timedelta(hours=1)
+            Story.objects.bulk_create([
+                Story(user=author, media='stories/more.jpg', media_type='image', expires_at=expires_at)
+                for author in User.objects.exclude(pk=self.viewer.pk)
+            ])
+        self.assertFlatInPageSize('stories', '/api/stories/', grow)
+
+    def test_notifications(self):
+        keep = list(Notification.objects.filter(user=self.viewer).values_list('pk', flat=True)[:2])
+        Notification.objects.filter(user=self.viewer).exclude(pk__in=keep).delete()
+
+        def grow():
+            Notification.objects.bulk_create([
+                Notification(user=self.viewer, from_user=self.other, notification_type='follow', text='followed you')
+                for _ in range(15)
+            ])
+        self.assertFlatInPageSize('notifications', '/api/notifications/', grow)
+
+    def test_users_list(self):
+        def grow():
+            User.objects.bulk_create([
+                User(username=f'extra{n}', email=f'extra{n}@example.com') for n in range(10)
+            ])
+        self.assertFlatInPageSize('users_list', '/api/users/', grow)
+        with CaptureQueriesContext(connection) as ctx:
+            rows = {row['username']: row for row in self.client.get('/api/users/').data['results']}
+        self.assertFalse([query for query in ctx.captured_queries if 'COUNT(DISTINCT' in query['sql']])
+        viewer = rows[self.viewer.username]
+        self.assertEqual(
+            (viewer['followers_count'], viewer['following_count'], viewer['posts_count']),
+            (self.viewer.followers.count(), self.viewer.following.count(), self.viewer.posts.count()),
+        )
+
+    def test_user_profile(self):
+        self.assertWithinBudget('user_profile', 'get', f'/api/users/{self.other.username}/')
+
+    def test_profile_not_modified(self):
+        url = f'/api/users/{self.other.username}/'
+        etag = self.client.get(url)['ETag']
+        response, _ = self.assertWithinBudget('profile_not_modified', 'get', url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_follow_lists(self):
+        def grow(side):
+            people = User.objects.bulk_create([
+                User(username=f'{side}{n}', email=f'{side}{n}@example.com') for n in range(10)
+            ])
+            if side == 'followers':
+                Follow.objects.bulk_create([Follow(follower=user, followed=self.other) for user in people])
+            else:
+                Follow.objects.bulk_create([Follow(follower=self.other, followed=user) for user in people])
+        for side in ('followers', 'following'):
+            self.assertFlatInPageSize(side, f'/api/users/{self.other.username}/{side}/', partial(grow, side))
+
+    def test_search(self):
+        response, _ = self.assertWithinBudget('search', 'get', '/api/users/search/?q=user')
+        self.assertTrue(response.data)
+
+    def test_post_detail(self):
+        self.assertWithinBudget('post_detail', 'get', f'/api/posts/{self.post.id}/')
+
+    def test_comments_list(self):
+        def grow(parent=None):
+            Comment.objects.bulk_create([
+                Comment(user=self.other, post=self.post, parent=parent, text='more') for _ in range(15)
+            ])
+        self.assertFlatInPageSize('comments_list', f'/api/posts/{self.post.id}/comments/', grow)
+        thread = Comment.objects.filter(post=self.post).first()
+        grow(thread)
+        self.assertFlatInPageSize(
+            'comment_replies', f'/api/posts/{self.post.id}/comments/?parent={thread.id}', partial(grow, thread)
+        )
+
+    def test_feed_previews(self):
+        cache.clear()
+        Post.objects.exclude(user=self.viewer).delete()
+        # Both measured requests then read the signed-in user from the cache
+        self.request('get', '/api/posts/')
+        url = '/api/posts/?expand=comments_preview'
+        self.assertFlatInPageSize('feed_previews', url, lambda: self.add_posts(15))
+        # Cached previews cost no queries at all
+        _, cached = self.request('get', url)
+        _, plain = self.request('get', '/api/posts/')
+        self.assertEqual(cached, plain)
+
+    def test_comment_create(self):
+        self.assertWithinBudget('comment_create', 'post', f'/api/posts/{self.post.id}/comments/', {'text': 'Nice!'})
+
+    def test_comment_mentions(self):
+        url = f'/api/posts/{self.post.id}/comments/'
+        _, one = self.assertWithinBudget('comment_mentions', 'post', url, {'text': 'Hi @user2'})
+        everyone = ' '.join(f'@user{n}' for n in range(8))
+        _, many = self.assertWithinBudget('comment_mentions', 'post', url, {'text': everyone})
+        self.assertEqual(one, many)
+
+    def test_like_toggle(self):
+        Like.objects.filter(user=self.viewer, post=self.post).delete()
+        self.assertWithinBudget('like', 'post', f'/api/posts/{self.post.id}/like/')
+        self.assertWithinBudget('unlike', 'post', f'/api/posts/{self.post.id}/like/')
+
+    def test_save_toggle(self):
+        Save.objects.filter(user=self.viewer, post=self.post).delete()
+        self.assertWithinBudget('save', 'post', f'/api/posts/{self.post.id}/save_post/')
+        self.assertWithinBudget('unsave', 'post', f'/api/posts/{self.post.id}/save_post/')
+
+    def test_follow_toggle(self):
+        Follow.objects.filter(follower=self.viewer, followed=self.other).delete()
+        self.assertWithinBudget('follow', 'post', f'/api/users/{self.other.username}/follow/')
+        self.assertWithinBudget('unfollow', 'post', f'/api/users/{self.other.username}/follow/')
+
+    def test_story_view(self):
+        self.assertWithinBudget('story_view', 'post', f'/api/stories/{self.story.id}/view/')
+
+    def test_mark_all_read(self):
+        self.assertWithinBudget('mark_all_read', 'post', '/api/notifications/mark_all_read/')
+
+    def test_interactions_batch(self):
+        Like.objects.filter(user=self.viewer).delete()
+        Save.objects.filter(user=self.viewer).delete()
+        StoryView.objects.filter(user=self.viewer).delete()
+        posts = list(Post.objects.exclude(user=self.viewer).values_list('id', flat=True)[:12])
+        stories = list(Story.objects.exclude(user=self.viewer).values_list('id', flat=True))
+
+        def ops(count):
+            return [{'type': 'like', 'id': post_id, 'state': True} for post_id in posts[:count]] + [
+                {'type': 'save', 'id': post_id, 'state': True} for post_id in posts[:count]
+            ] + [{'type': 'like', 'id': posts[-1], 'state': False}] + [
+                {'type': 'view', 'id': story_id, 'state': True} for story_id in stories[:count]
+            ]
+
+        _, before = self.assertWithinBudget('interactions_batch', 'post', '/api/interactions/batch/', {'ops': ops(1)})
+        _, after = self.assertWithinBudget('interactions_batch', 'post', '/api/interactions/batch/', {'ops': ops(10)})
+        self.assertEqual(before, after)
+
+    def test_every_budget_is_exercised(self):
+        tested = {
+            'feed', 'feed_not_modified', 'feed_previews', 'explore', 'stories', 'notifications', 'users_list',
+            'user_profile', 'profile_not_modified', 'followers', 'following',
+            'search', 'post_detail', 'comments_list', 'comment_replies', 'comment_create', 'comment_mentions', 'like', 'unlike',
+            'save', 'unsave', 'follow', 'unfollow', 'story_view', 'mark_all_read', 'interactions_batch',
+        }
+        self.assertEqual(set(self.budgets), tested)
+
+
+class SeedDataTests(TestCase):
+    options = dict(users=40, avg_following=6, posts_per_user=2, likes_per_post=4, no_media=True, seed=7)
+
+    def snapshot(self):
+        return (
+            sorted(Follow.objects.values_list('follower__username', 'followed__username')),
+            sorted(Post.objects.values_list('user__username', 'media', 'caption')),
+            Like.objects.count(), Comment.objects.count(), Story.objects.count(),
+            StoryView.objects.count(), Notification.objects.count(),
+        )
+
+    def test_synthetic_dataset_is_reproducible(self):
+        call_command('seed_data', stdout=StringIO(), **self.options)
+        first = self.snapshot()
+        self.assertEqual(User.objects.count(), 40)
+        self.assertTrue(all(first[2:]))
+
+        User.objects.all().delete()
+        call_command('seed_data', stdout=StringIO(), **self.options)
+        self.assertEqual(self.snapshot(), first)
+
+    def test_refuses_to_seed_twice(self):
+        call_command('seed_data', stdout=StringIO(), **self.options)
+        with self.assertRaises(CommandError):
+            call_command('seed_data', stdout=StringIO(), **self.options)
+
+
+class BenchmarkCommandTests(TestCase):
+    def test_inprocess_run_writes_results(self):
+        seed_graph(users=4, posts_per_user=2)
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / 'results.json'
+            call_command(
+                'benchmark', requests=3, warmup=1, scenario=['feed_page_1', 'like_toggle', 'comment_post'],
+                output=str(output), baseline=str(Path(tmp) / 'missing.json'), stdout=StringIO(),
+            )
+            with open(output) as f:
+                results = json.load(f)['targets']['inprocess']
+        self.assertEqual(set(results), {'feed_page_1', 'like_toggle', 'comment_post'})
+        self.assertTrue(all(stats['errors'] == 0 for stats in results.values()))
+        # Comments created by the benchmark are cleaned up afterwards
+        self.assertEqual(Comment.objects.filter(text='Benchmark comment').count(), 0)
+
+
+class QueryPlanTests(TestCase):
+    def setUp(self):
+        seed_graph(users=6, posts_per_user=5, comments_per_post=1, likes_per_post=1)
+
+    def test_endpoints_use_indexes(self):
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        self.assertIn('14 endpoint(s) use their indexes.', out.getvalue())
+
+        out = StringIO()
+        call_command('explain_queries', endpoint=['profile_page', 'explore'], plans=True, stdout=out)
+        self.assertIn('USING INDEX post_user_created_idx', out.getvalue())
+        self.assertIn('USING INDEX post_media_created_idx', out.getvalue())
+
+    def test_fails_on_full_scans(self):
+        search = explain_queries.Endpoint('search', '/api/users/search/?q=user')
+        with mock.patch.object(explain_queries, 'ENDPOINTS', [search]):
+            with self.assertRaisesMessage(CommandError, 'search'):
+                call_command('explain_queries', stdout=StringIO())
+
+
+class FollowCacheTests(TestCase):
+    def setUp(self):
+        self.viewer = seed_graph(users=5, posts_per_user=1)
+        follow_cache.cache.clear()
+        self.addCleanup(follow_cache.cache.clear)
+        enabled = mock.patch.object(follow_cache.cache, 'enabled', True)
+        enabled.start()
+        self.addCleanup(enabled.stop)
+
+    def test_lru_with_memory_cap(self):
+        cache = follow_cache.FollowSetCache(max_bytes=2 * (follow_cache.ENTRY_OVERHEAD + 40), ttl=60)
+        for user_id in (1, 2):
+            cache.put(user_id, follow_cache.compact(range(10)), cache.generation)
+        cache.get(1)
+        cache.put(3, follow_cache.compact(range(10)), cache.generation)
+        self.assertEqual(list(cache.entries), [1, 3])
+
+        # A load that started before an invalidation is not stored
+        generation = cache.generation
+        cache.invalidate(4)
+        cache.put(4, follow_cache.compact([1]), generation)
+        self.assertIsNone(cache.get(4))
+
+    def test_cached_until_follows_change(self):
+        following = list(follow_cache.following_ids(self.viewer.id))
+        self.assertEqual(following, sorted(following))
+        with self.assertNumQueries(0):
+            follow_cache.following_ids(self.viewer.id)
+
+        unfollowed = User.objects.get(pk=following[0])
+        Follow.objects.filter(follower=self.viewer, followed=unfollowed).delete()
+        self.assertFalse(follow_cache.is_following(self.viewer.id, unfollowed.id))
+        self.assertTrue(follow_cache.is_following(self.viewer.id, following[1]))
+
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        ids = {post['user']['id'] for post in client.get('/api/posts/').json()['results']}
+        self.assertNotIn(unfollowed.id, ids)
+        client.put(f'/api/users/{unfollowed.username}/follow/')
+        ids = {post['user']['id'] for post in client.get('/api/posts/').json()['results']}
+        self.assertIn(unfollowed.id, ids)
+
+    def test_large_sets_filter_with_a_subquery(self):
+        posts = Post.objects.filter(follow_cache.author_filter(self.viewer))
+        self.assertNotIn('core_follow', str(posts.query))
+        with override_settings(FOLLOW_CACHE={'IN_LIST_MAX': 2}):
+            large = Post.objects.filter(follow_cache.author_filter(self.viewer))
+            self.assertIn('core_follow', str(large.query))
+        self.assertEqual(set(large), set(posts))
+
+    def test_socket_bus_reaches_other_processes(self):
+        received = threading.Event()
+        with tempfile.TemporaryDirectory() as directory:
+            publisher, subscriber = SocketBus(directory), SocketBus(directory)
+            subscriber.subscribe('follows', lambda payload: payload == '42' and received.set())
+            # Sockets are named after the process, so pretend to be two
+            for pid, bus in enumerate((publisher, subscriber), 1):
+                with mock.patch('core.bus.os.getpid', return_value=pid):
+                    bus.start()
+            try:
+                publisher.publish('follows', '42')
+                self.assertTrue(received.wait(2))
+            finally:
+                publisher.stop()
+                subscriber.stop()
+
+
+class FollowListTests(TestCase):
+    def setUp(self):
+        self.viewer = seed_graph(users=8, posts_per_user=1)
+        self.other = User.objects.exclude(pk=self.viewer.pk).order_by('id').first()
+        # Ties on created_at must still page without repeats
+        Follow.objects.filter(followed=self.other).update(created_at=timezone.now())
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def pages(self, url):
+        usernames = []
+        while url:
+            data = self.client.get(url).json()
+            usernames += [user['username'] for user in data['results']]
+            url = data['next']
+        return usernames
+
+    def test_pages_follow_each_other(self):
+        url = f'/api/users/{self.other.username}/followers/'
+        everyone = self.pages(url)
+        self.assertEqual(len(everyone), 7)
+        self.assertEqual(self.pages(f'{url}?page_size=3'), everyone)
+        self.assertEqual(self.client.get(f'{url}?cursor=nonsense').status_code, 404)
+
+    def test_rejects_cursors_of_the_wrong_types(self):
+        url = f'/api/users/{self.other.username}/followers/'
+        for position in (['garbage', 1], ['2026-01-01T00:00:00+00:00', 'x'], [None, 1], [[], {}], [1]):
+            cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+            with self.subTest(position=position):
+                self.assertEqual(self.client.get(f'{url}?cursor={cursor}').status_code, 404)
+
+    def test_is_following_for_the_viewer(self):
+        unfollowed = User.objects.exclude(pk__in=[self.viewer.pk, self.other.pk]).order_by('id').first()
+        Follow.objects.filter(follower=self.viewer, followed=unfollowed).delete()
+        rows = self.client.get(f'/api/users/{self.other.username}/followers/').json()['results']
+        states = {row['username']: row['is_following'] for row in rows}
+        # The viewer is listed too, and does not follow themselves
+        self.assertFalse(states.pop(self.viewer.username))
+        self.assertFalse(states.pop(unfollowed.username))
+        self.assertTrue(all(states.values()))
+        self.assertIn('followed_at', rows[0])
+
+    def test_prefix_search(self):
+        User.objects.create_user(username='user10', email='user10@example.com', password='x')
+        Follow.objects.create(follower=User.objects.get(username='user10'), followed=self.other)
+        url = f'/api/users/{self.other.username}/followers/?q=user1'
+        self.assertEqual(self.pages(f'{url}&page_size=1'), ['user10'])
+        self.assertEqual(self.pages(f'/api/users/{self.other.username}/following/?q=user7'), ['user7'])
+
+    def test_prefix_search_up_to_the_last_code_point(self):
+        url = f'/api/users/{self.other.username}/followers/'
+        self.assertEqual(self.pages(f'{url}?q=user\U0010ffff'), [])
+        self.assertEqual(self.pages(f'{url}?q=\U0010ffff'), [])
+        self.assertEqual(prefix_upper_bound('a\U0010ffff'), 'b')
+        self.assertEqual(prefix_upper_bound('\ud7ff'), '\ue000')
+        self.assertIsNone(prefix_upper_bound('\U0010ffff'))
+
+
+class CommentThreadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer = seed_graph(users=3, posts_per_user=1, comments_per_post=3)
+        self.post = Post.objects.exclude(user=self.viewer).order_by('id').first()
+        self.url = f'/api/posts/{self.post.id}/comments/'
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_replies_stay_one_level_deep(self):
+        thread = Comment.objects.filter(post=self.post).order_by('id').first()
+        reply = self.client.post(self.url, {'parent': thread.id, 'text': 'first'}, format='json').json()
+        nested = self.client.post(self.url, {'parent': reply['id'], 'text': 'second'}, format='json').json()
+        self.assertEqual((reply['parent'], nested['parent']), (thread.id, thread.id))
+
+        top_level = self.client.get(self.url).json()['results']
+        self.assertEqual(len(top_level), 3)
+        self.assertEqual({c['id']: c['reply_count'] for c in top_level}[thread.id], 2)
+        replies = self.client.get(f'{self.url}?parent={thread.id}').json()['results']
+        self.assertEqual([c['text'] for c in replies], ['first', 'second'])
+
+        Comment.objects.get(pk=reply['id']).delete()
+        self.assertEqual(Comment.objects.get(pk=thread.id).reply_count, 1)
+        other = Comment.objects.exclude(post=self.post).first()
+        response = self.client.post(self.url, {'parent': other.id, 'text': 'elsewhere'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_pages(self):
+        Comment.objects.bulk_create([Comment(user=self.viewer, post=self.post, text=f'more {n}') for n in range(25)])
+        first = self.client.get(self.url).json()
+        second = self.client.get(first['next']).json()
+        ids = [c['id'] for c in first['results'] + second['results']]
+        self.assertEqual((len(first['results']), second['next']), (20, None))
+        self.assertEqual(ids, list(self.post.comments.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_rejects_bad_cursors(self):
+        thread = Comment.objects.filter(post=self.post).order_by('id').first()
+        # Top-level comments page newest first, replies oldest first
+        for query in ('', f'parent={thread.id}&'):
+            for position in (['garbage', 1], ['2026-01-01T00:00:00+00:00', None], [1, 2, 3]):
+                cursor = base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+                with self.subTest(query=query, position=position):
+                    self.assertEqual(self.client.get(f'{self.url}?{query}cursor={cursor}').status_code, 404)
+            self.assertEqual(self.client.get(f'{self.url}?{query}cursor=%%%').status_code, 404)
+
+    def test_preview_is_cached_until_comments_change(self):
+        url = f'/api/posts/{self.post.id}/?expand=comments_preview'
+        newest = list(self.post.comments.order_by('-created_at', '-id').values_list('text', flat=True)[:2])
+        self.assertEqual([c['text'] for c in self.client.get(url).json()['comments_preview']], newest)
+        self.assertEqual(comment_previews.preview_rows([self.post.id])[self.post.id][0]['text'], newest[0])
+        with self.assertNumQueries(0):
+            comment_previews.preview_rows([self.post.id])
+
+        self.client.post(self.url, {'text': 'latest'}, format='json')
+        preview = self.client.get(url).json()['comments_preview']
+        self.assertEqual([c['text'] for c in preview], ['latest', newest[0]])
+        self.assertNotIn('comments_preview', self.client.get(f'/api/posts/{self.post.id}/').json())
+
+
+class MentionTests(TestCase):
+    def setUp(self):
+        self.author = seed_graph(users=4, posts_per_user=1, comments_per_post=0)
+        self.post = Post.objects.filter(user=self.author).first()
+
+    def mentioned(self):
+        return set(Notification.objects.filter(notification_type='mention').values_list('user__username', flat=True))
+
+    def test_parse(self):
+        text = 'Thanks @alice, @bob. and @alice again! Mail me at carol@example.com @dave.smith.'
+        self.assertEqual(parse_mentions(text), ['alice', 'bob', 'dave.smith'])
+        self.assertEqual(parse_mentions(text, limit=2), ['alice', 'bob'])
+        self.assertEqual(parse_mentions(None), [])
+
+    def test_one_query_per_step(self):
+        User.objects.filter(username='user3').update(is_active=False)
+        text = '@user0 @user1 @user1 @user2 @user3 @nobody'
+        with self.assertNumQueries(2):
+            notify_mentions(text, self.author, self.post)
+        # Not the author, only once each, and not deactivated accounts
+        self.assertEqual(self.mentioned(), {'user1', 'user2'})
+
+    @override_settings(MENTIONS={'MAX_PER_MESSAGE': 1})
+    def test_capped_per_message(self):
+        notify_mentions('@user1 @user2 @user3', self.author, self.post)
+        self.assertEqual(self.mentioned(), {'user1'})
+
+    def test_comment_skips_the_post_author(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.get(username='user1'))
+        client.post(f'/api/posts/{self.post.id}/comments/', {'text': '@user0 @user2 look'}, format='json')
+        self.assertEqual(self.mentioned(), {'user2'})
+        self.assertEqual(Notification.objects.filter(user=self.author, notification_type='comment').count(), 1)
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        ratelimit.locmem_store.clear()
+        self.addCleanup(ratelimit.locmem_store.clear)
+        cache.clear()
+        self.viewer = seed_graph(users=3, posts_per_user=1)
+        self.post = Post.objects.exclude(user=self.viewer).first()
+
+    def test_bucket_refills_evenly(self):
+        capacity, interval = ratelimit.parse_rate('3/min')
+        self.assertEqual((capacity, interval), (3, 20.0))
+        full_at = None
+        for _ in range(3):
+            allowed, full_at, _ = ratelimit.consume(full_at, capacity, interval, now=1000.0)
+            self.assertTrue(allowed)
+        allowed, _, wait = ratelimit.consume(full_at, capacity, interval, now=1000.0)
+        self.assertEqual((allowed, wait), (False, 20.0))
+        self.assertTrue(ratelimit.consume(full_at, capacity, interval, now=1020.0)[0])
+
+    @override_settings(RATE_LIMITS={'SCOPES': {'like': '2/min'}})
+    def test_api_writes_get_429_with_retry_after(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        url = f'/api/posts/{self.post.id}/like/'
+        self.assertEqual([client.put(url).status_code for _ in range(2)], [200, 200])
+        refused = client.put(url)
+        self.assertEqual(refused.status_code, 429)
+        self.assertEqual(refused['Retry-After'], '30')
+        # Reads are not limited, and other users have their own buckets
+        self.assertEqual(client.get('/api/posts/').status_code, 200)
+        client.force_authenticate(User.objects.exclude(pk=self.viewer.pk).first())
+        self.assertEqual(client.put(url).status_code, 200)
+
+    @override_settings(RATE_LIMITS={'SCOPES': {'login': '1/min'}})
+    def test_template_views_are_limited_per_ip(self):
+        def attempt(ip):
+            return Client().post('/login/', {'username': 'user1', 'password': 'wrong'},
+                                 content_type='application/json', REMOTE_ADDR=ip)
+        self.assertEqual(attempt('10.0.0.1').status_code, 400)
+        refused = attempt('10.0.0.1')
+        self.assertEqual((refused.status_code, refused['Retry-After']), (429, '60'))
+        self.assertEqual(attempt('10.0.0.2').status_code, 400)
+
+    @override_settings(RATE_LIMITS={'SCOPES': {'login': '1/min'}})
+    def test_forwarded_for_cannot_dodge_the_limit(self):
+        def attempt(forwarded_for, remote_addr='10.0.0.1'):
+            return Client().post('/login/', {'username': 'user1', 'password': 'wrong'}, content_type='application/json',
+                                 REMOTE_ADDR=remote_addr, HTTP_X_FORWARDED_FOR=forwarded_for)
+        self.assertEqual(attempt('198.51.100.1').status_code, 400)
+        self.assertEqual(attempt('198.51.100.2').status_code, 429)
+
+        # Behind one proxy, only the address it appended counts
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            self.assertEqual(attempt('198.51.100.3, 203.0.113.7', '10.0.0.9').status_code, 400)
+            self.assertEqual(attempt('198.51.100.4, 203.0.113.7', '10.0.0.9').status_code, 429)
+            self.assertEqual(attempt('203.0.113.8', '10.0.0.9').status_code, 400)
+
+    @override_settings(RATE_LIMITS={'BACKEND': 'cache', 'SCOPES': {'comment': '1/hour'}})
+    def test_cache_backend_is_shared(self):
+        # Two workers' stores see the same bucket through the cache
+        first, second = ratelimit.CacheStore('default'), ratelimit.CacheStore('default')
+        self.assertTrue(first.take('worker-test', 1, 3600.0, time.time())[0])
+        self.assertFalse(second.take('worker-test', 1, 3600.0, time.time())[0])
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        url = f'/api/posts/{self.post.id}/comments/'
+        self.assertEqual(client.post(url, {'text': 'one'}, format='json').status_code, 201)
+        self.assertEqual(client.post(url, {'text': 'two'}, format='json').status_code, 429)
+        self.assertEqual(ratelimit.locmem_store.full_at, {})
+
+
+
+
+class NameAvailabilityTests(TestCase):
+    def setUp(self):
+        ratelimit.locmem_store.clear()
+        seed_graph(users=3, posts_per_user=1)
+        enabled = mock.patch.object(availability.names, 'enabled', True)
+        enabled.start()
+        self.addCleanup(enabled.stop)
+        # A pool thread could not see this test's users, so builds run here
+        background = mock.patch.object(availability.names, 'rebuild_in_background')
+        self.rebuild_in_background = background.start()
+        self.addCleanup(background.stop)
+        self.addCleanup(setattr, availability.names, 'filter', None)
+        # As start_name_filter() does when the server starts
+        availability.names.rebuild(availability.name_filter_settings())
+
+    def available(self, **params):
+        return APIClient().get('/api/users/available/', params).json()
+
+    def register(self, **data):
+        data = {'username': 'newcomer', 'email': 'newcomer@example.com', 'password': 'secret-pass', **data}
+        return Client().post('/register/', data, content_type='application/json')
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = availability.BloomFilter(2000, 0.01)
+        for n in range(2000):
+            bloom.add(f'taken{n}')
+        self.assertTrue(all(f'taken{n}' in bloom for n in range(2000)))
+        false_positives = sum(f'free{n}' in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_free_names_cost_no_query(self):
+        with self.assertNumQueries(1):
+            # A name the filter holds is looked up
+            self.assertEqual(self.available(username='user1'), {'username': 'user1', 'available': False})
+        with self.assertNumQueries(0):
+            self.assertTrue(self.available(username='somebody-new')['available'])
+            invalid = self.available(username='no spaces')
+        self.assertFalse(invalid['available'])
+        self.assertIn('valid username', invalid['error'])
+        self.assertEqual(APIClient().get('/api/users/available/').status_code, 400)
+        # Emails are not looked up
+        self.assertEqual(APIClient().get('/api/users/available/', {'email': 'user1@example.com'}).status_code, 400)
+
+    def test_stale_filters_are_rebuilt_off_the_request(self):
+        bloom = availability.names.filter
+        availability.names.built_at -= availability.name_filter_settings()['TTL'] + 1
+        with self.assertNumQueries(0):
+            self.assertTrue(self.available(username='somebody-new')['available'])
+        # The old filter answered, and the rebuild was left to a thread
+        self.assertIs(availability.names.filter, bloom)
+        self.rebuild_in_background.assert_called()
+
+        # Before the first build, checks go to the database
+        availability.names.filter = None
+        with self.assertNumQueries(1):
+            self.assertFalse(self.available(username='user1')['available'])
+
+    def test_background_rebuild_keeps_names_added_meanwhile(self):
+        names = availability.NameFilter()
+        reading = threading.Event()
+        release = threading.Event()
+        real_rebuild = names.rebuild
+
+        def slow_rebuild(config):
+            reading.set()
+            release.wait(5)
+            real_rebuild(config)
+
+        with mock.patch.object(names, 'rebuild', slow_rebuild), \
+                mock.patch.object(availability.User.objects, 'values_list', return_value=User.objects.none()):
+            names.rebuild_in_background()
+            self.assertTrue(reading.wait(5))
+            names.add([availability.name_key('username', 'meanwhile')])
+            names.rebuild_in_background()  # Already running: no second thread
+            release.set()
+            for _ in range(50):
+                if names.filter is not None:
+                    break
+                time.sleep(0.1)
+        self.assertTrue(names.may_contain(availability.name_key('username', 'meanwhile')))
+
+    @override_settings(RATE_LIMITS={'SCOPES': {'lookup': '3/min'}})
+    def test_lookups_are_limited_per_ip(self):
+        client = APIClient()
+        statuses = [client.get('/api/users/available/', {'username': f'name{n}'}).status_code for n in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        self.assertEqual(APIClient(REMOTE_ADDR='10.0.0.2').get('/api/users/available/', {'username': 'x'}).status_code, 200)
+
+    def test_registration_relies_on_unique_constraints(self):
+        self.assertTrue(self.available(username='newcomer')['available'])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.register()
+        self.assertEqual(response.status_code, 200, response.content)
+        # No existence checks before the INSERT
+        statements = [query['sql'] for query in ctx.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertTrue(statements[0].startswith('INSERT'), statements[0])
+        # Names registered in this process are in the filter at once
+        self.assertFalse(self.available(username='newcomer')['available'])
+
+        taken_username = self.register(email='other@example.com')
+        self.assertEqual((taken_username.status_code, taken_username.json()), (400, {'error': 'Username already exists'}))
+        taken_email = self.register(username='other')
+        self.assertEqual(taken_email.json(), {'error': 'Email already exists'})
+        self.assertEqual(self.register(password='').status_code, 400)
+
+    def test_registration_needs_a_json_object(self):
+        for body in ('[1]', '"newcomer"', 'null', '{'):
+            with self.subTest(body=body):
+                response = Client().post('/register/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(username='newcomer').exists())
+
+    def test_password_reset_by_username_or_email(self):
+        def reset(identity):
+            return Client().post('/password-reset/', {'identity': identity, 'password': 'new-pass-123'},
+                                 content_type='application/json').status_code
+        self.assertEqual([reset('user1'), reset('user2@example.com'), reset('nobody@example.com')], [200, 200, 404])
+        self.assertTrue(User.objects.get(username='user2').check_password('new-pass-123'))
+
+
+class CachedAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer = seed_graph(users=3, posts_per_user=1)
+        self.token = str(RefreshToken.for_user(self.viewer).access_token)
+
+    def authenticate(self):
+        request = Request(APIRequestFactory().get('/api/posts/', HTTP_AUTHORIZATION=f'Bearer {self.token}'))
+        return CachedJWTAuthentication().authenticate(request)[0]
+
+    def test_jwt_user_is_read_from_the_cache(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual((user.pk, user.username, user.is_active), (self.viewer.pk, self.viewer.username, True))
+        # Fields that are not cached are deferred
+        self.assertEqual(user.get_deferred_fields(), {'password', 'email', 'bio', 'phone', 'website', 'last_login',
+                                                      'first_name', 'last_name', 'date_joined', 'created_at',
+                                                      'updated_at'})
+        response = APIClient().get('/api/posts/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, 200)
+
+    def test_saving_or_deactivating_drops_the_cached_user(self):
+        self.authenticate()
+        self.viewer.full_name = 'Renamed'
+        self.viewer.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate().full_name, 'Renamed')
+        self.viewer.is_active = False
+        self.viewer.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+        response = APIClient().get('/api/posts/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, 401)
+
+    def test_session_clients(self):
+        client = Client()
+        client.force_login(self.viewer)
+        self.assertEqual(client.get('/api/notifications/').status_code, 200)
+        self.assertIsNotNone(cache.get(f'auth-user:{self.viewer.pk}'))
+        self.assertEqual(client.get('/api/notifications/').status_code, 200)
+        # A password change signs the session out, as with Django's own check
+        self.viewer.set_password('changed-password')
+        self.viewer.save()
+        self.assertIn(client.get('/api/notifications/').status_code, (401, 403))
+
+
+
+class VideoMetadataTests(TestCase):
+    def setUp(self):
+        ratelimit.locmem_store.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        media_root = override_settings(MEDIA_ROOT=self.tmp.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.viewer = seed_graph(users=2, posts_per_user=1)
+
+    def video(self, index=1, name=None):
+        path = os.path.join(self.tmp.name, name or f'clip{index}.mp4')
+        render_video((path, index, 360))
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_mp4_header_is_parsed_without_reading_media_data(self):
+        data = self.video(index=1)
+        # A large mdat after the header must not be read
+        source = BytesIO(data + struct.pack('>I4sQ', 1, b'mdat', 16 + 10 ** 9))
+        info = media.parse_mp4(source)
+        self.assertEqual((info.width, info.height), (360, 640))
+        self.assertGreater(info.duration, 3)
+        self.assertIsNone(media.parse_mp4(BytesIO(b'not a video at all')))
+
+    def test_upload_stores_metadata_and_poster(self):
+        poster = BytesIO()
+        Image.new('RGB', (36, 64)).save(poster, 'JPEG')
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        upload = SimpleUploadedFile('clip.mp4', self.video(index=1), content_type='video/mp4')
+        with mock.patch.object(media, 'render_poster', return_value=poster.getvalue()) as render:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = client.post('/api/posts/', {'caption': 'clip', 'media': upload}, format='multipart')
+            # Nothing is read from the video before the response
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual((response.data['media_type'], response.data['width']), ('video', None))
+            render.assert_not_called()
+            url = f'/api/posts/{response.data["id"]}/'
+            etag = client.get(url)['ETag']
+            for callback in callbacks:
+                callback()
+        post = Post.objects.get(pk=response.data['id'])
+        self.assertEqual((post.media_type, post.width, post.height), ('video', 360, 640))
+        self.assertTrue(post.poster.name.startswith('posters/clip'))
+        fresh = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fresh.status_code, 200)
+        data = fresh.data
+        self.assertEqual((data['width'], data['height'], data['duration']), (360, 640, post.duration))
+        self.assertTrue(data['poster'].endswith('.jpg'))
+
+    def test_skips_posts_whose_video_is_gone(self):
+        post = Post.objects.first()
+        Post.objects.filter(pk=post.pk).update(media='gone.mp4', media_type='video')
+        with mock.patch.object(media, 'process_video') as process:
+            media.process_post(post.pk)
+            media.process_post(0)
+        process.assert_not_called()
+
+    def test_backfill_command(self):
+        post = Post.objects.first()
+        # Uploaded before videos were processed
+        self.video(index=2, name='old.mp4')
+        Post.objects.filter(pk=post.pk).update(media='old.mp4', media_type='video')
+        out = StringIO()
+        call_command('process_media', stdout=out)
+        self.assertIn('Processed 1 video file(s)', out.getvalue())
+        post.refresh_from_db()
+        self.assertEqual((post.width, post.height), (360, 360))
+
+
+@override_settings(MEDIA_PIPELINE={'WORKERS': 1, 'FFMPEG': None})
+class VideoPoolTests(TransactionTestCase):
+    def setUp(self):
+        ratelimit.locmem_store.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        media_root = override_settings(MEDIA_ROOT=self.tmp.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        pool = mock.patch.object(media, '_pool', None)
+        pool.start()
+        self.addCleanup(pool.stop)
+        self.viewer = seed_graph(users=2, posts_per_user=1)
+
+    def test_uploads_are_processed_after_the_response(self):
+        path = os.path.join(self.tmp.name, 'clip.mp4')
+        render_video((path, 1, 360))
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        with open(path, 'rb') as f:
+            upload = SimpleUploadedFile('clip.mp4', f.read(), content_type='video/mp4')
+        response = client.post('/api/posts/', {'caption': 'clip', 'media': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        # One worker, so this runs once the upload's task is done
+        pool = media.get_pool()
+        pool.submit(lambda: None).result(timeout=30)
+        pool.shutdown()
+        post = Post.objects.get(pk=response.data['id'])
+        self.assertEqual((post.width, post.height), (360, 640))
+        self.assertEqual(post.poster.name, '')
+
+
+class SQLiteTuningTests(TransactionTestCase):
+    def test_connections_are_tuned(self):
+        with connection.cursor() as cursor:
+            values = {
+                pragma: cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
+                for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store')
+            }
+        self.assertEqual(values, {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 10000, 'temp_store': 2})
+
+    def test_maintenance_command(self):
+        out = StringIO()
+        call_command('sqlite_maintenance', analyze=True, stdout=out)
+        self.assertIn('WAL checkpointed', out.getvalue())
+
+    def test_contention_benchmark(self):
+        seed_graph(users=4, posts_per_user=2)
+        stats = run_contention(
+            connection.settings_dict['NAME'], sqlite_pragmas(), 'BEGIN IMMEDIATE', 'WAL', writers=2, transactions=20,
+        )
+        self.assertEqual((stats['requests'], stats['errors']), (20, 0))
+
+
+class ProfilingMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', 'staff@example.com', 'pass', is_staff=True)
+        cls.member = User.objects.create_user('member', 'member@example.com', 'pass')
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.override = override_settings(PROFILING={'OUTPUT_DIR': Path(self.tmp.name)})
+        self.override.enable()
+        self.addCleanup(self.override.disable)
+
+    def get(self, user, url='/api/posts/', **extra):
+        client = APIClient()
+        token = RefreshToken.for_user(user).access_token
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client.get(url, **extra)
+
+    def test_staff_cprofile_is_stored(self):
+        response = self.get(self.staff, '/api/posts/?_profile=cprofile')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Profile-Output'].endswith('PostViewSet.list-%d.prof' % os.getpid()))
+        self.assertTrue((Path(self.tmp.name) / response['X-Profile-Output']).exists())
+
+    def test_staff_sample_can_be_returned_inline(self):
+        response = self.get(self.staff, '/api/posts/?_profile=sample&_profile_return=1')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertTrue(response['X-Profile-Output'].endswith('.collapsed'))
+
+    def test_non_staff_requests_are_not_profiled(self):
+        response = self.get(self.member, HTTP_X_PROFILE='cprofile')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Output', response)
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [])
+
+    def test_continuous_sampling_leaves_dispatch_to_django(self):
+        names = []
+
+        class Active(dict):
+            def __setitem__(self, key, value):
+                names.append(value)
+                super().__setitem__(key, value)
+
+        sampler = mock.Mock(active=Active())
+        config = {'OUTPUT_DIR': Path(self.tmp.name), 'CONTINUOUS': True, 'SAMPLE_RATE': 1.0}
+        with override_settings(PROFILING=config), \
+                mock.patch('core.profiling.get_continuous_sampler', return_value=sampler), \
+                mock.patch('core.profiling._continuous_sampler', sampler):
+            response = self.get(self.member)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Output', response)
+        # Sampled from the start of the request, then named after its view
+        self.assertEqual(names, ['GET', 'PostViewSet.list'])
+        self.assertEqual(sampler.active, {})
+
+
+class FastJSONTests(TestCase):
+    def test_renderer_matches_drf_output(self):
+        viewer = seed_graph(users=3, posts_per_user=2)
+        client = APIClient()
+        client.force_authenticate(viewer)
+        data = client.get('/api/posts/').data
+        data['extra'] = {
+            'when': datetime(2026, 1, 2, 3, 4, 5, 678901, tzinfo=dt_timezone.utc),
+            'day': date(2026, 1, 2),
+            'amount': Decimal('1.50'),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'text': 'line\u2028separator ✓',
+            1: 'non-string key',
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_parser_rejects_invalid_json(self):
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(BytesIO('{"text": "ok ✓"}'.encode())), {'text': 'ok ✓'})
+        with self.assertRaises(ParseError):
+            parser.parse(BytesIO(b'{"text": NaN}'))
+
+
+class CompiledSerializerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = seed_graph(users=4, posts_per_user=3)
+        Notification.objects.create(
+            user=cls.viewer, from_user=cls.viewer, notification_type='follow', text='no post'
+        )
+
+    def assertMatchesFullSerializer(self, url, viewset, serializer_class):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        view = viewset(action='list', format_kwarg=None)
+        view.request = Request(response.wsgi_request)
+        view.request.user = self.viewer
+        queryset = view.get_queryset()[:len(response.data['results'])]
+        expected = serializer_class(queryset, many=True, context=view.get_serializer_context()).data
+        self.assertTrue(expected)
+        self.assertEqual(
+            FastJSONRenderer().render(response.data['results']),
+            JSONRenderer().render(expected),
+        )
+
+    def test_post_list(self):
+        self.assertMatchesFullSerializer('/api/posts/', PostViewSet, PostSerializer)
+
+    def test_story_list(self):
+        self.assertMatchesFullSerializer('/api/stories/', StoryViewSet, StorySerializer)
+
+    def test_notification_list(self):
+        self.assertMatchesFullSerializer('/api/notifications/', NotificationViewSet, NotificationSerializer)
+
+    def test_unsupported_serializer_falls_back(self):
+        class DottedSerializer(serializers.ModelSerializer):
+            author = serializers.CharField(source='user.username')
+
+            class Meta:
+                model = Post
+                fields = ['id', 'author']
+
+        compiled = CompiledSerializer(DottedSerializer)
+        with self.assertRaises(TypeError):
+            compiled.columns
+
+
+class SparseFieldsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = seed_graph(users=4, posts_per_user=4)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, ' '.join(query['sql'] for query in ctx.captured_queries)
+
+    def test_explore_grid_skips_counts_and_flags(self):
+        full, _ = self.get('/api/posts/?type=explore')
+        grid, sql = self.get('/api/posts/?type=explore&fields=id,media,user.username')
+        self.assertEqual(grid.data['results'][0].keys(), {'id', 'media', 'user'})
+        self.assertEqual(grid.data['results'][0]['user'].keys(), {'username'})
+        self.assertNotIn('COUNT(DISTINCT', sql)
+        self.assertNotIn('EXISTS', sql)
+        self.assertLess(len(grid.content) * 3, len(full.content))
+
+    def test_detail_and_profile_honour_fields(self):
+        post = Post.objects.filter(user=self.viewer).first()
+        response, sql = self.get(f'/api/posts/{post.id}/?fields=id,likes_count')
+        self.assertEqual(response.data, {'id': post.id, 'likes_count': post.likes.count()})
+        self.assertNotIn('EXISTS', sql)
+
+        response, sql = self.get(f'/api/users/{self.viewer.username}/?fields=username,bio')
+        self.assertEqual(set(response.data), {'username', 'bio'})
+        self.assertNotIn('COUNT(', sql)
+
+    def test_unknown_fields_are_ignored(self):
+        response, _ = self.get('/api/notifications/?fields=id,nope')
+        self.assertEqual(response.data['results'][0].keys(), {'id'})
+
+    def test_writes_ignore_fields(self):
+        post = Post.objects.filter(user=self.viewer).first()
+        response = self.client.patch(f'/api/posts/{post.id}/?fields=id', {'caption': 'edited'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Post.objects.get(pk=post.pk).caption, 'edited')
+        self.assertEqual(response.data['caption'], 'edited')
+
+        url = f'/api/posts/{post.id}/comments/?fields=id'
+        self.assertEqual(self.client.post(url, {'text': 'kept'}, format='json').status_code, 201)
+        self.assertTrue(Comment.objects.filter(post=post, text='kept').exists())
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = seed_graph(users=4, posts_per_user=2)
+        cls.other, cls.third = User.objects.exclude(pk=cls.viewer.pk).order_by('id')[:2]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def assertRevalidates(self, url, change):
+        """304 while nothing changed, a fresh 200 and ETag after ``change()``"""
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        self.assertIn('no-cache', first['Cache-Control'])
+
+        cached = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b'')
+        self.assertEqual(cached['ETag'], etag)
+
+        change()
+        fresh = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh['ETag'], etag)
+
+    def next_minute(self):
+        patcher = mock.patch('core.views.rolling_minute', return_value='next minute')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_feed_changes_with_followed_users_activity(self):
+        post = Post.objects.filter(user=self.other).first()
+        self.assertRevalidates('/api/posts/', lambda: Like.objects.filter(user=self.third, post=post).delete())
+        self.assertRevalidates('/api/posts/', lambda: Follow.objects.filter(follower=self.viewer).first().delete())
+        self.assertRevalidates('/api/posts/', lambda: Post.objects.create(user=self.other, media='posts/new.jpg'))
+        self.assertRevalidates('/api/posts/', lambda: User.objects.get(pk=self.other.pk).save(update_fields=['full_name']))
+
+    def test_writes_bump_no_follower_keys(self):
+        self.assertGreater(Follow.objects.filter(followed=self.other).count(), 1)
+        with mock.patch.object(versions.cache, 'set_many', wraps=versions.cache.set_many) as set_many:
+            Post.objects.create(user=self.other, media='posts/new.jpg')
+            Story.objects.create(user=self.other, media='stories/new.jpg')
+        keys = {key for call in set_many.call_args_list for key in call.args[0]}
+        self.assertEqual(keys, {
+            f'version:post:{Post.objects.latest("id").id}', f'version:author:{self.other.id}',
+            f'version:profile:{self.other.id}', f'version:stories:{self.other.id}',
+        })
+
+    def test_feed_etag_reads_the_authors_versions(self):
+        following = list(Follow.objects.filter(follower=self.viewer).values_list('followed_id', flat=True))
+        with mock.patch('core.views.make_etag', wraps=make_etag) as etag:
+            self.client.get('/api/posts/')
+        self.assertEqual(
+            sorted(etag.call_args.args[0]),
+            sorted([f'feed:{self.viewer.id}'] + [f'author:{user_id}' for user_id in [*following, self.viewer.id]]),
+        )
+
+    def test_etags_need_a_shared_cache(self):
+        self.addCleanup(setattr, versions, 'etags_enabled', True)
+        with self.assertLogs('core.versions', 'WARNING'):
+            versions.start_versions()
+        response = self.client.get('/api/posts/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_post_detail_changes_with_its_comments_and_author(self):
+        post = Post.objects.filter(user=self.other).first()
+        url = f'/api/posts/{post.id}/'
+        self.assertRevalidates(url, lambda: Comment.objects.create(user=self.third, post=post, text='hi'))
+        self.assertRevalidates(url, lambda: User.objects.filter(pk=self.other.pk).first().save())
+
+    def test_profile_changes_with_follows(self):
+        url = f'/api/users/{self.other.username}/'
+        self.assertRevalidates(url, lambda: self.client.post(f'/api/users/{self.other.username}/follow/'))
+
+    def test_stories_change_with_new_stories_and_each_minute(self):
+        story = Story.objects.filter(user=self.other).first()
+        self.assertRevalidates('/api/stories/', lambda: Story.objects.create(user=self.other, media='stories/new.jpg'))
+        self.assertRevalidates('/api/stories/', lambda: StoryView.objects.create(story=story, user=self.third))
+        # Stories expire without a write
+        self.assertRevalidates('/api/stories/', self.next_minute)
+
+    def test_notifications_change_when_marked_read(self):
+        self.assertRevalidates('/api/notifications/', lambda: self.client.post('/api/notifications/mark_all_read/'))
+
+    def test_etag_depends_on_viewer_and_query(self):
+        etag = self.client.get('/api/posts/')['ETag']
+        self.assertEqual(self.client.get('/api/posts/?fields=id', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.client.force_authenticate(self.other)
+        self.assertEqual(self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CompressionTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.TemporaryDirectory()
+        cls.settings_override = override_settings(STATIC_ROOT=cls.static_root.name)
+        cls.settings_override.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.app_js = staticfiles_storage.stored_name('js/app.js')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.settings_override.disable()
+        cls.static_root.cleanup()
+        super().tearDownClass()
+
+    def test_collectstatic_fingerprints_and_precompresses(self):
+        self.assertRegex(self.app_js, r'^js/app\.[0-9a-f]{12}\.js$')
+        original = (Path(self.static_root.name) / self.app_js).read_bytes()
+        compressed = Path(self.static_root.name) / f'{self.app_js}.gz'
+        self.assertEqual(gzip.decompress(compressed.read_bytes()), original)
+        self.assertFalse((Path(self.static_root.name) / 'images/default-avatar.png.gz').exists())
+
+    def test_serves_precompressed_variant_with_immutable_caching(self):
+        url = f'/static/{self.app_js}'
+        response = Client().get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        body = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(response['Content-Type'].startswith('text/javascript'))
+
+        plain = Client().get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(gzip.decompress(body), b''.join(plain.streaming_content))
+
+    def test_unhashed_names_get_a_short_max_age(self):
+        response = Client().get('/static/js/app.js')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+    def test_large_api_responses_are_gzipped(self):
+        viewer = seed_graph(users=3, posts_per_user=3)
+        client = APIClient()
+        client.force_authenticate(viewer)
+        response = client.get('/api/posts/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['count'], 9)
+
+        small = client.get('/api/posts/?fields=id', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertLess(len(small.content), 1024)
+        self.assertFalse(small.has_header('Content-Encoding'))
+
+        # The weakened ETag still revalidates
+        cached = client.get('/api/posts/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertEqual(cached.status_code, 304)
+
+
+class InteractionBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = seed_graph(users=3, posts_per_user=2, likes_per_post=0)
+        cls.other = User.objects.exclude(pk=cls.viewer.pk).order_by('id').first()
+        cls.post, cls.second = Post.objects.filter(user=cls.other).order_by('id')
+        cls.story = Story.objects.filter(user=cls.other).first()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def batch(self, *ops):
+        return self.client.post('/api/interactions/batch/', {'ops': list(ops)}, format='json')
+
+    def test_applies_operations_in_order(self):
+        response = self.batch(
+            {'type': 'like', 'id': self.post.id, 'state': True},
+            {'type': 'save', 'id': self.second.id, 'state': True},
+            {'type': 'like', 'id': self.second.id, 'state': True},
+            {'type': 'like', 'id': self.second.id, 'state': False},
+            {'type': 'view', 'id': self.story.id, 'state': True},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Like.objects.filter(user=self.viewer, post=self.post).exists())
+        self.assertFalse(Like.objects.filter(user=self.viewer, post=self.second).exists())
+        self.assertTrue(Save.objects.filter(user=self.viewer, post=self.second).exists())
+        self.assertTrue(StoryView.objects.filter(user=self.viewer, story=self.story).exists())
+        self.assertEqual(response.data['likes_count'], {self.post.id: 1, self.second.id: 0})
+        self.assertEqual([op['type'] for op in response.data['results']], ['like', 'save', 'like', 'view'])
+
+    def test_replaying_a_batch_changes_nothing(self):
+        op = {'type': 'like', 'id': self.post.id, 'state': True}
+        self.batch(op)
+        self.batch(op)
+        self.assertEqual(Like.objects.filter(post=self.post).count(), 1)
+        self.assertEqual(Notification.objects.filter(from_user=self.viewer, post=self.post).count(), 1)
+
+    def test_skips_posts_the_user_cannot_see(self):
+        stranger = User.objects.create_user(username='stranger', email='stranger@example.com', password='x')
+        hidden = Post.objects.create(user=stranger, media='posts/hidden.jpg')
+        response = self.batch({'type': 'like', 'id': hidden.id, 'state': True})
+        self.assertFalse(response.data['results'][0]['applied'])
+        self.assertFalse(Like.objects.filter(post=hidden).exists())
+
+    def test_counts_only_rows_this_batch_changed(self):
+        # As if a concurrent batch had liked the first post and viewed the story just before
+        Like.objects.bulk_create([Like(user=self.viewer, post=self.post)])
+        StoryView.objects.bulk_create([StoryView(user=self.viewer, story=self.story)])
+        inserted = insert_ignore_many([Like(user=self.viewer, post=self.post), Like(user=self.viewer, post=self.second)])
+        self.assertEqual([like.post_id for like in inserted], [self.second.id])
+
+        Like.objects.filter(post=self.second).delete()
+        response = self.batch(
+            {'type': 'like', 'id': self.post.id, 'state': True},
+            {'type': 'like', 'id': self.second.id, 'state': True},
+            {'type': 'view', 'id': self.story.id, 'state': True},
+        )
+        self.assertEqual(response.data['likes_count'], {self.post.id: 0, self.second.id: 1})
+        self.assertEqual(Story.objects.get(pk=self.story.pk).view_count, 0)
+        self.assertEqual(Notification.objects.filter(from_user=self.viewer, post=self.post).count(), 0)
+
+        # A like another request already removed is not counted down again
+        Like.objects.filter(post=self.second).update(user=self.other)
+        self.assertEqual(delete_matching_many([Like(user=self.viewer, post=self.second)]), [])
+        self.batch({'type': 'like', 'id': self.second.id, 'state': False})
+        self.assertEqual(Post.objects.get(pk=self.second.pk).like_count, 1)
+
+    def test_rejects_unviewing_a_story(self):
+        response = self.batch({'type': 'view', 'id': self.story.id, 'state': False})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalidates_feed_etag(self):
+        etag = self.client.get('/api/posts/')['ETag']
+        self.batch({'type': 'like', 'id': self.post.id, 'state': True})
+        self.assertEqual(self.client.get('/api/posts/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class SetStateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = seed_graph(users=3, posts_per_user=1, likes_per_post=0)
+        cls.other = User.objects.exclude(pk=cls.viewer.pk).order_by('id').first()
+        cls.post = Post.objects.filter(user=cls.other).first()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+        self.url = f'/api/posts/{self.post.id}/like/'
+
+    def like_notifications(self):
+        return Notification.objects.filter(from_user=self.viewer, notification_type='like').count()
+
+    def test_put_and_delete_set_state(self):
+        for _ in range(2):
+            response = self.client.put(self.url)
+            self.assertEqual(response.data, {'status': 'liked', 'likes_count': 1})
+        self.assertEqual(self.like_notifications(), 1)
+        for _ in range(2):
+            response = self.client.delete(self.url)
+            self.assertEqual(response.data, {'status': 'unliked', 'likes_count': 0})
+
+    def test_state_query_parameter(self):
+        self.client.post(f'{self.url}?state=true')
+        self.client.post(f'{self.url}?state=true')
+        self.assertTrue(Like.objects.filter(user=self.viewer, post=self.post).exists())
+        self.assertEqual(self.client.post(f'{self.url}?state=maybe').status_code, 400)
+
+    def test_save_and_follow_set_state(self):
+        save_url = f'/api/posts/{self.post.id}/save_post/'
+        self.assertEqual(self.client.put(save_url).data, {'status': 'saved'})
+        self.assertEqual(self.client.put(save_url).data, {'status': 'saved'})
+        follow_url = f'/api/users/{self.other.username}/follow/'
+        self.assertEqual(self.client.delete(follow_url).data, {'status': 'unfollowed'})
+        self.assertEqual(self.client.delete(follow_url).data, {'status': 'unfollowed'})
+        self.assertFalse(Follow.objects.filter(follower=self.viewer, followed=self.other).exists())
+
+    def test_idempotency_key_replays_the_first_response(self):
+        first = self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='tap-1')
+        retry = self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='tap-1')
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        # The toggle ran once, so the retry did not unlike
+        self.assertTrue(Like.objects.filter(user=self.viewer, post=self.post).exists())
+
+        reused = self.client.delete(self.url, HTTP_IDEMPOTENCY_KEY='tap-1')
+        self.assertEqual(reused.status_code, 422)
+
+    def test_in_progress_key_conflicts(self):
+        self.client.put(self.url, HTTP_IDEMPOTENCY_KEY='busy')
+        IdempotencyKey.objects.filter(key='busy').update(status_code=None, response=None)
+        self.assertEqual(self.client.put(self.url, HTTP_IDEMPOTENCY_KEY='busy').status_code, 409)
+
+    def test_expired_keys_are_purged_and_reusable(self):
+        self.client.put(self.url, HTTP_IDEMPOTENCY_KEY='old')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=1))
+        self.client.delete(self.url)
+        response = self.client.put(self.url, HTTP_IDEMPOTENCY_KEY='old')
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(purge_expired(force=True), 1)
+
+
+class CounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = seed_graph(users=3, posts_per_user=2, likes_per_post=0, comments_per_post=0)
+        cls.other = User.objects.exclude(pk=cls.viewer.pk).order_by('id').first()
+        cls.post, cls.second = Post.objects.filter(user=cls.other).order_by('id')
+        cls.story = Story.objects.filter(user=cls.other).first()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+        self.addCleanup(counters.buffer.pending.clear)
+
+    def counts(self, post):
+        post.refresh_from_db()
+        return post.like_count, post.comment_count
+
+    def test_signals_keep_counters_current(self):
+        self.client.put(f'/api/posts/{self.post.id}/like/')
+        self.client.post(f'/api/posts/{self.post.id}/comments/', {'text': 'Nice'})
+        self.assertEqual(self.counts(self.post), (1, 1))
+        self.client.delete(f'/api/posts/{self.post.id}/like/')
+        self.assertEqual(self.counts(self.post), (0, 1))
+
+        self.client.post('/api/interactions/batch/', {'ops': [
+            {'type': 'like', 'id': self.second.id, 'state': True},
+            {'type': 'view', 'id': self.story.id, 'state': True},
+        ]}, format='json')
+        self.client.post('/api/interactions/batch/', {'ops': [
+            {'type': 'view', 'id': self.story.id, 'state': True},
+        ]}, format='json')
+        self.assertEqual(self.counts(self.second), (1, 0))
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.view_count, StoryView.objects.filter(story=self.story).count())
+
+    def test_flush_writes_one_update_per_table(self):
+        buffer = counters.CounterBuffer(flush_interval=1)
+        for post in (self.post, self.second):
+            for _ in range(3):
+                buffer.add(Post, post.id, 'like_count')
+        buffer.add(Post, self.second.id, 'comment_count', 2)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(sum(query['sql'].startswith('UPDATE') for query in queries), 1)
+        self.assertEqual(self.counts(self.post), (3, 0))
+        self.assertEqual(self.counts(self.second), (3, 2))
+        self.assertEqual(buffer.flush(), 0)
+
+    def test_write_behind_reads_include_pending_deltas(self):
+        with mock.patch.object(counters.buffer, 'running', True):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.put(f'/api/posts/{self.post.id}/like/')
+            self.assertEqual(counters.buffer.get(Post, self.post.id, 'like_count'), 1)
+            self.assertEqual(self.counts(self.post), (0, 0))
+
+            feed = self.client.get('/api/posts/', {'fields': 'id,likes_count'}).data['results']
+            self.assertEqual({row['id']: row['likes_count'] for row in feed}[self.post.id], 1)
+            detail = self.client.get(f'/api/posts/{self.post.id}/').data
+            self.assertEqual(detail['likes_count'], 1)
+
+        counters.buffer.flush()
+        self.assertEqual(self.counts(self.post), (1, 0))
+        self.assertEqual(counters.buffer.get(Post, self.post.id, 'like_count'), 0)
+
+    def test_recount_repairs_drift(self):
+        Post.objects.update(like_count=7)
+        Like.objects.create(user=self.viewer, post=self.post)
+        recount(Post)
+        self.assertEqual(self.counts(self.post), (1, 0))
+        self.assertEqual(self.counts(self.second), (0, 0))
+
+
+class ConcurrentInteractionTests(TransactionTestCase):
+    """Hammer one post from many threads; the final counts must add up"""
+    THREADS = 8
+
+    def setUp(self):
+        self.author = User.objects.create(username='author', email='author@example.com')
+        self.fans = User.objects.bulk_create([
+            User(username=f'fan{n}', email=f'fan{n}@example.com') for n in range(self.THREADS)
+        ])
+        Follow.objects.bulk_create([Follow(follower=fan, followed=self.author) for fan in self.fans])
+        self.post = Post.objects.create(user=self.author, media='posts/hot.mp4')
+        self.url = f'/api/posts/{self.post.id}/like/'
+
+    def run_threads(self, work, jobs):
+        def run(job):
+            try:
+                return work(*job)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as pool:
+            return list(pool.map(run, jobs))
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_random_set_state_sequences(self):
+        rng = random.Random(42)
+        plans = [(fan, [rng.choice(['put', 'delete']) for _ in range(15)]) for fan in self.fans]
+
+        def work(fan, plan):
+            client = self.client_for(fan)
+            for method in plan:
+                self.assertEqual(getattr(client, method)(self.url).status_code, 200)
+
+        self.run_threads(work, plans)
+        expected = sum(1 for _, plan in plans if plan[-1] == 'put')
+        self.assertEqual(Like.objects.filter(post=self.post).count(), expected)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, expected)
+
+    def test_duplicate_taps_like_once(self):
+        def work(fan, method, url, key):
+            response = getattr(self.client_for(fan), method)(url, HTTP_IDEMPOTENCY_KEY=key)
+            return response.status_code
+
+        # Plain repeated PUTs, plus client retries that reuse one key
+        jobs = [(fan, 'put', self.url, None) for fan in self.fans for _ in range(3)]
+        jobs += [(fan, 'post', f'{self.url}?state=true', f'retry-{fan.id}') for fan in self.fans for _ in range(3)]
+        random.Random(7).shuffle(jobs)
+        statuses = self.run_threads(work, jobs)
+
+        self.assertTrue(set(statuses) <= {200, 409}, statuses)
+        self.assertEqual(Like.objects.filter(post=self.post).count(), len(self.fans))
+        self.assertEqual(Notification.objects.filter(post=self.post, notification_type='like').count(), len(self.fans))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, len(self.fans))
+
+
+class FanOutTests(TransactionTestCase):
+    # Outside a transaction the profile page reads from any configured replica
+    databases = '__all__'
+
+    def setUp(self):
+        self.viewer = seed_graph(users=3, posts_per_user=2)
+        self.addCleanup(connections.close_all)
+
+    def task(self, seen):
+        def run():
+            seen.append(threading.get_ident())
+            time.sleep(0.2)
+            return User.objects.count()
+        return run
+
+    def test_runs_tasks_concurrently_with_their_own_connections(self):
+        seen = []
+        started = time.perf_counter()
+        results = fan_out(**{f'task{n}': self.task(seen) for n in range(4)})
+        self.assertLess(time.perf_counter() - started, 0.6)
+        self.assertEqual(results, {f'task{n}': 3 for n in range(4)})
+        self.assertEqual(len(set(seen)), 4)
+
+    def test_pool_threads_recycle_connections_like_requests(self):
+        workers = []
+
+        def task():
+            count = User.objects.count()
+            if threading.get_ident() != main:
+                workers.append(connections['default'])
+            return count
+
+        main = threading.get_ident()
+        with mock.patch.dict(connections.settings['default'], {'CONN_MAX_AGE': 0}):
+            fan_out(**{f'task{n}': task for n in range(4)})
+        self.assertTrue(workers)
+        # Closed at the end of the task, as CONN_MAX_AGE = 0 asks
+        self.assertTrue(all(worker.connection is None for worker in workers))
+
+    def test_runs_inline_inside_transactions(self):
+        seen = []
+        with transaction.atomic():
+            User.objects.create(username='uncommitted', email='uncommitted@example.com')
+            results = fan_out(first=self.task(seen), second=self.task(seen))
+        self.assertEqual(results, {'first': 4, 'second': 4})
+        self.assertEqual(set(seen), {threading.get_ident()})
+
+    def test_propagates_errors(self):
+        def fail():
+            raise ValueError('boom')
+        with self.assertRaises(ValueError):
+            fan_out(ok=User.objects.count, failing=fail)
+
+    def test_profile_page(self):
+        client = Client()
+        client.force_login(self.viewer)
+        response = client.get('/profile/user1/')
+        self.assertEqual(response.context['posts_count'], 2)
+        self.assertEqual(response.context['followers_count'], 2)
+        self.assertTrue(response.context['is_following'])
+
+
+@override_settings(
+    READ_REPLICAS={'ALIASES': ['replica1'], 'STICKY_SECONDS': 5},
+    DATABASE_ROUTERS=['core.replicas.ReplicaRouter'],
+)
+class ReplicaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer = seed_graph(users=3, posts_per_user=1)
+        self.router = ReplicaRouter()
+        self.state = RoutingState()
+        self.addCleanup(replicas._state.reset, replicas._state.set(self.state))
+        # Every TestCase runs in a transaction, which keeps reads on the primary
+        self.outside_transaction = mock.patch.object(connections['default'], 'in_atomic_block', False)
+
+    def test_databases_from_env(self):
+        base_dir = Path('/srv/dekogram')
+        databases = databases_from_env(base_dir, {
+            'DEKOGRAM_DATABASE_URL': 'postgres://app:p%40ss@db:6432/dekogram?sslmode=require',
+            'DEKOGRAM_REPLICA_URLS': 'postgres://app@replica-a/dekogram, postgres://app@replica-b/dekogram',
+            'DEKOGRAM_DB_POOL': '2:10',
+        })
+        default = databases['default']
+        self.assertEqual(default['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((default['USER'], default['PASSWORD'], default['HOST'], default['PORT']), ('app', 'p@ss', 'db', '6432'))
+        self.assertEqual(default['OPTIONS'], {'sslmode': 'require', 'pool': {'min_size': 2, 'max_size': 10}})
+        self.assertEqual(default['CONN_MAX_AGE'], 0)
+        self.assertEqual(list(databases), ['default', 'replica1', 'replica2'])
+        self.assertEqual(databases['replica2']['HOST'], 'replica-b')
+        self.assertEqual(databases['replica1']['TEST'], {'MIRROR': 'default'})
+
+        sqlite = databases_from_env(base_dir, {'DEKOGRAM_DB_CONN_MAX_AGE': '30'})['default']
+        self.assertEqual(sqlite['NAME'], base_dir / 'db.sqlite3')
+        self.assertEqual(sqlite['TEST']['NAME'], base_dir / 'test_db.sqlite3')
+        self.assertEqual(sqlite['CONN_MAX_AGE'], 30)
+
+    def test_reads_from_replica_until_the_request_writes(self):
+        read_from_replica(self.viewer)
+        with self.outside_transaction:
+            self.assertEqual(self.router.db_for_read(Post), 'replica1')
+            self.assertEqual(self.router.db_for_write(Post), 'default')
+            self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_reads_from_primary_inside_transactions(self):
+        read_from_replica(self.viewer)
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_recently_changed_content_reads_from_primary(self):
+        make_etag(['explore'])
+        read_from_replica(self.viewer)
+        make_etag(['explore'])
+        self.assertIsNone(self.state.alias)
+
+        cache.set('version:explore', f'{int((time.time() - 60) * 1000):x}.00000000')
+        read_from_replica(self.viewer)
+        make_etag(['explore'])
+        self.assertEqual(self.state.alias, 'replica1')
+
+    def test_writes_pin_the_user_to_the_primary(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        post = Post.objects.exclude(user=self.viewer).first()
+        client.get('/api/posts/')
+        self.assertIsNone(cache.get(replicas.pin_key(self.viewer.id)))
+        client.put(f'/api/posts/{post.id}/like/')
+        self.assertEqual(cache.get(replicas.pin_key(self.viewer.id)), 1)
+
+        read_from_replica(self.viewer)
+        self.assertIsNone(self.state.alias)
+
+
+class AsyncURLConf:
+    """The API with its read endpoints served by core.async_views, as under ASGI"""
+    urlpatterns = [path('api/', include(async_urls(router.urls)))]
+
+
+class AsyncViewTests(TestCase):
+    PATHS = [
+        '/api/posts/', '/api/posts/?page=2', '/api/posts/?expand=comments_preview',
+        '/api/posts/?type=explore&fields=id,media,user.username',
+        '/api/stories/', '/api/notifications/?fields=id,text', '/api/users/user1/',
+        '/api/users/user1/?fields=username,followers_count', '/api/users/search/?q=user',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = seed_graph(users=4, posts_per_user=6)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def get_async(self, url, **extra):
+        with override_settings(ROOT_URLCONF=AsyncURLConf):
+            return self.client.get(url, **extra)
+
+    def test_routes_reads_to_async_views(self):
+        with override_settings(ROOT_URLCONF=AsyncURLConf):
+            self.assertIsInstance(resolve('/api/posts/').func, PostList)
+
+    def test_responses_match_the_sync_views(self):
+        for url in self.PATHS:
+            with self.subTest(url=url):
+                expected = self.client.get(url)
+                response = self.get_async(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json(), expected.json())
+                self.assertEqual(response.get('ETag'), expected.get('ETag'))
+                self.assertEqual(response['Content-Type'], expected['Content-Type'])
+
+    def test_revalidates_with_sync_etags(self):
+        for url in ('/api/posts/', '/api/stories/', '/api/users/user1/'):
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(self.get_async(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_falls_back_to_sync_views(self):
+        self.assertEqual(self.get_async('/api/posts/?page=99').status_code, 404)
+        self.assertEqual(self.get_async('/api/users/nobody/').status_code, 404)
+        self.assertIn('text/html', self.get_async('/api/posts/', HTTP_ACCEPT='text/html')['Content-Type'])
+        with override_settings(ROOT_URLCONF=AsyncURLConf):
+            self.assertEqual(self.client.post('/api/posts/', {}).status_code, 400)
+            self.assertEqual(APIClient().get('/api/posts/').status_code, 401)
+
+    async def test_serves_asgi_requests_with_jwt(self):
+        headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.viewer).access_token}'}
+        client = AsyncClient()
+        with override_settings(ROOT_URLCONF=AsyncURLConf):
+            feed = await client.get('/api/posts/', headers=headers)
+            profile = await client.get('/api/users/user1/', headers=headers)
+        self.assertEqual(feed.status_code, 200)
+        self.assertEqual(feed.json()['count'], await Post.objects.acount())
+        self.assertEqual(profile.json()['followers_count'], 3)
+        self.assertTrue(profile.json()['is_following'])
+
+    async def test_loads_follow_sets_off_the_event_loop(self):
+        headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.viewer).access_token}'}
+        etag_response = AsyncListEndpoint.etag_response
+
+        async def then_expire(endpoint, view, keys):
+            result = await etag_response(endpoint, view, keys)
+            # Another request's follow invalidates the set between the ETag and the list
+            follow_cache.cache.clear()
+            return result
+
+        with mock.patch.object(follow_cache.cache, 'enabled', True), \
+                mock.patch.object(AsyncListEndpoint, 'etag_response', then_expire), \
+                override_settings(ROOT_URLCONF=AsyncURLConf):
+            feed = await AsyncClient().get('/api/posts/', headers=headers)
+            stories = await AsyncClient().get('/api/stories/', headers=headers)
+        self.addCleanup(follow_cache.cache.clear)
+        self.assertEqual(feed.status_code, 200)
+        self.assertEqual(feed.json()['count'], await Post.objects.acount())
+        self.assertEqual(stories.status_code, 200)
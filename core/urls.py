@@ -1,7 +1,8 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from . import views, urls_password
+from . import async_views, views, urls_password
 
 router = DefaultRouter()
 router.register(r'users', views.UserViewSet)
@@ -9,6 +10,11 @@ router.register(r'posts', views.PostViewSet, basename='post')
 router.register(r'stories', views.StoryViewSet, basename='story')
 router.register(r'notifications', views.NotificationViewSet, basename='notification')
 
+api_urls = router.urls
+if settings.ASYNC_API:
+    # Serve the read-heavy GETs with async views (core/async_views.py)
+    api_urls = async_views.async_urls(api_urls)
+
 urlpatterns = [
     # Template Views
     path('', views.feed_view, name='feed'),
@@ -20,9 +26,10 @@ urlpatterns = [
     path('logout/', views.logout_view, name='logout'),
     
     # API Endpoints
-    path('api/', include(router.urls)),
+    path('api/', include(api_urls)),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/interactions/batch/', views.InteractionBatchView.as_view(), name='interactions_batch'),
     
     # Password Reset
     path('password-reset/', views.password_reset_simple_view, name='password_reset'),
@@ -0,0 +1,105 @@
+"""
+Cheap content versions for conditional GETs.
+
+Each key names a slice of content that a response depends on. Signal
+handlers in ``core.signals`` bump a key whenever that content changes, and
+views hash the current versions into an ETag before touching the
+queryset. A version is a random token rather than a counter, so a key that
+was evicted from the cache can never come back with an old value. It
+starts with the time of the change, so requests can read content changed
+in the last few seconds from the primary rather than a lagging replica.
+
+Keys:
+    feed:<user_id>           the viewer's own state: follows, likes, saves, story views
+    author:<user_id>         posts by that user, their counts and the author's profile
+    post:<post_id>           one post and its counts
+    profile:<user_id>        a profile and its follower/following/post counts
+    stories:<user_id>        that user's stories and their view counts
+    notifications:<user_id>  the user's notifications
+    explore                  anything shown on the explore page
+
+The versions live in the default cache, which must be shared between
+worker processes (see ``CACHES`` in settings) for the ETags to be valid.
+Server processes (``start_versions()`` in wsgi.py/asgi.py) turn ETags off
+when it is not: with a per-process cache, one worker would answer 304 for
+content another worker has changed.
+"""
+import hashlib
+import logging
+import time
+import uuid
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction
+
+from . import replicas
+
+logger = logging.getLogger(__name__)
+
+VERSION_TIMEOUT = 60 * 60 * 24 * 7
+
+# Whether views send ETags; see start_versions()
+etags_enabled = True
+
+
+def start_versions():
+    """Turn ETags off in this server process unless the default cache is shared between processes"""
+    global etags_enabled
+    if isinstance(caches['default'], (LocMemCache, DummyCache)):
+        etags_enabled = False
+        logger.warning(
+            'ETags are off: the default cache is per-process. Set DEKOGRAM_REDIS_URL or DEKOGRAM_CACHE_DIR.'
+        )
+
+
+def _token():
+    return f'{int(time.time() * 1000):x}.{uuid.uuid4().hex[:8]}'
+
+
+def token_age(token):
+    """Seconds since the version was set; infinite for tokens without a time"""
+    stamp, dot, _ = token.partition('.')
+    if not dot:
+        return float('inf')
+    return time.time() - int(stamp, 16) / 1000
+
+
+def _set_new_versions(keys):
+    cache.set_many({f'version:{key}': _token() for key in keys}, VERSION_TIMEOUT)
+
+
+def bump(*keys):
+    """Give every key a fresh version"""
+    _set_new_versions(keys)
+    if connection.in_atomic_block:
+        # A reader may see the new version before the write commits and
+        # cache the old content under it; bump again once it is visible
+        transaction.on_commit(lambda: _set_new_versions(keys))
+
+
+def get_versions(keys):
+    """Current versions of ``keys`` in order, creating missing ones"""
+    names = [f'version:{key}' for key in keys]
+    found = cache.get_many(names)
+    missing = {name: _token() for name in names if name not in found}
+    if missing:
+        for name, token in missing.items():
+            # Another process may have created the key in the meantime
+            if not cache.add(name, token, VERSION_TIMEOUT):
+                missing[name] = cache.get(name, token)
+        found.update(missing)
+    return [found[name] for name in names]
+
+
+def make_etag(keys, *extra):
+    """A strong ETag over the versions of ``keys`` plus any extra parts"""
+    versions = get_versions(keys)
+    if versions:
+        replicas.changed_ago(min(token_age(token) for token in versions))
+    digest = hashlib.sha1()
+    for part in [*versions, *extra]:
+        digest.update(str(part).encode())
+        digest.update(b'\0')
+    return f'"{digest.hexdigest()}"'
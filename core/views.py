@@ -1,22 +1,41 @@
+import sys
+from functools import partial
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
-import json
 from django.http import JsonResponse
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Count
+from django.core.paginator import InvalidPage, Page, Paginator as DjangoPaginator
+from django.db.models import Q, Exists, F, JSONField, OuterRef, Value
 from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
 from rest_framework import viewsets, permissions, status, filters
 from rest_framework.decorators import action
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django_filters.rest_framework import DjangoFilterBackend
+from django.db import IntegrityError, transaction
 
+from . import availability, comment_previews, counters, fastjson, media, versions
+from .fanout import fan_out
+from .follow_cache import author_filter, followed_among, following_ids
+from .idempotency import idempotent
+from .interactions import apply_state, delete_matching_many, insert_ignore_many
+from .mentions import notify_mentions
+from .pagination import KeysetPagination
+from .ratelimit import LookupThrottle, rate_limit
+from .replicas import ReplicaReadMixin, replica_reads
+from .signals import batched_versions
+from .versions import bump, make_etag
 from .models import User, Post, Story, Comment, Like, Save, Follow, Notification, Report, StoryView
 from .serializers import (
-    UserShortSerializer, PostSerializer, StorySerializer, 
-    CommentSerializer, UserProfileSerializer, NotificationSerializer
+    UserShortSerializer, FollowUserSerializer, PostSerializer, StorySerializer, 
+    CommentSerializer, UserProfileSerializer, NotificationSerializer,
+    CompiledSerializer, InteractionBatchSerializer, parse_field_list
 )
 
 # Template Views (For the main shell)
@@ -33,29 +52,34 @@ def search_view(request):
     query = request.GET.get('q', '')
     return render(request, 'search.html', {'query': query})
 
+@replica_reads
 def profile_view(request, username):
     profile_user = get_object_or_404(User, username=username)
-    is_following = False
-    if request.user.is_authenticated:
-        is_following = Follow.objects.filter(follower=request.user, followed=profile_user).exists()
-    
-    posts = profile_user.posts.all().order_by('-created_at')
+    viewer = request.user
+    authenticated = viewer.is_authenticated
+    # Independent queries, run concurrently
+    data = fan_out(
+        posts=lambda: list(profile_user.posts.all().order_by('-created_at')),
+        is_following=lambda: authenticated and Follow.objects.filter(follower=viewer, followed=profile_user).exists(),
+        followers_count=profile_user.followers.count,
+        following_count=profile_user.following.count,
+    )
     
     context = {
         'user_profile': profile_user,
-        'posts': posts,
-        'posts_count': posts.count(),
-        'is_following': is_following,
+        'posts_count': len(data['posts']),
+        **data,
     }
     return render(request, 'profile.html', context)
 
+@rate_limit('login')
 def login_view(request):
     if request.user.is_authenticated:
         return redirect('feed')
         
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
+            data = fastjson.loads(request.body)
             username = data.get('username')
             password = data.get('password')
             
@@ -76,101 +100,373 @@ def login_view(request):
             
     return render(request, 'login.html')
 
+@rate_limit('register')
 def register_view(request):
     if request.user.is_authenticated:
         return redirect('feed')
         
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
-            username = data.get('username')
-            email = data.get('email')
-            password = data.get('password')
-            full_name = data.get('full_name', '')
-            
+            data = fastjson.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Expected a JSON object'}, status=400)
+        username = data.get('username')
+        email = data.get('email')
+        password = data.get('password')
+        if not (username and email and password):
+            return JsonResponse({'error': 'Username, email and password are required'}, status=400)
+
+        try:
+            # A single INSERT; the unique constraints catch names already taken
+            with transaction.atomic():
+                user = User.objects.create_user(
+                    username=username,
+                    email=email,
+                    password=password,
+                    full_name=data.get('full_name', ''),
+                )
+        except IntegrityError:
             if User.objects.filter(username=username).exists():
                 return JsonResponse({'error': 'Username already exists'}, status=400)
-            if User.objects.filter(email=email).exists():
-                return JsonResponse({'error': 'Email already exists'}, status=400)
-                
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=password,
-                full_name=full_name
-            )
-            login(request, user)
-            refresh = RefreshToken.for_user(user)
-            return JsonResponse({
-                'status': 'success',
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            })
-        except Exception as e:
-            return JsonResponse({'error': str(e)}, status=400)
-            
+            return JsonResponse({'error': 'Email already exists'}, status=400)
+        login(request, user)
+        refresh = RefreshToken.for_user(user)
+        return JsonResponse({
+            'status': 'success',
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        })
+
     return render(request, 'register.html')
 
 def logout_view(request):
     logout(request)
     return redirect('login')
 
+@rate_limit('login')
 def password_reset_simple_view(request):
     if request.user.is_authenticated:
         return redirect('feed')
         
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
+            data = fastjson.loads(request.body)
             identity = data.get('identity')
             new_password = data.get('password')
             
-            try:
-                user = User.objects.get(Q(username=identity) | Q(email=identity))
-                user.set_password(new_password)
-                user.save()
-                return JsonResponse({'status': 'success'})
-            except User.DoesNotExist:
+            # Two unique-index lookups rather than an OR over both columns
+            user = User.objects.filter(username=identity).first()
+            if user is None and '@' in identity:
+                user = User.objects.filter(email=identity).first()
+            if user is None:
                 return JsonResponse({'error': 'No account found with that username or email.'}, status=404)
+            user.set_password(new_password)
+            user.save()
+            return JsonResponse({'status': 'success'})
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
             
     return render(request, 'password_reset_simple.html')
 
 # API ViewSets
-class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+class SparseFieldsViewMixin:
+    """Tells get_queryset which serializer fields the response will render"""
+
+    def rendered_fields(self):
+        """Top-level fields of a list/retrieve response; empty for other actions"""
+        if self.action not in ('list', 'retrieve'):
+            return set()
+        if not hasattr(self, '_rendered_fields'):
+            self._rendered_fields = set(self.get_serializer().fields)
+        return self._rendered_fields
+
+
+def prefix_upper_bound(prefix):
+    """The least string after every string that starts with ``prefix``, or None if there is none"""
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if 0xD800 <= code <= 0xDFFF:
+            # Surrogates cannot be encoded for the database
+            code = 0xE000
+        if code <= sys.maxunicode:
+            return prefix[:-1] + chr(code)
+        # The last character is the largest there is, so only the rest bounds the range
+        prefix = prefix[:-1]
+    return None
+
+
+def feed_author_ids(view):
+    """The viewer and the users they follow, as loaded by the async view or from the follow cache"""
+    user = view.request.user
+    ids = view.following if view.following is not None else following_ids(user.id)
+    return [*ids, user.id]
+
+
+def rolling_minute():
+    """An ETag part that changes every minute"""
+    return timezone.now().strftime('%Y%m%d%H%M')
+
+
+class ConditionalGetMixin:
+    """
+    ETags for list/retrieve built from content versions (core/versions.py).
+    A matching If-None-Match is answered with 304 before the queryset runs.
+    Viewsets name the versions a response depends on in get_version_keys().
+    """
+
+    def get_version_keys(self):
+        """Version keys for the current action, or None for no ETag"""
+        return None
+
+    def get_etag_extra(self):
+        """Anything besides content versions that changes the response"""
+        return ()
+
+    def get_etag(self, request):
+        if not versions.etags_enabled:
+            return None
+        keys = self.get_version_keys()
+        if keys is None:
+            return None
+        return self.etag_for(request, keys)
+
+    def etag_for(self, request, keys):
+        # The same URL renders differently per viewer and per media type
+        return make_etag(
+            keys, request.user.id, request.get_full_path(), request.accepted_media_type, *self.get_etag_extra()
+        )
+
+    @staticmethod
+    def not_modified(request, etag):
+        """A 304 response if If-None-Match matches ``etag``, else None"""
+        if etag is None:
+            return None
+        # Weak comparison: GZip middleware hands out our ETags as W/"..."
+        if_none_match = {tag.removeprefix('W/') for tag in parse_etags(request.headers.get('If-None-Match', ''))}
+        if etag in if_none_match or '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return None
+
+    @staticmethod
+    def add_etag(response, etag):
+        if etag is not None and response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+            # Clients may keep the body but must revalidate before using it
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ('Authorization', 'Cookie'))
+        return response
+
+    def conditional(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        not_modified = self.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        return self.add_etag(handler(request, *args, **kwargs), etag)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+
+class CompiledListMixin(SparseFieldsViewMixin):
+    """
+    Serve list() from ``values()`` rows through a CompiledSerializer of the
+    viewset's serializer. Writes and detail views keep the full serializer.
+    """
+    MAX_COMPILED = 128
+    _compiled = None
+
+    @classmethod
+    def get_compiled_serializer(cls, fields=None, expand=None):
+        if cls._compiled is None or cls._compiled.get('serializer_class') is not cls.serializer_class:
+            cls._compiled = {'serializer_class': cls.serializer_class}
+        key = (tuple(fields) if fields is not None else None, tuple(expand or ()))
+        compiled = cls._compiled.get(key)
+        if compiled is None:
+            compiled = CompiledSerializer(cls.serializer_class, fields, expand)
+            # Field lists come from clients; don't let them grow the cache forever
+            if len(cls._compiled) <= cls.MAX_COMPILED:
+                cls._compiled[key] = compiled
+        return compiled
+
+    def list(self, request, *args, **kwargs):
+        query_params = request.query_params
+        fields = parse_field_list(query_params['fields']) if 'fields' in query_params else None
+        compiled = self.get_compiled_serializer(fields, parse_field_list(query_params.get('expand')))
+        try:
+            columns = compiled.columns
+        except TypeError:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values(*columns)
+        context = self.get_serializer_context()
+
+        page = self.paginate_rows(rows)
+        if page is not None:
+            return self.get_paginated_response(compiled.serialize(self.prepare_rows(page), context))
+        return Response(compiled.serialize(self.prepare_rows(list(rows)), context))
+
+    def paginate_rows(self, rows):
+        """paginate_queryset() with the page and the total count fetched concurrently"""
+        bounds = self.page_bounds()
+        if bounds is None:
+            return self.paginate_queryset(rows)
+        number, page_size = bounds
+        offset = (number - 1) * page_size
+        data = fan_out(results=lambda: list(rows[offset:offset + page_size]), count=rows.count)
+        page = self.set_page(rows, number, page_size, data['count'], data['results'])
+        # Out-of-range pages get paginate_queryset()'s 404
+        return page if page is not None else self.paginate_queryset(rows)
+
+    def page_bounds(self):
+        """(page number, page size) of a valid page-number request, else None"""
+        pagination = self.paginator
+        if not isinstance(pagination, PageNumberPagination):
+            return None
+        page_size = pagination.get_page_size(self.request)
+        try:
+            number = int(self.request.query_params.get(pagination.page_query_param, 1))
+        except ValueError:
+            return None
+        return (number, page_size) if page_size and number >= 1 else None
+
+    def set_page(self, rows, number, page_size, count, results):
+        """Hand an already fetched page to the paginator. Returns its rows, or None if it is out of range."""
+        paginator = DjangoPaginator(rows, page_size)
+        paginator.count = count
+        try:
+            paginator.validate_number(number)
+        except InvalidPage:
+            return None
+        self.paginator.page = Page(results, number, paginator)
+        self.paginator.request = self.request
+        return results
+
+    def prepare_rows(self, rows):
+        """Adjust the loaded ``values()`` rows before they are serialized"""
+        return rows
+
+class UserViewSet(ReplicaReadMixin, ConditionalGetMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = User.objects.order_by('id')
     serializer_class = UserProfileSerializer
     lookup_field = 'username'
+    replica_actions = ('retrieve', 'followers', 'following')
+    throttle_scopes = {'follow': 'follow'}
+
+    def get_version_keys(self):
+        if self.action != 'retrieve':
+            return None
+        user_id = User.objects.filter(username=self.kwargs['username']).values_list('id', flat=True).first()
+        # is_following depends on the viewer's own follows
+        return [f'profile:{user_id}', f'feed:{self.request.user.id}']
+
+    # Counts of a single profile, run as separate concurrent queries
+    PROFILE_COUNTS = {
+        'followers_count': lambda user: user.followers.count(),
+        'following_count': lambda user: user.following.count(),
+        'posts_count': lambda user: user.posts.count(),
+    }
 
     def get_queryset(self):
-        return User.objects.annotate(
-            followers_count=Count('followers', distinct=True),
-            following_count=Count('following', distinct=True),
-            posts_count=Count('posts', distinct=True)
-        )
+        # Only pay for the counts a response will actually render
+        fields = self.rendered_fields()
+        annotations = {}
+        if self.action != 'retrieve':
+            # One correlated count each; joining all three would multiply their rows
+            annotations = {
+                'followers_count': counters.count_of(Follow, 'followed'),
+                'following_count': counters.count_of(Follow, 'follower'),
+                'posts_count': counters.count_of(Post, 'user'),
+            }
+        if self.request.user.is_authenticated:
+            annotations['is_following'] = Exists(
+                Follow.objects.filter(followed=OuterRef('pk'), follower=self.request.user)
+            )
+        return User.objects.annotate(**{name: value for name, value in annotations.items() if name in fields}).order_by('id')
+
+    def get_object(self):
+        user = super().get_object()
+        if self.action == 'retrieve':
+            # Three joined COUNT(DISTINCT)s multiply each other's rows; separate counts do not
+            fields = self.rendered_fields()
+            counts = fan_out(**{
+                name: partial(count, user) for name, count in self.PROFILE_COUNTS.items() if name in fields
+            })
+            for name, value in counts.items():
+                setattr(user, name, value)
+        return user
+
+    @action(detail=False, permission_classes=[permissions.AllowAny], throttle_classes=[LookupThrottle])
+    def available(self, request):
+        """?username=: whether a new account could take it (a typeahead for sign-up)"""
+        # Not emails: anyone could test which addresses have accounts. Registration reports those.
+        username = request.query_params.get('username')
+        if not username:
+            return Response({'error': 'Pass ?username='}, status=status.HTTP_400_BAD_REQUEST)
+        free, error = availability.check(username)
+        data = {'username': username, 'available': free}
+        if error:
+            data['error'] = error
+        return Response(data)
 
-    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    @action(detail=True, methods=['post', 'put', 'delete'], permission_classes=[permissions.IsAuthenticated])
+    @idempotent
     def follow(self, request, username=None):
+        """PUT follows, DELETE unfollows, POST ?state=true|false sets; a bare POST toggles"""
         user_to_follow = self.get_object()
         if user_to_follow == request.user:
             return Response({'error': 'You cannot follow yourself'}, status=status.HTTP_400_BAD_REQUEST)
         
-        follow, created = Follow.objects.get_or_create(follower=request.user, followed=user_to_follow)
-        
-        if not created:
-            follow.delete()
+        state, created = apply_state(request, Follow(follower=request.user, followed=user_to_follow))
+        if not state:
             return Response({'status': 'unfollowed'})
         
         # Create notification
-        Notification.objects.create(
-            user=user_to_follow,
-            from_user=request.user,
-            notification_type='follow',
-            text=f'{request.user.username} started following you'
-        )
+        if created:
+            Notification.objects.create(
+                user=user_to_follow,
+                from_user=request.user,
+                notification_type='follow',
+                text=f'{request.user.username} started following you'
+            )
         return Response({'status': 'followed'})
 
+    @action(detail=True, methods=['get'])
+    def followers(self, request, username=None):
+        """Who follows this user, newest first; ?q= keeps usernames starting with it"""
+        return self.follow_list(request, Follow.objects.filter(followed=self.get_object()), 'follower')
+
+    @action(detail=True, methods=['get'])
+    def following(self, request, username=None):
+        """Whom this user follows, newest first; ?q= keeps usernames starting with it"""
+        return self.follow_list(request, Follow.objects.filter(follower=self.get_object()), 'followed')
+
+    def follow_list(self, request, follows, side):
+        prefix = request.query_params.get('q', '')
+        if prefix:
+            # A range rather than LIKE, so the username index finds the matches
+            follows = follows.filter(**{f'{side}__username__gte': prefix})
+            upper = prefix_upper_bound(prefix)
+            if upper is not None:
+                follows = follows.filter(**{f'{side}__username__lt': upper})
+            paginator = KeysetPagination(ordering=(f'{side}__username',))
+        else:
+            paginator = KeysetPagination(ordering=('-created_at', '-id'))
+        page = paginator.paginate_queryset(follows.select_related(side), request, view=self)
+        users = [getattr(follow, side) for follow in page]
+        followed = followed_among(request.user.id, [user.id for user in users])
+        for follow, user in zip(page, users):
+            user.followed_at = follow.created_at
+            user.is_following = user.id in followed
+        serializer = FollowUserSerializer(users, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
     @action(detail=False, methods=['get'])
     def search(self, request):
         query = request.query_params.get('q', '')
@@ -180,89 +476,205 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = UserShortSerializer(users, many=True)
         return Response(serializer.data)
 
-class PostViewSet(viewsets.ModelViewSet):
+class PostViewSet(ReplicaReadMixin, ConditionalGetMixin, CompiledListMixin, viewsets.ModelViewSet):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scopes = {'create': 'upload', 'like': 'like', 'save_post': 'like', 'comments': 'comment'}
+    # The ids the viewer follows, when the async view has loaded them
+    following = None
+
+    def get_version_keys(self):
+        user = self.request.user
+        if self.action == 'retrieve':
+            try:
+                author_id = Post.objects.filter(pk=self.kwargs['pk']).values_list('user_id', flat=True).first()
+            except ValueError:
+                return None
+            return [f'post:{self.kwargs["pk"]}', f'author:{author_id}', f'feed:{user.id}']
+        if self.action != 'list':
+            return None
+        if self.request.query_params.get('type') == 'explore':
+            return ['explore', f'feed:{user.id}']
+        # Read from the authors' versions, so a post bumps one key however many follow its author
+        return [f'feed:{user.id}'] + [f'author:{author_id}' for author_id in feed_author_ids(self)]
 
     def get_queryset(self):
         query_type = self.request.query_params.get('type', 'feed')
+        user = self.request.user
+        
+        # Counts and per-viewer flags are annotated so a page costs the same
+        # number of queries regardless of its size, and only when rendered
+        fields = self.rendered_fields()
+        annotations = {
+            'likes_count': F('like_count'),
+            'comments_count': F('comment_count'),
+            'is_liked': Exists(Like.objects.filter(post=OuterRef('pk'), user=user)),
+            'is_saved': Exists(Save.objects.filter(post=OuterRef('pk'), user=user)),
+        }
+        queryset = Post.objects.annotate(**{name: value for name, value in annotations.items() if name in fields})
+        if 'comments_preview' in fields:
+            # A placeholder column for the compiled serializer; prepare_rows() fills it from the cache
+            queryset = queryset.annotate(comments_preview=Value(None, output_field=JSONField()))
+        if 'user' in fields:
+            queryset = queryset.select_related('user')
         
         if query_type == 'explore':
             # Trending/Explore: show all users' videos as requested
-            return Post.objects.select_related('user').prefetch_related('likes', 'comments').filter(media_type='video').order_by('-created_at')
+            return queryset.filter(media_type='video').order_by('-created_at')
         
         # Default Feed: followed users + own posts
-        following_ids = self.request.user.following.values_list('followed_id', flat=True)
-        return Post.objects.select_related('user').prefetch_related('likes', 'comments').filter(
-            Q(user_id__in=following_ids) | Q(user=self.request.user)
-        ).order_by('-created_at')
+        return queryset.filter(author_filter(user, ids=self.following)).order_by('-created_at')
+
+    # Response field -> counter column, for adding this process's buffered deltas
+    PENDING_COUNTS = {'likes_count': 'like_count', 'comments_count': 'comment_count'}
+
+    def prepare_rows(self, rows):
+        if rows and 'comments_preview' in rows[0]:
+            previews = comment_previews.previews([row['id'] for row in rows], self.get_serializer_context())
+            for row in rows:
+                row['comments_preview'] = previews[row['id']]
+        return counters.merge_pending(rows, Post, self.PENDING_COUNTS)
+
+    def get_object(self):
+        post = super().get_object()
+        counters.merge_pending([post], Post, self.PENDING_COUNTS)
+        if 'comments_preview' in self.rendered_fields():
+            post.comments_preview = comment_previews.previews([post.id], self.get_serializer_context())[post.id]
+        return post
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        post = serializer.save(user=self.request.user)
+        if post.media_type == 'video':
+            # Duration, size and poster are filled in off the request
+            media.process_later(post)
+        notify_mentions(post.caption, self.request.user, post)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post', 'put', 'delete'])
+    @idempotent
     def like(self, request, pk=None):
+        """PUT likes, DELETE unlikes, POST ?state=true|false sets; a bare POST toggles"""
         post = self.get_object()
-        like, created = Like.objects.get_or_create(user=request.user, post=post)
+        state, created = apply_state(request, Like(user=request.user, post=post))
         
-        if not created:
-            like.delete()
-            return Response({'status': 'unliked', 'likes_count': post.likes.count()})
+        if not state:
+            return Response({'status': 'unliked', 'likes_count': counters.current(Post, post.pk, 'like_count')})
         
         # Notify
-        if post.user != request.user:
+        if created and post.user_id != request.user.id:
             Notification.objects.create(
-                user=post.user,
+                user_id=post.user_id,
                 from_user=request.user,
                 notification_type='like',
                 post=post,
                 text=f'{request.user.username} liked your post'
             )
-        return Response({'status': 'liked', 'likes_count': post.likes.count()})
+        return Response({'status': 'liked', 'likes_count': counters.current(Post, post.pk, 'like_count')})
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post', 'put', 'delete'])
+    @idempotent
     def save_post(self, request, pk=None):
+        """PUT saves, DELETE unsaves, POST ?state=true|false sets; a bare POST toggles"""
         post = self.get_object()
-        save, created = Save.objects.get_or_create(user=request.user, post=post)
-        if not created:
-            save.delete()
-            return Response({'status': 'unsaved'})
-        return Response({'status': 'saved'})
+        state, _ = apply_state(request, Save(user=request.user, post=post))
+        return Response({'status': 'saved' if state else 'unsaved'})
 
     @action(detail=True, methods=['get', 'post'])
     def comments(self, request, pk=None):
+        """
+        GET pages through the top-level comments, newest first, or with
+        ?parent=<id> through that comment's replies, oldest first. POST
+        with an optional ``parent`` replies; replies to a reply join the
+        reply's thread.
+        """
         post = self.get_object()
         if request.method == 'POST':
             text = request.data.get('text')
-            comment = Comment.objects.create(user=request.user, post=post, text=text)
+            parent = None
+            if request.data.get('parent') is not None:
+                parent = self.comment_thread(post, request.data['parent'])
+                if parent is None:
+                    return Response({'error': 'No such comment on this post'}, status=status.HTTP_400_BAD_REQUEST)
+            comment = Comment.objects.create(user=request.user, post=post, parent=parent, text=text)
             # Notify
-            if post.user != request.user:
+            if post.user_id != request.user.id:
                 Notification.objects.create(
-                    user=post.user,
+                    user_id=post.user_id,
                     from_user=request.user,
                     notification_type='comment',
                     post=post,
                     text=f'{request.user.username} commented: {text[:20]}...'
                 )
+            # The post's author already has the comment notification
+            notify_mentions(text, request.user, post, where='a comment', skip=[post.user_id])
             serializer = CommentSerializer(comment)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         
-        comments = post.comments.all()
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data)
+        if 'parent' in request.query_params:
+            parent = self.comment_thread(post, request.query_params['parent'])
+            if parent is None:
+                return Response({'error': 'No such comment on this post'}, status=status.HTTP_404_NOT_FOUND)
+            comments = parent.replies.all()
+            paginator = KeysetPagination(ordering=('created_at', 'id'))
+        else:
+            comments = post.comments.filter(parent=None)
+            paginator = KeysetPagination(ordering=('-created_at', '-id'))
+        page = paginator.paginate_queryset(comments.select_related('user'), request, view=self)
+        counters.merge_pending(page, Comment, {'reply_count': 'reply_count'})
+        serializer = CommentSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
 
-class StoryViewSet(viewsets.ModelViewSet):
+    @staticmethod
+    def comment_thread(post, comment_id):
+        """The top-level comment of the thread ``comment_id`` belongs to, if it is on ``post``"""
+        try:
+            comment = post.comments.only('id', 'post_id', 'parent_id').get(pk=comment_id)
+        except (Comment.DoesNotExist, ValueError, TypeError):
+            return None
+        return Comment(pk=comment.parent_id, post=post) if comment.parent_id else comment
+
+class StoryViewSet(ReplicaReadMixin, ConditionalGetMixin, CompiledListMixin, viewsets.ModelViewSet):
     serializer_class = StorySerializer
     permission_classes = [permissions.IsAuthenticated]
+    throttle_scopes = {'create': 'upload'}
+    # The ids the viewer follows, when the async view has loaded them
+    following = None
+
+    def get_version_keys(self):
+        if self.action not in ('list', 'retrieve'):
+            return None
+        user = self.request.user
+        return [f'feed:{user.id}'] + [f'stories:{author_id}' for author_id in feed_author_ids(self)]
+
+    def get_etag_extra(self):
+        # Stories expire without a write, so the ETag also rolls over every minute
+        return (rolling_minute(),)
 
     def get_queryset(self):
         # Active stories from followed users + own
-        following_ids = list(self.request.user.following.values_list('followed_id', flat=True)) + [self.request.user.id]
-        return Story.objects.filter(
-            user_id__in=following_ids,
+        user = self.request.user
+        fields = self.rendered_fields()
+        annotations = {
+            'views_count': F('view_count'),
+            'is_viewed': Exists(StoryView.objects.filter(story=OuterRef('pk'), user=user)),
+        }
+        queryset = Story.objects.annotate(**{name: value for name, value in annotations.items() if name in fields})
+        if 'user' in fields:
+            queryset = queryset.select_related('user')
+        return queryset.filter(
+            author_filter(user, ids=self.following),
             expires_at__gt=timezone.now()
         ).order_by('-created_at')
 
+    PENDING_COUNTS = {'views_count': 'view_count'}
+
+    def prepare_rows(self, rows):
+        return counters.merge_pending(rows, Story, self.PENDING_COUNTS)
+
+    def get_object(self):
+        story = super().get_object()
+        counters.merge_pending([story], Story, self.PENDING_COUNTS)
+        return story
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
@@ -272,14 +684,98 @@ class StoryViewSet(viewsets.ModelViewSet):
         StoryView.objects.get_or_create(story=story, user=request.user)
         return Response({'status': 'viewed'})
 
-class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+class NotificationViewSet(ConditionalGetMixin, CompiledListMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_version_keys(self):
+        return [f'notifications:{self.request.user.id}']
+
     def get_queryset(self):
-        return self.request.user.notifications.all().order_by('-created_at')
+        queryset = self.request.user.notifications.order_by('-created_at')
+        if 'from_user' in self.rendered_fields():
+            queryset = queryset.select_related('from_user')
+        return queryset
 
     @action(detail=False, methods=['post'])
     def mark_all_read(self, request):
         request.user.notifications.filter(is_read=False).update(is_read=True)
+        # update() sends no signals
+        bump(f'notifications:{request.user.id}')
         return Response({'status': 'read'})
+
+
+class InteractionBatchView(APIView):
+    """
+    Apply an ordered list of set-state operations in one request, e.g.
+    ``{"ops": [{"type": "like", "id": 12, "state": true}, {"type": "view", "id": 5, "state": true}]}``.
+    Operations are idempotent and the last one for a target wins. Posts and
+    stories the user cannot see are skipped and reported as not applied.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_scope = 'interactions'
+
+    def post(self, request):
+        serializer = InteractionBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = request.user
+
+        final = {}
+        for op in serializer.validated_data['ops']:
+            # Move repeated targets to the position of their last operation
+            final.pop((op['type'], op['id']), None)
+            final[(op['type'], op['id'])] = op['state']
+
+        authors = author_filter(user)
+        post_ids = [target for kind, target in final if kind != 'view']
+        story_ids = [target for kind, target in final if kind == 'view']
+        posts = dict(Post.objects.filter(
+            authors | Q(media_type='video'), pk__in=post_ids
+        ).values_list('id', 'user_id')) if post_ids else {}
+        stories = dict(Story.objects.filter(
+            authors, pk__in=story_ids, expires_at__gt=timezone.now()
+        ).values_list('id', 'user_id')) if story_ids else {}
+
+        def targets(kind, state):
+            known = stories if kind == 'view' else posts
+            return [target for (k, target), s in final.items() if k == kind and s == state and target in known]
+
+        like_ids, unlike_ids = targets('like', True), targets('like', False)
+        save_ids, unsave_ids = targets('save', True), targets('save', False)
+        view_ids = targets('view', True)
+
+        # Only the rows a statement reports as inserted or deleted send signals, which count them
+        # (a concurrent batch may have written the same ones); counter writes and version
+        # bumps are sent inside the transaction
+        with transaction.atomic(), batched_versions() as versions:
+            new_likes = insert_ignore_many([Like(user=user, post_id=post_id) for post_id in like_ids])
+            notify = [like.post_id for like in new_likes if posts[like.post_id] != user.id]
+            Notification.objects.bulk_create([
+                Notification(
+                    user_id=posts[post_id], from_user=user, notification_type='like',
+                    post_id=post_id, text=f'{user.username} liked your post',
+                )
+                for post_id in notify
+            ])
+            versions.add(*(f'notifications:{posts[post_id]}' for post_id in notify))
+            delete_matching_many([Like(user=user, post_id=post_id) for post_id in unlike_ids])
+            insert_ignore_many([Save(user=user, post_id=post_id) for post_id in save_ids])
+            delete_matching_many([Save(user=user, post_id=post_id) for post_id in unsave_ids])
+            insert_ignore_many([StoryView(user=user, story_id=story_id) for story_id in view_ids])
+
+        counted = like_ids + unlike_ids
+        likes_count = {
+            row['id']: row['likes_count']
+            for row in counters.merge_pending(
+                Post.objects.filter(pk__in=counted).values('id', likes_count=F('like_count')),
+                Post, {'likes_count': 'like_count'},
+            )
+        } if counted else {}
+        results = [
+            {'type': kind, 'id': target, 'state': state, 'applied': target in (stories if kind == 'view' else posts)}
+            for (kind, target), state in final.items()
+        ]
+        return Response({
+            'results': results,
+            'likes_count': {post_id: likes_count.get(post_id, 0) for post_id in counted},
+        })
@@ -12,5 +12,19 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dekogram_project.settings')
+os.environ.setdefault('DEKOGRAM_ASYNC_API', '1')
 
 application = get_asgi_application()
+
+# Buffer like/comment/view counters, cache follow sets, filter taken names
+# and check the ETag cache in server processes (core/counters.py,
+# core/follow_cache.py, core/availability.py, core/versions.py)
+from core.counters import start_flusher  # noqa: E402
+from core.follow_cache import start_follow_cache  # noqa: E402
+from core.availability import start_name_filter  # noqa: E402
+from core.versions import start_versions  # noqa: E402
+
+start_flusher()
+start_follow_cache()
+start_name_filter()
+start_versions()
@@ -63,11 +63,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.compression.StaticFilesMiddleware',
+    'core.compression.APIGZipMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS must be before CommonMiddleware
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.replicas.ReplicaMiddleware',
+    'core.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -97,13 +101,59 @@ WSGI_APPLICATION = 'dekogram_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+from .databases import databases_from_env
+
+# SQLite db.sqlite3 unless DEKOGRAM_DATABASE_URL says otherwise; see
+# dekogram_project/databases.py for Postgres, pooling and replicas
+DATABASES = databases_from_env(BASE_DIR)
+
+# Feed, explore, stories and profile GETs read from a random replica, but
+# from the primary for users who wrote and for content that changed within
+# STICKY_SECONDS (core/replicas.py). Keep it above the replication lag.
+READ_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'STICKY_SECONDS': float(os.environ.get('DEKOGRAM_REPLICA_STICKY_SECONDS', 5)),
+}
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter'] if READ_REPLICAS['ALIASES'] else []
+
+# Pragmas run on every SQLite connection (core/sqlite.py): WAL, relaxed
+# fsyncs, memory-mapped reads and a busy timeout instead of lock errors
+SQLITE = {
+    'TUNE': os.environ.get('DEKOGRAM_SQLITE_TUNING', '1') == '1',
+    'JOURNAL_MODE': 'WAL',
+    'SYNCHRONOUS': 'NORMAL',
+    'MMAP_SIZE': 256 * 1024 * 1024,  # bytes
+    'CACHE_SIZE': -32 * 1024,  # negative: KiB per connection
+    'BUSY_TIMEOUT': 10000,  # milliseconds
+    'TEMP_STORE': 'MEMORY',
 }
 
+# Cache. It also holds the content versions behind the API's ETags
+# (core/versions.py), so every worker process must see the same cache:
+# local memory is only right for a single process. Set DEKOGRAM_REDIS_URL
+# or DEKOGRAM_CACHE_DIR when running several gunicorn workers.
+if os.environ.get('DEKOGRAM_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['DEKOGRAM_REDIS_URL'],
+        }
+    }
+elif os.environ.get('DEKOGRAM_CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ['DEKOGRAM_CACHE_DIR'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'dekogram',
+        }
+    }
+
 # Custom User Model
 AUTH_USER_MODEL = 'core.User'
 
@@ -142,6 +192,62 @@ STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# collectstatic fingerprints files (app.<hash>.js) and precompresses them to
+# .gz/.br; core.compression.StaticFilesMiddleware serves the result
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'core.compression.CompressedManifestStaticFilesStorage',
+    },
+}
+
+# Response compression (see core/compression.py)
+COMPRESSION = {
+    'API_MIN_LENGTH': 1024,  # smaller JSON responses are sent uncompressed
+    'STATIC_MAX_AGE': 60,  # seconds, for static files without a content hash
+}
+
+# Async views for the read-heavy API endpoints (core/async_views.py). asgi.py
+# turns this on; under WSGI the sync views are cheaper.
+ASYNC_API = os.environ.get('DEKOGRAM_ASYNC_API') == '1'
+
+# Like, comment and story view counters (core/counters.py). Server processes
+# buffer the increments and write them every FLUSH_INTERVAL seconds.
+COUNTERS = {
+    'WRITE_BEHIND': True,
+    'FLUSH_INTERVAL': 0.25,  # seconds
+}
+
+# Independent queries of one request (profile page, list page and count) run
+# concurrently on a pool of this many threads (core/fanout.py); 0 disables it.
+FANOUT = {
+    'MAX_WORKERS': 8,
+}
+
+# Followed ids per user, cached in each server process (core/follow_cache.py)
+# and invalidated across the host's workers over Unix sockets
+FOLLOW_CACHE = {
+    'MAX_BYTES': 16 * 1024 * 1024,
+    'TTL': 300,  # seconds, in case an invalidation is lost
+    'IN_LIST_MAX': 500,  # larger sets are filtered with a subquery
+    'BUS': 'socket',
+}
+
+# Bloom filter of taken usernames and emails behind /api/users/available/
+# (core/availability.py)
+NAME_FILTER = {
+    'ERROR_RATE': 0.01,
+    'TTL': 600,  # seconds between rebuilds from the users table
+}
+
+# @mentions in captions and comments (core/mentions.py); later names in a
+# message are ignored
+MENTIONS = {
+    'MAX_PER_MESSAGE': 10,
+}
+
 # Media files (User uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -149,12 +255,27 @@ MEDIA_ROOT = BASE_DIR / 'media'
 # REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
+        # simplejwt's and DRF's classes, with the user read from the cache
+        'core.authentication.CachedJWTAuthentication',
+        'core.authentication.CachedSessionAuthentication',
+    ),
+    # orjson-backed JSON; falls back to the stdlib when orjson is missing
+    'DEFAULT_RENDERER_CLASSES': (
+        'core.fastjson.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'core.fastjson.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # Token buckets for the write endpoints, see RATE_LIMITS
+    'DEFAULT_THROTTLE_CLASSES': (
+        'core.ratelimit.TokenBucketThrottle',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_FILTER_BACKENDS': (
@@ -162,9 +283,49 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ),
+    # Reverse proxies in front of the app, each appending to X-Forwarded-For.
+    # Rate limits take the client IP that many entries from the end; with 0
+    # the header is ignored, so clients cannot pick their own IP.
+    'NUM_PROXIES': int(os.environ.get('DEKOGRAM_NUM_PROXIES', 0)),
+}
+
+# Token-bucket limits on writes (core/ratelimit.py): a burst of N that
+# refills over the period, per user, or per IP for the sign-in forms.
+# 'cache' shares the buckets between workers through the default cache.
+RATE_LIMITS = {
+    'ENABLED': os.environ.get('DEKOGRAM_RATE_LIMITS', '1') != '0',
+    'BACKEND': 'cache' if os.environ.get('DEKOGRAM_REDIS_URL') else 'locmem',
+    'SCOPES': {
+        'like': '120/min',  # likes and saves
+        'interactions': '30/min',  # batches of up to 200 likes, saves and views
+        'comment': '30/min',
+        'follow': '60/min',
+        'upload': '20/hour',  # posts and stories
+        'login': '10/min',  # also password resets
+        'register': '5/hour',
+        'lookup': '20/min',  # username availability, per IP when signed out
+    },
+}
+
+# Request profiling (see core/profiling.py). Staff can profile a single
+# request with ?_profile=cprofile or ?_profile=sample at any time; the
+# continuous per-view sampler is opt-in.
+PROFILING = {
+    'OUTPUT_DIR': BASE_DIR / 'profiles',
+    'CONTINUOUS': os.environ.get('DEKOGRAM_CONTINUOUS_PROFILING') == '1',
+    'SAMPLE_INTERVAL': 0.005,  # seconds between stack samples
+    'SAMPLE_RATE': 1.0,  # fraction of requests sampled in continuous mode
+    'FLUSH_INTERVAL': 30,  # seconds between writes of the aggregated file
 }
 
 from datetime import timedelta
+
+# How long a write's Idempotency-Key is remembered (core/idempotency.py)
+IDEMPOTENCY_KEY_TTL = timedelta(hours=1)
+
+# Seconds the API keeps a signed-in user's row cached (core/authentication.py)
+AUTH_USER_CACHE_TTL = 60
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
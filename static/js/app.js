@@ -170,6 +170,10 @@ async function loadStories() {
         data.results?.forEach(story => {
             const div = document.createElement('div');
             div.className = 'story-item';
+            div.onclick = () => {
+                div.querySelector('.story-avatar').classList.remove('avatar-story');
+                interactions.add('view', story.id, true);
+            };
             div.innerHTML = `
                 <div class="story-avatar ${story.is_viewed ? '' : 'avatar-story'}">
                     <div class="avatar avatar-lg">
@@ -191,7 +195,7 @@ async function loadFeed() {
     if (loader) loader.style.display = 'flex';
 
     try {
-        const res = await api.fetch(`/api/posts/?page=${currentPage}`);
+        const res = await api.fetch(`/api/posts/?page=${currentPage}&expand=comments_preview`);
         const data = await res.json();
         const container = document.getElementById('feedContainer');
         if (!container) return;
@@ -224,9 +228,9 @@ function createPostElement(post) {
                 </div>
                 <div>
                     <div class="post-username pointer" onclick="window.location.href='/profile/${post.user.username}/'">
-                        ${post.user.username} ${post.user.is_verified ? '<i class="fas fa-check-circle verified-badge"></i>' : ''}
+                        ${escapeHtml(post.user.username)} ${post.user.is_verified ? '<i class="fas fa-check-circle verified-badge"></i>' : ''}
                     </div>
-                    ${post.location ? `<div class="post-location">${post.location}</div>` : ''}
+                    ${post.location ? `<div class="post-location">${escapeHtml(post.location)}</div>` : ''}
                 </div>
             </div>
             <button class="post-menu-btn"><i class="fas fa-ellipsis-h"></i></button>
@@ -234,7 +238,7 @@ function createPostElement(post) {
         
         <div class="post-media">
             ${post.media_type === 'video'
-            ? `<video src="${post.media}" controls></video>`
+            ? `<video src="${post.media}" controls ${post.poster ? `poster="${post.poster}" preload="none"` : ''}></video>`
             : `<img src="${post.media}" alt="Post">`}
         </div>
         
@@ -258,13 +262,18 @@ function createPostElement(post) {
         </div>
         
         <div class="post-caption">
-            <span class="caption-username">${post.user.username}</span> ${post.caption}
+            <span class="caption-username">${escapeHtml(post.user.username)}</span> ${escapeHtml(post.caption)}
         </div>
         
         <div class="view-comments pointer" onclick="showToast('Comments coming soon', 'info')">
             View all ${post.comments_count} comments
         </div>
         
+        ${(post.comments_preview || []).map(comment => `
+        <div class="post-caption">
+            <span class="caption-username">${escapeHtml(comment.user.username)}</span> ${escapeHtml(comment.text)}
+        </div>`).join('')}
+        
         <div class="post-time">${timeAgo}</div>
         
         <div class="add-comment">
@@ -357,18 +366,58 @@ async function submitPost() {
 }
 
 // Interactions
-async function toggleLike(postId) {
-    try {
-        const res = await api.fetch(`/api/posts/${postId}/like/`, { method: 'POST' });
-        const data = await res.json();
-        const card = document.querySelector(`[data-post-id="${postId}"]`);
-        const btn = card.querySelector('.action-btn');
-        const count = document.getElementById(`likes-${postId}`);
+// Likes, saves and story views are buffered and sent together to
+// /api/interactions/batch/. Each operation sets a state, so a lost or
+// repeated batch can't flip anything back.
+const interactions = {
+    queue: [],
+    timer: null,
+    delay: 300,
+
+    add(type, id, state) {
+        this.queue.push({ type, id, state });
+        clearTimeout(this.timer);
+        this.timer = setTimeout(() => this.flush(), this.delay);
+    },
+
+    async flush(keepalive = false) {
+        clearTimeout(this.timer);
+        if (!this.queue.length) return;
+        const ops = this.queue.splice(0);
+        try {
+            const res = await api.fetch('/api/interactions/batch/', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ops }),
+                keepalive
+            });
+            if (!res.ok) return;
+            const data = await res.json();
+            Object.entries(data.likes_count || {}).forEach(([postId, count]) => {
+                const el = document.getElementById(`likes-${postId}`);
+                if (el) el.textContent = count;
+            });
+        } catch (e) {
+            // Put the operations back; replaying them is harmless
+            this.queue.unshift(...ops);
+        }
+    }
+};
 
-        btn.classList.toggle('liked', data.status === 'liked');
-        btn.querySelector('i').className = data.status === 'liked' ? 'fas fa-heart' : 'far fa-heart';
-        count.textContent = data.likes_count;
-    } catch (e) { }
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'hidden') interactions.flush(true);
+});
+
+function toggleLike(postId) {
+    const card = document.querySelector(`[data-post-id="${postId}"]`);
+    const btn = card.querySelector('.action-btn');
+    const count = document.getElementById(`likes-${postId}`);
+    const liked = !btn.classList.contains('liked');
+
+    btn.classList.toggle('liked', liked);
+    btn.querySelector('i').className = liked ? 'fas fa-heart' : 'far fa-heart';
+    count.textContent = Math.max(0, parseInt(count.textContent, 10) + (liked ? 1 : -1));
+    interactions.add('like', postId, liked);
 }
 
 async function postComment(postId) {
@@ -385,19 +434,25 @@ async function postComment(postId) {
     } catch (e) { }
 }
 
-async function toggleSave(postId) {
-    try {
-        const res = await api.fetch(`/api/posts/${postId}/save_post/`, { method: 'POST' });
-        const data = await res.json();
-        const card = document.querySelector(`[data-post-id="${postId}"]`);
-        const btn = card.querySelectorAll('.action-btn')[3];
-        btn.classList.toggle('saved', data.status === 'saved');
-        btn.querySelector('i').className = data.status === 'saved' ? 'fas fa-bookmark' : 'far fa-bookmark';
-        showToast(data.status === 'saved' ? 'Saved' : 'Removed', 'info');
-    } catch (e) { }
+function toggleSave(postId) {
+    const card = document.querySelector(`[data-post-id="${postId}"]`);
+    const btn = card.querySelectorAll('.action-btn')[3];
+    const saved = !btn.classList.contains('saved');
+    btn.classList.toggle('saved', saved);
+    btn.querySelector('i').className = saved ? 'fas fa-bookmark' : 'far fa-bookmark';
+    showToast(saved ? 'Saved' : 'Removed', 'info');
+    interactions.add('save', postId, saved);
 }
 
 // Utils
+// Captions, comments and names are user text; escape them before they go
+// into an innerHTML template.
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text ?? '';
+    return div.innerHTML;
+}
+
 function getTimeAgo(date) {
     const seconds = Math.floor((new Date() - date) / 1000);
     if (seconds < 60) return 'Just now';